@@ -0,0 +1,19 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests import SavepointCase
+
+
+class TestFiscalOperationDashboard(SavepointCase):
+    def test_dashboard_counters(self):
+        """The grouped counters count the invoices, as the dashboard actions"""
+        operations = self.env["l10n_br_fiscal.operation"].search([])
+        counters = operations._get_dashboard_counters()
+        for operation in operations:
+            self.assertEqual(
+                counters[operation.id],
+                {
+                    "number_2confirm": operation._get_number_2confirm_documents(),
+                    "number_authorized": operation._get_authorized_documents(),
+                    "number_cancelled": operation._get_cancelled_documents(),
+                },
+            )
@@ -88,6 +88,8 @@
         "views/l10n_br_fiscal_action.xml",
         # Menus
         "views/l10n_br_fiscal_menu.xml",
+        # Wizards
+        "wizards/ibpt_import_wizard.xml",
     ],
     "demo": [
         # Some demo data is being loaded via post_init_hook in hook file
@@ -528,3 +528,15 @@ FISCAL_PAYMENT_MODE = [
     ("90", "90 - Sem Pagamento"),
     ("99", "99 - Outros"),
 ]
+
+TAX_ENGINE_LINE = "line"
+TAX_ENGINE_DOCUMENT = "document"
+TAX_ENGINE_VALIDATE = "validate"
+
+TAX_ENGINE = [
+    (TAX_ENGINE_LINE, "Line by Line"),
+    (TAX_ENGINE_DOCUMENT, "By Document"),
+    (TAX_ENGINE_VALIDATE, "Line by Line, validating the Document engine"),
+]
+
+TAX_ENGINE_DEFAULT = TAX_ENGINE_LINE
@@ -2,11 +2,305 @@
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
 import logging
+import os
 
 from odoo import SUPERUSER_ID, _, api, tools
+from odoo.models import MAGIC_COLUMNS
 
 _logger = logging.getLogger(__name__)
 
+# Reference tables loaded with COPY instead of the ORM, see load_fiscal_csv
+BULK_CSV_MODELS = (
+    "l10n_br_fiscal.ncm",
+    "l10n_br_fiscal.nbm",
+    "l10n_br_fiscal.nbs",
+    "l10n_br_fiscal.cest",
+    "l10n_br_fiscal.cnae",
+)
+
+# Models whose ncm_ids are derived from the ncms column (action_search_ncms)
+BULK_CSV_NCM_RELATIONS = {
+    "l10n_br_fiscal.nbm": ("fiscal_nbm_ncm_rel", "nbm_id"),
+    "l10n_br_fiscal.cest": ("fiscal_cest_ncm_rel", "cest_id"),
+}
+
+
+def _csv_value_sql(field, column):
+    if field.type == "boolean":
+        return f"COALESCE({column} IN ('True', 'true', '1'), FALSE)"
+    if field.type == "integer":
+        return f"NULLIF({column}, '')::integer"
+    if field.type in ("float", "monetary"):
+        return f"NULLIF({column}, '')::numeric"
+    return f"NULLIF({column}, '')"
+
+
+def load_fiscal_csv(
+    env, filename, module="l10n_br_fiscal", noupdate=True, archive_missing=False
+):
+    """Load a reference data CSV file (NCM, NBM, NBS, CEST, CNAE) with
+    PostgreSQL COPY instead of the ORM.
+
+    The file is copied into a staging table, records whose xmlid exists
+    are updated only when a value changed, new records are inserted
+    together with their ir.model.data entries and the ncm_ids of NBM/CEST
+    are computed in SQL. The stored computed fields (code_unmasked, tax
+    estimates) of the inserted and updated records are then recomputed by
+    the ORM. With archive_missing, the
+    records of the module missing from the file are archived, which
+    allows applying a new government table as an incremental diff.
+    :return: (number of records inserted, number of records updated)
+    """
+    model_name = os.path.splitext(os.path.basename(filename))[0].split("-")[0]
+    model = env[model_name]
+    table = model._table
+    cr = env.cr
+    env["base"].flush()
+
+    with tools.file_open(os.path.join(module, filename), "rb") as file:
+        header = next(tools.pycompat.csv_reader(file))
+        file.seek(0)
+        staging = [f"c{index}" for index in range(len(header))]
+        cr.execute("DROP TABLE IF EXISTS fiscal_csv_staging")
+        cr.execute(
+            "CREATE TEMP TABLE fiscal_csv_staging ({}) ON COMMIT DROP".format(
+                ", ".join(f"{column} TEXT" for column in staging)
+            )
+        )
+        cr.copy_expert(
+            "COPY fiscal_csv_staging FROM STDIN WITH (FORMAT csv, HEADER true)", file
+        )
+
+    columns = dict(zip(header, staging))
+    cr.execute(
+        """
+        ALTER TABLE fiscal_csv_staging
+            ADD COLUMN xml_module VARCHAR,
+            ADD COLUMN xml_name VARCHAR,
+            ADD COLUMN res_id INTEGER
+        """
+    )
+    cr.execute(
+        f"""
+        UPDATE fiscal_csv_staging
+           SET xml_module = CASE WHEN position('.' IN {columns["id"]}) > 0
+                   THEN split_part({columns["id"]}, '.', 1) ELSE %(module)s END,
+               xml_name = CASE WHEN position('.' IN {columns["id"]}) > 0
+                   THEN split_part({columns["id"]}, '.', 2) ELSE {columns["id"]} END
+        """,
+        {"module": module},
+    )
+    cr.execute(
+        """
+        UPDATE fiscal_csv_staging s
+           SET res_id = d.res_id
+          FROM ir_model_data d
+         WHERE d.module = s.xml_module
+           AND d.name = s.xml_name
+           AND d.model = %s
+        """,
+        (model_name,),
+    )
+
+    values = {}
+    for name, column in columns.items():
+        if name == "id" or name.endswith(":id"):
+            continue
+        values[name] = _csv_value_sql(model._fields[name], column)
+    defaults = model.default_get(
+        [
+            name
+            for name, field in model._fields.items()
+            if field.store
+            and field.column_type
+            and field.type not in ("many2one", "reference")
+            and name not in values
+            and name not in MAGIC_COLUMNS
+        ]
+    )
+    params = {
+        "uid": env.uid,
+        "model": model_name,
+        "noupdate": noupdate,
+        "sequence": f"{table}_id_seq",
+    }
+    for name, value in defaults.items():
+        params[f"default_{name}"] = value
+        values[name] = f"%(default_{name})s"
+
+    fields_sql = ", ".join(values)
+    values_sql = ", ".join(f"{sql} AS {name}" for name, sql in values.items())
+
+    cr.execute(
+        f"""
+        UPDATE {table} t
+           SET {", ".join(f"{name} = v.{name}" for name in values)},
+               write_uid = %(uid)s,
+               write_date = now() at time zone 'UTC'
+          FROM (
+               SELECT s.res_id, {values_sql}
+                 FROM fiscal_csv_staging s
+                WHERE s.res_id IS NOT NULL
+          ) v
+         WHERE t.id = v.res_id
+           AND ({", ".join(f"t.{name}" for name in values)})
+               IS DISTINCT FROM ({", ".join(f"v.{name}" for name in values)})
+        RETURNING t.id
+        """,
+        params,
+    )
+    updated_ids = {row[0] for row in cr.fetchall()}
+
+    cr.execute(
+        f"""
+        WITH new AS (
+            SELECT nextval(%(sequence)s) AS id, s.xml_module, s.xml_name,
+                   {values_sql}
+              FROM fiscal_csv_staging s
+             WHERE s.res_id IS NULL
+        ), inserted AS (
+            INSERT INTO {table} (
+                id, {fields_sql}, create_uid, create_date, write_uid, write_date
+            )
+            SELECT id, {fields_sql},
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+              FROM new
+            RETURNING id
+        )
+        INSERT INTO ir_model_data (
+            module, name, model, res_id, noupdate, date_init, date_update,
+            create_uid, create_date, write_uid, write_date
+        )
+        SELECT xml_module, xml_name, %(model)s, id, %(noupdate)s,
+               now() at time zone 'UTC', now() at time zone 'UTC',
+               %(uid)s, now() at time zone 'UTC',
+               %(uid)s, now() at time zone 'UTC'
+          FROM new
+        RETURNING res_id
+        """,
+        params,
+    )
+    inserted_ids = {row[0] for row in cr.fetchall()}
+    cr.execute(
+        """
+        UPDATE fiscal_csv_staging s
+           SET res_id = d.res_id
+          FROM ir_model_data d
+         WHERE s.res_id IS NULL
+           AND d.module = s.xml_module
+           AND d.name = s.xml_name
+           AND d.model = %s
+        """,
+        (model_name,),
+    )
+
+    # Many2one columns are resolved once every record exists, so records
+    # may reference other records of the same file (CNAE parent_id)
+    for name, column in columns.items():
+        if not name.endswith(":id"):
+            continue
+        field_name = name[: -len(":id")]
+        cr.execute(
+            f"""
+            UPDATE {table} t
+               SET {field_name} = d.res_id
+              FROM fiscal_csv_staging s
+              LEFT JOIN ir_model_data d
+                ON d.module = CASE WHEN position('.' IN s.{column}) > 0
+                       THEN split_part(s.{column}, '.', 1) ELSE %(module)s END
+               AND d.name = CASE WHEN position('.' IN s.{column}) > 0
+                       THEN split_part(s.{column}, '.', 2) ELSE s.{column} END
+             WHERE t.id = s.res_id
+               AND t.{field_name} IS DISTINCT FROM d.res_id
+            RETURNING t.id
+            """,
+            {"module": module},
+        )
+        updated_ids.update(
+            row[0] for row in cr.fetchall() if row[0] not in inserted_ids
+        )
+
+    # The stored computed fields are left to the ORM, so that they get the
+    # same values as records created by the ORM
+    model.invalidate_cache()
+    records = model.with_context(active_test=False).browse(
+        sorted(inserted_ids | updated_ids)
+    )
+    for field in model._fields.values():
+        if field.store and field.compute:
+            env.add_to_compute(field, records)
+    model.flush()
+
+    if model_name in BULK_CSV_NCM_RELATIONS:
+        relation, column = BULK_CSV_NCM_RELATIONS[model_name]
+        cr.execute(
+            f"""
+            DELETE FROM {relation}
+             WHERE {column} IN (SELECT res_id FROM fiscal_csv_staging)
+            """
+        )
+        cr.execute(
+            f"""
+            INSERT INTO {relation} ({column}, ncm_id)
+            SELECT DISTINCT t.id, n.id
+              FROM {table} t
+             CROSS JOIN LATERAL unnest(
+                   string_to_array(replace(t.ncms, '.', ''), ',')
+             ) AS c(code)
+              JOIN l10n_br_fiscal_ncm n
+                ON n.active
+               AND (
+                   (length(trim(c.code)) = 8 AND n.code_unmasked = trim(c.code))
+                   OR (
+                       length(trim(c.code)) < 8
+                       AND n.code_unmasked ILIKE trim(c.code) || '%'
+                   )
+               )
+             WHERE t.id IN (SELECT res_id FROM fiscal_csv_staging)
+            """
+        )
+
+    if archive_missing and "active" in model._fields:
+        cr.execute(
+            f"""
+            UPDATE {table} SET active = FALSE
+             WHERE active
+               AND id IN (
+                   SELECT res_id FROM ir_model_data
+                    WHERE model = %s AND module = %s
+               )
+               AND id NOT IN (SELECT res_id FROM fiscal_csv_staging)
+            """,
+            (model_name, module),
+        )
+
+    cr.execute("DROP TABLE fiscal_csv_staging")
+    model.invalidate_cache()
+    inserted, updated = len(inserted_ids), len(updated_ids)
+    _logger.info(
+        "%s loaded: %s records inserted, %s updated", filename, inserted, updated
+    )
+    return inserted, updated
+
+
+def _load_files(cr, files, kind, mode="init"):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    for file in files:
+        model_name = os.path.basename(file).rsplit(".", 1)[0].split("-")[0]
+        if file.endswith(".csv") and model_name in BULK_CSV_MODELS:
+            load_fiscal_csv(env, file)
+            continue
+        tools.convert_file(
+            cr,
+            "l10n_br_fiscal",
+            file,
+            None,
+            mode=mode,
+            noupdate=True,
+            kind=kind,
+        )
+
 
 def post_init_hook(cr, registry):
     """Import XML data to change core data"""
@@ -29,16 +323,7 @@ def post_init_hook(cr, registry):
 
     _logger.info(_("Loading l10n_br_fiscal fiscal files. It may take a minute..."))
 
-    for file in files:
-        tools.convert_file(
-            cr,
-            "l10n_br_fiscal",
-            file,
-            None,
-            mode="init",
-            noupdate=True,
-            kind="init",
-        )
+    _load_files(cr, files, kind="init")
 
     env.cr.execute("select demo from ir_module_module where name='l10n_br_fiscal';")
     is_demo = env.cr.fetchone()[0]
@@ -75,16 +360,7 @@ def post_init_hook(cr, registry):
 
         _logger.info(_("Loading l10n_br_fiscal demo files."))
 
-        for f in demofiles:
-            tools.convert_file(
-                cr,
-                "l10n_br_fiscal",
-                f,
-                None,
-                mode="init",
-                noupdate=True,
-                kind="demo",
-            )
+        _load_files(cr, demofiles, kind="demo")
 
     if not is_demo:
         prodfiles = []
@@ -103,21 +379,12 @@ def post_init_hook(cr, registry):
 
         _logger.info(
             _(
-                "Loading l10n_br_fiscal production files. It may take at least"
-                " 3 minutes..."
+                "Loading l10n_br_fiscal production files. It may take a few"
+                " seconds..."
             )
         )
 
-        for f in prodfiles:
-            tools.convert_file(
-                cr,
-                "l10n_br_fiscal",
-                f,
-                None,
-                mode="init",
-                noupdate=True,
-                kind="init",
-            )
+        _load_files(cr, prodfiles, kind="init")
 
     # Load post files
     posloadfiles = [
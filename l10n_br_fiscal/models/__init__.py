@@ -10,6 +10,7 @@ from . import document_move_mixin
 from . import document_line_mixin_methods
 from . import document_line_mixin
 from . import invalidate_number
+from . import cache_version
 from . import comment
 from . import ibpt
 from . import cfop
@@ -0,0 +1,49 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+# Current version of each fiscal cache, part of the ormcache keys of the
+# cached methods so that bumping it only drops the entries of that cache.
+CACHE_VERSION_TABLE = "l10n_br_fiscal_cache_version"
+
+
+class CacheVersion(models.AbstractModel):
+    _name = "l10n_br_fiscal.cache.version"
+    _description = "Fiscal Cache Versions"
+
+    def init(self):
+        self.env.cr.execute(
+            f"CREATE SEQUENCE IF NOT EXISTS {CACHE_VERSION_TABLE}_seq;"
+            f" CREATE TABLE IF NOT EXISTS {CACHE_VERSION_TABLE} ("
+            " name VARCHAR PRIMARY KEY,"
+            " version INTEGER NOT NULL)"
+        )
+
+    @api.model
+    def _get_version(self, name):
+        """Return the version of a cache, read once per transaction."""
+        versions = self.env.cr.precommit.data.setdefault(CACHE_VERSION_TABLE, {})
+        if name not in versions:
+            self.env.cr.execute(
+                f"SELECT version FROM {CACHE_VERSION_TABLE} WHERE name = %s",
+                (name,),
+            )
+            row = self.env.cr.fetchone()
+            versions[name] = row[0] if row else 0
+        return versions[name]
+
+    @api.model
+    def _bump_version(self, name):
+        """Drop the entries of a cache on every worker once the transaction
+        is committed, without clearing the rest of the registry cache.
+
+        The versions come from a sequence so that the version of a rolled
+        back transaction is never used again.
+        """
+        self.env.cr.execute(
+            f"INSERT INTO {CACHE_VERSION_TABLE} (name, version)"
+            f" VALUES (%s, nextval('{CACHE_VERSION_TABLE}_seq'))"
+            " ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version",
+            (name,),
+        )
+        self.env.cr.precommit.data.get(CACHE_VERSION_TABLE, {}).pop(name, None)
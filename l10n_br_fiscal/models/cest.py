@@ -3,7 +3,6 @@
 
 from odoo import api, fields, models
 
-from .. import tools
 from ..constants.fiscal import CEST_SEGMENT
 
 
@@ -58,8 +57,7 @@ class Cest(models.Model):
         return write_super
 
     def action_search_ncms(self):
-        ncm = self.env["l10n_br_fiscal.ncm"]
+        ncm_trie = self.env["l10n_br_fiscal.ncm"]._get_code_trie(8)
         for r in self:
             if r.ncms:
-                domain = tools.domain_field_codes(field_codes=r.ncms)
-                r.ncm_ids = ncm.search(domain)
+                r.ncm_ids = [(6, 0, list(ncm_trie.match_codes(r.ncms)))]
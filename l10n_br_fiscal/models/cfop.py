@@ -100,6 +100,13 @@ class Cfop(models.Model):
             else:
                 cfop.destination = False
 
+    def write(self, values):
+        result = super().write(values)
+        if {"code", "destination", "tax_definition_ids"}.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     _sql_constraints = [
         (
             "fiscal_cfop_code_uniq",
@@ -8,6 +8,7 @@ from dateutil.relativedelta import relativedelta
 
 from odoo import api, fields, models, tools
 from odoo.osv.expression import AND
+from odoo.tools.lru import LRU
 
 from ..constants.fiscal import (
     COMMENT_TYPE,
@@ -15,6 +16,53 @@ from ..constants.fiscal import (
     FISCAL_COMMENT_OBJECTS,
 )
 
+# Compiled comment templates shared by the whole process, keyed by
+# database, comment id and write_date so edited comments are recompiled.
+TEMPLATE_CACHE = LRU(512)
+
+_template_envs = {}
+
+
+def _get_template_env():
+    """Return the process wide jinja environment used to render comments."""
+    if "env" not in _template_envs:
+        from jinja2.sandbox import SandboxedEnvironment
+
+        mako_template_env = SandboxedEnvironment(
+            block_start_string="<%",
+            block_end_string="%>",
+            variable_start_string="${",
+            variable_end_string="}",
+            comment_start_string="<%doc>",
+            comment_end_string="</%doc>",
+            line_statement_prefix="%",
+            line_comment_prefix="##",
+            trim_blocks=True,  # do not output newline after
+            autoescape=True,  # XML/HTML automatic escaping
+        )
+        mako_template_env.globals.update(
+            {
+                "str": str,
+                "datetime": datetime,
+                "len": len,
+                "abs": abs,
+                "min": min,
+                "max": max,
+                "sum": sum,
+                "filter": filter,
+                "map": map,
+                "round": round,
+                # dateutil.relativedelta is an old-style class and cannot be
+                # instanciated wihtin a jinja2 expression, so a lambda "proxy" is
+                # is needed, apparently.
+                "relativedelta": lambda *a, **kw: relativedelta.relativedelta(*a, **kw),
+            }
+        )
+        mako_safe_env = copy.copy(mako_template_env)
+        mako_safe_env.autoescape = False
+        _template_envs["env"] = mako_safe_env
+    return _template_envs["env"]
+
 
 class Comment(models.Model):
     _name = "l10n_br_fiscal.comment"
@@ -115,57 +163,55 @@ class Comment(models.Model):
 
         return f"{pre}{formatted_amount}{post}"
 
-    def compute_message(self, vals, manual_comment=None):
-        if not self.ids and not manual_comment:
-            return False
-
-        from jinja2.sandbox import SandboxedEnvironment
+    def _get_templates(self):
+        """Return the compiled template of each comment, compiling only
+        the comments missing from the process cache."""
+        templates = []
+        for record in self:
+            key = (self.env.cr.dbname, record.id, record.write_date)
+            source = tools.ustr(record.comment)
+            # write_date does not change inside a transaction, so the
+            # source is checked too before reusing a compiled template
+            cached = TEMPLATE_CACHE.get(key)
+            if cached is None or cached[0] != source:
+                cached = (source, _get_template_env().from_string(source))
+                TEMPLATE_CACHE[key] = cached
+            templates.append(cached[1])
+        return templates
 
-        mako_template_env = SandboxedEnvironment(
-            block_start_string="<%",
-            block_end_string="%>",
-            variable_start_string="${",
-            variable_end_string="}",
-            comment_start_string="<%doc>",
-            comment_end_string="</%doc>",
-            line_statement_prefix="%",
-            line_comment_prefix="##",
-            trim_blocks=True,  # do not output newline after
-            autoescape=True,  # XML/HTML automatic escaping
-        )
-        mako_template_env.globals.update(
-            {
-                "str": str,
-                "datetime": datetime,
-                "len": len,
-                "abs": abs,
-                "min": min,
-                "max": max,
-                "sum": sum,
-                "filter": filter,
-                "map": map,
-                "round": round,
-                # dateutil.relativedelta is an old-style class and cannot be
-                # instanciated wihtin a jinja2 expression, so a lambda "proxy" is
-                # is needed, apparently.
-                "relativedelta": lambda *a, **kw: relativedelta.relativedelta(*a, **kw),
-                # adding format amount
-                # now we can format values like currency on fiscal observation
-                "format_amount": (
-                    lambda amount, context=self._context: self.format_amount(
-                        self.env, amount, self.env.ref("base.BRL")
-                    )
-                ),
-            }
-        )
-        mako_safe_env = copy.copy(mako_template_env)
-        mako_safe_env.autoescape = False
+    def compute_message(self, vals, manual_comment=None):
+        return self.compute_message_multi([(self, vals, manual_comment)])[0]
 
-        comments = [manual_comment] if manual_comment else []
-        for record in self:
-            template = mako_safe_env.from_string(tools.ustr(record.comment))
-            comments.append(template.render(vals))
-        return " - ".join(comments)
+    @api.model
+    def compute_message_multi(self, items):
+        """Render several messages sharing the compiled templates.
+
+        :param items: list of (comments, vals, manual_comment)
+        :return: list with the message of each item
+        """
+        all_comments = self.browse()
+        for comments, _vals, _manual_comment in items:
+            all_comments |= comments
+        templates = dict(zip(all_comments, all_comments._get_templates()))
+
+        # format_amount function for fiscal observation
+        # now we can format values like currency on fiscal observation
+        brl = self.env.ref("base.BRL")
+        render_globals = {
+            "format_amount": lambda amount: self.format_amount(self.env, amount, brl)
+        }
+
+        messages = []
+        for comments, vals, manual_comment in items:
+            if not comments and not manual_comment:
+                messages.append(False)
+                continue
+            render_vals = dict(render_globals, **vals)
+            message = [manual_comment] if manual_comment else []
+            for record in comments:
+                message.append(templates[record].render(render_vals))
+            messages.append(" - ".join(message))
+        return messages
 
     def action_test_message(self):
         vals = {"user": self.env.user, "ctx": self._context, "doc": self.object_id}
@@ -2,6 +2,8 @@
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
 import json
+import logging
+import re
 
 from erpbrasil.base import misc
 from lxml import etree
@@ -9,6 +11,14 @@ from lxml import etree
 from odoo import _, api, fields, models
 from odoo.exceptions import AccessError
 from odoo.osv import expression
+from odoo.tools import ormcache
+
+from .. import tools
+
+_logger = logging.getLogger(__name__)
+
+# A search made only of digits and code punctuation looks for a code prefix
+CODE_PREFIX_RE = re.compile(r"^[\d\s./-]+$")
 
 
 class DataAbstract(models.AbstractModel):
@@ -26,6 +36,33 @@ class DataAbstract(models.AbstractModel):
 
     active = fields.Boolean(default=True)
 
+    def init(self):
+        if self._abstract:
+            return
+        cr = self.env.cr
+        # Prefix searches on code_unmasked (LIKE '7323%') do not depend on
+        # the database collation with a text_pattern_ops index.
+        cr.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_code_unmasked_prefix_idx"
+            f" ON {self._table} (code_unmasked text_pattern_ops)"
+        )
+        cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if not cr.fetchone():
+            try:
+                with cr.savepoint():
+                    cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except Exception:
+                _logger.warning(
+                    "The pg_trgm extension is not available, %s name searches"
+                    " will not use a trigram index.",
+                    self._name,
+                )
+                return
+        cr.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_name_trgm_idx"
+            f" ON {self._table} USING gin (name gin_trgm_ops)"
+        )
+
     def action_archive(self):
         if not self.env.user.has_group("l10n_br_fiscal.group_manager"):
             raise AccessError(_("You don't have permission to archive records."))
@@ -42,6 +79,20 @@ class DataAbstract(models.AbstractModel):
             # TODO mask code and unmasck
             r.code_unmasked = misc.punctuation_rm(r.code)
 
+    @api.model
+    def _get_code_trie(self, code_size, field_name="code_unmasked"):
+        """Return a prefix tree of the codes of the visible records."""
+        self.flush([field_name])
+        query = self._where_calc([(field_name, "!=", False)])
+        self._apply_ir_rules(query, "read")
+        from_clause, where_clause, params = query.get_sql()
+        self.env.cr.execute(
+            f'SELECT "{self._table}".id, "{self._table}"."{field_name}"'
+            f" FROM {from_clause} WHERE {where_clause}",
+            params,
+        )
+        return tools.CodeTrie(self.env.cr.fetchall(), code_size)
+
     @api.model
     def fields_view_get(
         self, view_id=None, view_type="form", toolbar=False, submenu=False
@@ -49,46 +100,61 @@ class DataAbstract(models.AbstractModel):
         model_view = super().fields_view_get(view_id, view_type, toolbar, submenu)
 
         if view_type == "search":
-            doc = etree.XML(model_view["arch"])
-            for node in doc.xpath("//field[@name='code']"):
-                modifiers = json.loads(node.get("modifiers", "{}"))
-                modifiers["filter_domain"] = (
-                    "['|', '|', ('code', 'ilike', self), "
-                    "('code_unmasked', 'ilike', self + '%'),"
-                    "('name', 'ilike', self + '%')]"
-                )
-                node.set("modifiers", json.dumps(modifiers))
-            model_view["arch"] = etree.tostring(doc)
+            model_view["arch"] = self._get_search_view_arch(model_view["arch"])
 
         return model_view
 
+    @api.model
+    @ormcache("arch")
+    def _get_search_view_arch(self, arch):
+        """Return the search arch looking for codes with and without mask."""
+        doc = etree.XML(arch)
+        for node in doc.xpath("//field[@name='code']"):
+            modifiers = json.loads(node.get("modifiers", "{}"))
+            modifiers["filter_domain"] = (
+                "['|', '|', ('code', 'ilike', self), "
+                "('code_unmasked', '=like', self + '%'),"
+                "('name', 'ilike', self + '%')]"
+            )
+            node.set("modifiers", json.dumps(modifiers))
+        return etree.tostring(doc)
+
     @api.model
     def _name_search(
         self, name, args=None, operator="ilike", limit=100, name_get_uid=None
     ):
         if operator == "ilike" and not (name or "").strip():
             domain = []
+        elif operator == "ilike" and CODE_PREFIX_RE.match(name):
+            # a code prefix, looked up with the code_unmasked pattern index;
+            # every branch of the OR must be indexed (the name with the
+            # trigram index) for PostgreSQL to combine them in a BitmapOr
+            domain = [
+                "|",
+                ("name", operator, name),
+                ("code_unmasked", "=like", misc.punctuation_rm(name) + "%"),
+            ]
         elif operator in ("ilike", "like", "=", "=like", "=ilike"):
-            domain = expression.AND(
-                [
-                    args or [],
-                    [
-                        "|",
-                        "|",
-                        ("name", operator, name),
-                        ("code", operator, name),
-                        ("code_unmasked", "ilike", name + "%"),
-                    ],
-                ]
-            )
-            return self._search(
-                expression.AND([domain, args]),
+            domain = [
+                "|",
+                "|",
+                ("name", operator, name),
+                ("code", operator, name),
+                ("code_unmasked", "ilike", name + "%"),
+            ]
+        else:
+            return super()._name_search(
+                name,
+                args=args,
+                operator=operator,
                 limit=limit,
-                access_rights_uid=name_get_uid,
+                name_get_uid=name_get_uid,
             )
 
-        return super()._name_search(
-            name, args=args, operator=operator, limit=limit, name_get_uid=name_get_uid
+        return self._search(
+            expression.AND([domain, args or []]),
+            limit=limit,
+            access_rights_uid=name_get_uid,
         )
 
     def name_get(self):
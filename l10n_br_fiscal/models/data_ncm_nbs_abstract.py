@@ -3,15 +3,17 @@
 
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 from erpbrasil.base import misc
 from lxml import etree
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.tools import config as odooconfig
 
-from .ibpt import DeOlhoNoImposto
+from .ibpt import DeOlhoNoImposto, RateLimiter, get_session
 
 _logger = logging.getLogger(__name__)
 
@@ -19,6 +21,8 @@ OBJECT_NAMES = {"l10n_br_fiscal.ncm": "NCM", "l10n_br_fiscal.nbs": "NBS"}
 
 OBJECT_FIELDS = {"l10n_br_fiscal.ncm": "ncm_id", "l10n_br_fiscal.nbs": "nbs_id"}
 
+IBPT_CHECKPOINT_PARAM = "l10n_br_fiscal.ibpt_checkpoint.{}.{}"
+
 
 class DataNcmNbsAbstract(models.AbstractModel):
     _name = "l10n_br_fiscal.data.ncm.nbs.abstract"
@@ -49,68 +53,67 @@ class DataNcmNbsAbstract(models.AbstractModel):
 
     @api.depends("tax_estimate_ids")
     def _compute_amount(self):
+        percents = self.env["l10n_br_fiscal.tax.estimate"]._get_estimate_percents_multi(
+            self.env.company.id, OBJECT_FIELDS.get(self._name), self.ids
+        )
         for record in self:
-            object_field = OBJECT_FIELDS.get(record._name)
-            last_estimated = record.env["l10n_br_fiscal.tax.estimate"].search(
-                [
-                    (object_field, "=", record.id),
-                    ("company_id", "=", record.env.company.id),
-                ],
-                order="create_date DESC",
-                limit=1,
-            )
-
-            if last_estimated:
-                record.estimate_tax_imported = (
-                    last_estimated.federal_taxes_import
-                    + last_estimated.state_taxes
-                    + last_estimated.municipal_taxes
-                )
-
-                record.estimate_tax_national = (
-                    last_estimated.federal_taxes_national
-                    + last_estimated.state_taxes
-                    + last_estimated.municipal_taxes
-                )
+            if record.id in percents:
+                (
+                    record.estimate_tax_national,
+                    record.estimate_tax_imported,
+                ) = percents[record.id]
 
     def _get_ibpt(self, config, code_unmasked):
         return False
 
+    @api.model
+    def _get_ibpt_param(self, name, default=None):
+        return (
+            odooconfig.get(name)
+            or self.env["ir.config_parameter"].sudo().get_param(name)
+            or default
+        )
+
+    @api.model
+    def _get_ibpt_config(self, company, session=None):
+        return DeOlhoNoImposto(
+            company.ibpt_token,
+            misc.punctuation_rm(company.cnpj_cpf),
+            company.state_id.code,
+            self._get_ibpt_param("ibpt_request_timeout"),
+            session,
+            self._get_ibpt_param("ibpt_api_url"),
+        )
+
+    def _prepare_tax_estimate_values(self, company, result):
+        self.ensure_one()
+        return {
+            OBJECT_FIELDS.get(self._name): self.id,
+            "key": result.chave,
+            "origin": result.fonte,
+            "state_id": company.state_id.id,
+            "state_taxes": result.estadual,
+            "federal_taxes_national": result.nacional,
+            "federal_taxes_import": result.importado,
+            "company_id": company.id,
+        }
+
     def action_ibpt_inquiry(self):
         if not self.env.company.ibpt_api:
             return False
 
         object_name = OBJECT_NAMES.get(self._name)
-        object_field = OBJECT_FIELDS.get(self._name)
 
         for record in self:
             try:
                 company = self.env.company
-
-                config = DeOlhoNoImposto(
-                    company.ibpt_token,
-                    misc.punctuation_rm(company.cnpj_cpf),
-                    company.state_id.code,
-                    odooconfig.get("ibpt_request_timeout")
-                    or self.env["ir.config_parameter"]
-                    .sudo()
-                    .get_param("ibpt_request_timeout"),
-                )
-
+                config = self._get_ibpt_config(company)
                 result = self._get_ibpt(config, record.code_unmasked)
 
                 if result:
-                    values = {
-                        object_field: record.id,
-                        "key": result.chave,
-                        "origin": result.fonte,
-                        "state_id": company.state_id.id,
-                        "state_taxes": result.estadual,
-                        "federal_taxes_national": result.nacional,
-                        "federal_taxes_import": result.importado,
-                    }
-
-                    self.env["l10n_br_fiscal.tax.estimate"].create(values)
+                    self.env["l10n_br_fiscal.tax.estimate"].create(
+                        record._prepare_tax_estimate_values(company, result)
+                    )
 
                     record.message_post(
                         body=_("{} Tax Estimate Updated").format(object_name),
@@ -132,51 +135,130 @@ class DataNcmNbsAbstract(models.AbstractModel):
                 continue
 
     @api.model
-    def _scheduled_update(self):
-        object_name = OBJECT_NAMES.get(self._name)
-
-        _logger.info(_("Scheduled {} estimate taxes update...").format(object_name))
-
-        config_date = self.env.company.ibpt_update_days
-        today = fields.date.today()
-        data_max = today - timedelta(days=config_date)
-
-        all_records = self.env[self._name].search([])
-
-        not_estimated = all_records.filtered(
-            lambda r: r.product_tmpl_qty > 0 and not r.tax_estimate_ids
+    def _get_ibpt_stale_ids(self, after_id=0):
+        """Select in SQL the codes used by products without any estimate
+        and the codes whose last estimate is older than ibpt_update_days"""
+        object_field = OBJECT_FIELDS.get(self._name)
+        data_max = fields.Date.today() - timedelta(
+            days=self.env.company.ibpt_update_days
+        )
+        self.flush()
+        self.env["l10n_br_fiscal.tax.estimate"].flush([object_field, "create_date"])
+        self.env.cr.execute(
+            f"""
+            SELECT r.id
+              FROM {self._table} r
+              LEFT JOIN (
+                   SELECT {object_field}, max(create_date) AS max_date
+                     FROM l10n_br_fiscal_tax_estimate
+                    WHERE {object_field} IS NOT NULL
+                    GROUP BY {object_field}
+              ) e ON e.{object_field} = r.id
+             WHERE r.id > %(after_id)s
+               AND (
+                   (e.max_date IS NULL AND EXISTS (
+                       SELECT 1 FROM product_template p
+                        WHERE p.{object_field} = r.id
+                   ))
+                   OR e.max_date < %(create_date)s
+               )
+             ORDER BY r.id
+            """,
+            {"after_id": after_id, "create_date": data_max},
         )
+        return [row[0] for row in self.env.cr.fetchall()]
 
-        query = """
-            WITH {0}_max_date AS (
-               SELECT
-                   {0}_id,
-                   max(create_date)
-               FROM
-                   l10n_br_fiscal_tax_estimate
-               GROUP BY {0}_id)
-               SELECT {0}_id
-               FROM {0}_max_date
-            WHERE max < %(create_date)s
-            """.format(object_name.lower())
+    @api.model
+    def _ibpt_refresh(self, record_ids):
+        """Fetch the IBPT estimates of record_ids in batches.
+
+        The requests of a batch run in a bounded thread pool sharing one
+        pooled HTTP session and rate limiter, then the estimates of the
+        batch are created at once. The last processed id is saved as a
+        checkpoint after each batch (committed outside tests), so an
+        interrupted run resumes where it stopped.
+        :return: (number of estimates created, number of failures)
+        """
+        company = self.env.company
+        object_name = OBJECT_NAMES.get(self._name)
+        checkpoint_param = IBPT_CHECKPOINT_PARAM.format(self._name, company.id)
+        max_workers = int(self._get_ibpt_param("ibpt_max_workers", 4))
+        batch_size = int(self._get_ibpt_param("ibpt_batch_size", 200))
+        limiter = RateLimiter(self._get_ibpt_param("ibpt_rate_limit"))
+        session = get_session(max_workers)
+        config = self._get_ibpt_config(company, session)
+        testing = getattr(threading.current_thread(), "testing", False)
+
+        def fetch(code):
+            limiter.wait()
+            try:
+                return self._get_ibpt(config, code), None
+            except Exception as e:
+                return None, e
+
+        created = failed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for index in range(0, len(record_ids), batch_size):
+                    records = self.browse(record_ids[index : index + batch_size])
+                    codes = records.mapped("code_unmasked")
+                    vals_list = []
+                    for record, (result, error) in zip(
+                        records, executor.map(fetch, codes)
+                    ):
+                        if result:
+                            vals_list.append(
+                                record._prepare_tax_estimate_values(company, result)
+                            )
+                        elif error:
+                            failed += 1
+                            _logger.warning(
+                                _(
+                                    "%(name)s %(code)s Tax Estimate Failure: %(error)s",
+                                    name=object_name,
+                                    code=record.code,
+                                    error=error,
+                                )
+                            )
+                    self.env["l10n_br_fiscal.tax.estimate"].create(vals_list)
+                    created += len(vals_list)
+                    self.env["ir.config_parameter"].sudo().set_param(
+                        checkpoint_param, records[-1].id
+                    )
+                    if not testing:
+                        self.env.cr.commit()  # pylint: disable=invalid-commit
+        finally:
+            session.close()
 
-        query_params = {"create_date": data_max.strftime("%Y-%m-%d")}
+        self.env["ir.config_parameter"].sudo().set_param(checkpoint_param, False)
+        return created, failed
 
-        self.env.cr.execute(self.env.cr.mogrify(query, query_params))
-        past_estimated = self.env.cr.fetchall()
+    @api.model
+    def _scheduled_update(self):
+        object_name = OBJECT_NAMES.get(self._name)
 
-        ids = [estimate[0] for estimate in past_estimated]
+        _logger.info(_("Scheduled {} estimate taxes update...").format(object_name))
 
-        record_past_estimated = self.env[self._name].browse(ids)
+        if not self.env.company.ibpt_api:
+            return
 
-        for record in not_estimated + record_past_estimated:
-            try:
-                record.action_ibpt_inquiry()
-            except Exception:
-                continue
+        checkpoint = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(IBPT_CHECKPOINT_PARAM.format(self._name, self.env.company.id))
+        )
+        created, failed = self._ibpt_refresh(
+            self._get_ibpt_stale_ids(int(checkpoint or 0))
+        )
 
         _logger.info(
-            _("Scheduled {} estimate taxes update complete.").format(object_name)
+            _(
+                "Scheduled %(name)s estimate taxes update complete: "
+                "%(created)s updated, %(failed)s failures.",
+                name=object_name,
+                created=created,
+                failed=failed,
+            )
         )
 
     @api.model
@@ -184,14 +266,21 @@ class DataNcmNbsAbstract(models.AbstractModel):
         self, view_id=None, view_type="form", toolbar=False, submenu=False
     ):
         res = super().fields_view_get(view_id, view_type, toolbar, submenu)
-        if view_type == "form":
-            xml = etree.XML(res["arch"])
-            xml_button = xml.xpath("//button[@name='action_ibpt_inquiry']")
-            if xml_button and not self.env.company.ibpt_api:
-                modifiers = json.loads(xml_button[0].get("modifiers", "{}"))
-                modifiers["invisible"] = 1
-                xml_button[0].set("modifiers", json.dumps(modifiers))
-                res["arch"] = etree.tostring(xml, pretty_print=True)
+        if view_type == "form" and not self.env.company.ibpt_api:
+            res["arch"] = self._get_form_view_arch(res["arch"])
         if res.get("toolbar") and not self.env.company.ibpt_api:
             res["toolbar"]["action"] = []
         return res
+
+    @api.model
+    @tools.ormcache("arch")
+    def _get_form_view_arch(self, arch):
+        """Return the form arch without the IBPT inquiry button."""
+        xml = etree.XML(arch)
+        xml_button = xml.xpath("//button[@name='action_ibpt_inquiry']")
+        if not xml_button:
+            return arch
+        modifiers = json.loads(xml_button[0].get("modifiers", "{}"))
+        modifiers["invisible"] = 1
+        xml_button[0].set("modifiers", json.dumps(modifiers))
+        return etree.tostring(xml, pretty_print=True)
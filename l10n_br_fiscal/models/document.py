@@ -16,7 +16,9 @@ from ..constants.fiscal import (
     DOCUMENT_ISSUER_PARTNER,
     EDOC_PURPOSE,
     EDOC_PURPOSE_NORMAL,
+    FISCAL_IN,
     FISCAL_IN_OUT_DICT,
+    FISCAL_OUT,
     MODELO_FISCAL_CTE,
     MODELO_FISCAL_NFCE,
     MODELO_FISCAL_NFE,
@@ -88,6 +90,7 @@ class Document(models.Model):
         domain="[('state', '=', 'approved'), "
         "'|', ('fiscal_operation_type', '=', fiscal_operation_type),"
         " ('fiscal_operation_type', '=', 'all')]",
+        index=True,
     )
 
     fiscal_operation_type = fields.Selection(
@@ -346,7 +349,43 @@ class Document(models.Model):
         for values in vals_list:
             if not values.get("document_date"):
                 values["document_date"] = self._date_server_format()
-        return super().create(vals_list)
+        documents = super().create(vals_list)
+        documents.filtered(
+            lambda d: d.state_edoc == SITUACAO_EDOC_AUTORIZADA
+        )._update_company_revenue()
+        return documents
+
+    def write(self, values):
+        if "state_edoc" not in values:
+            return super().write(values)
+        authorized = self.filtered(lambda d: d.state_edoc == SITUACAO_EDOC_AUTORIZADA)
+        result = super().write(values)
+        if values["state_edoc"] == SITUACAO_EDOC_AUTORIZADA:
+            (self - authorized)._update_company_revenue()
+        else:
+            authorized._update_company_revenue(sign=-1)
+        return result
+
+    def _get_simples_revenue(self):
+        """Gross revenue of the document counted in the Simples Nacional
+        RBT12: sales add and sale returns deduct the untaxed amount."""
+        self.ensure_one()
+        fiscal_type = self.fiscal_operation_id.fiscal_type
+        if self.fiscal_operation_type == FISCAL_OUT and fiscal_type == "sale":
+            return self.amount_untaxed
+        if self.fiscal_operation_type == FISCAL_IN and fiscal_type == "sale_refund":
+            return -self.amount_untaxed
+        return 0.0
+
+    def _update_company_revenue(self, sign=1):
+        """Add (or remove when cancelled) the revenue of authorized documents
+        to the monthly revenue accumulator of their companies."""
+        for document in self:
+            amount = document._get_simples_revenue()
+            if amount:
+                document.company_id.sudo()._add_fiscal_revenue(
+                    document.document_date, sign * amount
+                )
 
     def unlink(self):
         forbidden_states_unlink = [
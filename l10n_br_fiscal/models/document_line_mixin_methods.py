@@ -1,16 +1,24 @@
 # Copyright (C) 2019  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+import logging
 from copy import deepcopy
 
 from lxml import etree
 
 from odoo import api, models
 
-from ..constants.fiscal import CFOP_DESTINATION_EXPORT, FISCAL_IN
+from ..constants.fiscal import (
+    CFOP_DESTINATION_EXPORT,
+    FISCAL_IN,
+    TAX_ENGINE_DOCUMENT,
+    TAX_ENGINE_VALIDATE,
+)
 from ..constants.icms import ICMS_BASE_TYPE_DEFAULT, ICMS_ST_BASE_TYPE_DEFAULT
 from .tax import TAX_DICT_VALUES
 
+_logger = logging.getLogger(__name__)
+
 FISCAL_TAX_ID_FIELDS = [
     "cofins_tax_id",
     "cofins_wh_tax_id",
@@ -186,9 +194,9 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
                 record.financial_total_gross = record.financial_total = 0.0
                 record.financial_discount_value = 0.0
 
-    def _compute_taxes(self, taxes, cst=None):
+    def _get_compute_taxes_kwargs(self):
         self.ensure_one()
-        return taxes.compute_taxes(
+        return dict(
             company=self.company_id,
             partner=self._get_fiscal_partner(),
             product=self.product_id,
@@ -217,6 +225,79 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
             icms_relief_id=self.icms_relief_id,
         )
 
+    def _compute_taxes(self, taxes, cst=None):
+        self.ensure_one()
+        return taxes.compute_taxes(**self._get_compute_taxes_kwargs())
+
+    def _compute_taxes_multi(self):
+        """Compute the fiscal taxes of every line with the tax engine
+        configured in its company."""
+        results = {}
+        for company in self.mapped("company_id"):
+            lines = self.filtered(lambda line, c=company: line.company_id == c)
+            engine = company.fiscal_tax_engine
+            if engine == TAX_ENGINE_DOCUMENT:
+                document_results = self.env["l10n_br_fiscal.tax"].compute_taxes_multi(
+                    [
+                        (line.fiscal_tax_ids, line._get_compute_taxes_kwargs())
+                        for line in lines
+                    ]
+                )
+                results.update(zip(lines, document_results))
+                continue
+
+            for line in lines:
+                results[line] = line._compute_taxes(line.fiscal_tax_ids)
+
+            if engine == TAX_ENGINE_VALIDATE:
+                document_results = self.env["l10n_br_fiscal.tax"].compute_taxes_multi(
+                    [
+                        (line.fiscal_tax_ids, line._get_compute_taxes_kwargs())
+                        for line in lines
+                    ]
+                )
+                for line, document_result in zip(lines, document_results):
+                    line._check_tax_engine_result(results[line], document_result)
+
+        for line in self - self.filtered("company_id"):
+            results[line] = line._compute_taxes(line.fiscal_tax_ids)
+
+        return [results[line] for line in self]
+
+    def _check_tax_engine_result(self, line_result, document_result):
+        self.ensure_one()
+        currency = self.currency_id or self.env.ref("base.BRL")
+        values = [
+            (field, line_result[field], document_result[field])
+            for field in (
+                "amount_included",
+                "amount_not_included",
+                "amount_withholding",
+                "estimate_tax",
+            )
+        ]
+        for tax_domain, tax_dict in line_result["taxes"].items():
+            document_tax_dict = document_result["taxes"].get(tax_domain, {})
+            values += [
+                (
+                    f"{tax_domain} {field}",
+                    tax_dict.get(field, 0.0),
+                    document_tax_dict.get(field, 0.0),
+                )
+                for field in ("base", "tax_value")
+            ]
+
+        for name, line_value, document_value in values:
+            if currency.compare_amounts(line_value, document_value):
+                _logger.warning(
+                    "Tax engine mismatch on %s %s (%s): line %s, document %s",
+                    self._name,
+                    self.id,
+                    name,
+                    line_value,
+                    document_value,
+                )
+
     @api.depends("tax_icms_or_issqn", "partner_is_public_entity")
     def _compute_allow_csll_irpj(self):
         """Calculates the possibility of 'CSLL' and 'IRPJ' tax charges."""
@@ -297,8 +378,7 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
             line.fiscal_tax_ids = fiscal_taxes + taxes
 
     def _update_fiscal_taxes(self):
-        for line in self:
-            compute_result = self._compute_taxes(line.fiscal_tax_ids)
+        for line, compute_result in zip(self, self._compute_taxes_multi()):
             to_update = {
                 "amount_tax_included": compute_result.get("amount_included", 0.0),
                 "amount_tax_not_included": compute_result.get(
@@ -309,7 +389,7 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
             }
             to_update.update(line._prepare_tax_fields(compute_result))
 
-            in_draft_mode = self != self._origin
+            in_draft_mode = line != line._origin
             if in_draft_mode:
                 line.update(to_update)
             else:
@@ -350,10 +430,14 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
         }
 
     def _document_comment(self):
-        for d in self:
-            d.additional_data = d.comment_ids.compute_message(
-                d.__document_comment_vals(), d.manual_additional_data
-            )
+        messages = self.env["l10n_br_fiscal.comment"].compute_message_multi(
+            [
+                (d.comment_ids, d.__document_comment_vals(), d.manual_additional_data)
+                for d in self
+            ]
+        )
+        for d, message in zip(self, messages):
+            d.additional_data = message
 
     def _get_fiscal_partner(self):
         """
@@ -381,27 +465,48 @@ class FiscalDocumentLineMixinMethods(models.AbstractModel):
 
     @api.onchange("fiscal_operation_line_id")
     def _onchange_fiscal_operation_line_id(self):
-        # Reset Taxes
-        self._remove_all_fiscal_tax_ids()
-        if self.fiscal_operation_line_id:
-            mapping_result = self.fiscal_operation_line_id.map_fiscal_taxes(
-                company=self.company_id,
-                partner=self._get_fiscal_partner(),
-                product=self.product_id,
-                ncm=self.ncm_id,
-                nbm=self.nbm_id,
-                nbs=self.nbs_id,
-                cest=self.cest_id,
-                city_taxation_code=self.city_taxation_code_id,
-                service_type=self.service_type_id,
-                ind_final=self.ind_final,
-            )
+        self._map_fiscal_taxes()
+
+    def _get_fiscal_mapping_values(self):
+        self.ensure_one()
+        return {
+            "product": self.product_id,
+            "ncm": self.ncm_id,
+            "nbm": self.nbm_id,
+            "nbs": self.nbs_id,
+            "cest": self.cest_id,
+            "city_taxation_code": self.city_taxation_code_id,
+            "service_type": self.service_type_id,
+            "ind_final": self.ind_final,
+        }
 
-            self.cfop_id = mapping_result["cfop"]
-            self._process_fiscal_mapping(mapping_result)
+    def _map_fiscal_taxes(self):
+        """Map the fiscal taxes of all lines, grouping them by operation
+        line, company and partner so each group is mapped with a single
+        call to map_fiscal_taxes_multi."""
+        groups = {}
+        for line in self:
+            # Reset Taxes
+            line._remove_all_fiscal_tax_ids()
+            if line.fiscal_operation_line_id:
+                groups.setdefault(
+                    (
+                        line.fiscal_operation_line_id,
+                        line.company_id,
+                        line._get_fiscal_partner(),
+                    ),
+                    [],
+                ).append(line)
+            else:
+                line.cfop_id = False
 
-        if not self.fiscal_operation_line_id:
-            self.cfop_id = False
+        for (operation_line, company, partner), lines in groups.items():
+            mapping_results = operation_line.map_fiscal_taxes_multi(
+                company, partner, [line._get_fiscal_mapping_values() for line in lines]
+            )
+            for line, mapping_result in zip(lines, mapping_results):
+                line.cfop_id = mapping_result["cfop"]
+                line._process_fiscal_mapping(mapping_result)
 
     def _process_fiscal_mapping(self, mapping_result):
         self.ipi_guideline_id = mapping_result["ipi_guideline"]
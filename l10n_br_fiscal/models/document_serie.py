@@ -2,6 +2,8 @@
 # Copyright (C) 2014  KMEE - www.kmee.com.br
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+from bisect import bisect_right
+
 from odoo import _, api, fields, models
 
 from ..constants.fiscal import (
@@ -83,26 +85,99 @@ class DocumentSerie(models.Model):
 
     def _is_invalid_number(self, document_number):
         self.ensure_one()
-        is_invalid_number = True
-        # TODO Improve this implementation!
-        invalids = self.env["l10n_br_fiscal.invalidate.number"].search(
-            [("state", "=", "done"), ("document_serie_id", "=", self.id)]
+        return bool(
+            self.env["l10n_br_fiscal.invalidate.number"].search_count(
+                [
+                    ("state", "=", "done"),
+                    ("document_serie_id", "=", self.id),
+                    ("number_start", "<=", int(document_number)),
+                    ("number_end", ">=", int(document_number)),
+                ]
+            )
+        )
+
+    def _get_invalid_intervals(self):
+        """Return the sorted (start, end) invalidated number ranges"""
+        self.ensure_one()
+        invalids = self.env["l10n_br_fiscal.invalidate.number"].search_read(
+            [("state", "=", "done"), ("document_serie_id", "=", self.id)],
+            ["number_start", "number_end"],
+            order="number_start",
         )
-        invalid_numbers = []
-        for invalid in invalids:
-            invalid_numbers += range(invalid.number_start, invalid.number_end + 1)
-        if int(document_number) not in invalid_numbers:
-            is_invalid_number = False
-        return is_invalid_number
+        return [(i["number_start"], i["number_end"]) for i in invalids]
+
+    def _get_numbers_in_use(self, document_numbers):
+        """Batch version of check_number_in_use"""
+        self.ensure_one()
+        documents = self.env["l10n_br_fiscal.document"].search_read(
+            [
+                ("document_number", "in", document_numbers),
+                ("document_serie_id", "=", self.id),
+                ("document_type_id", "=", self.document_type_id.id),
+                ("issuer", "=", DOCUMENT_ISSUER_COMPANY),
+                ("company_id", "=", self.company_id.id),
+            ],
+            ["document_number"],
+        )
+        return {d["document_number"] for d in documents}
 
     def next_seq_number(self):
         self.ensure_one()
-        document_number = self.internal_sequence_id._next()
-        if self._is_invalid_number(document_number) or self.check_number_in_use(
-            document_number
-        ):
-            document_number = self.next_seq_number()
-        return document_number
+        return self.reserve_numbers(1)[0]
+
+    def reserve_numbers(self, count):
+        """Reserve count valid document numbers of the serie.
+
+        The numbers skip the invalidated ranges and the numbers already
+        used by a document. For no_gap sequences the sequence row is
+        locked and moved once for the whole batch.
+        """
+        self.ensure_one()
+        sequence = self.internal_sequence_id
+        if sequence.implementation != "no_gap" or sequence.use_date_range:
+            return self._reserve_numbers_by_sequence(count)
+
+        intervals = self._get_invalid_intervals()
+        starts = [start for start, _end in intervals]
+
+        def is_invalid(number):
+            index = bisect_right(starts, number) - 1
+            return index >= 0 and intervals[index][1] >= number
+
+        sequence.flush(["number_next", "number_increment"])
+        self.env.cr.execute(
+            "SELECT number_next, number_increment FROM ir_sequence"
+            " WHERE id = %s FOR UPDATE NOWAIT",
+            (sequence.id,),
+        )
+        number_next, number_increment = self.env.cr.fetchone()
+
+        document_numbers = []
+        while len(document_numbers) < count:
+            candidates = []
+            while len(candidates) < count - len(document_numbers):
+                if not is_invalid(number_next):
+                    candidates.append(sequence.get_next_char(number_next))
+                number_next += number_increment
+            in_use = self._get_numbers_in_use(candidates)
+            document_numbers += [n for n in candidates if n not in in_use]
+
+        self.env.cr.execute(
+            "UPDATE ir_sequence SET number_next = %s WHERE id = %s",
+            (number_next, sequence.id),
+        )
+        sequence.invalidate_cache(["number_next"], sequence.ids)
+        return document_numbers
+
+    def _reserve_numbers_by_sequence(self, count):
+        document_numbers = []
+        while len(document_numbers) < count:
+            document_number = self.internal_sequence_id._next()
+            if not self._is_invalid_number(
+                document_number
+            ) and not self.check_number_in_use(document_number):
+                document_numbers.append(document_number)
+        return document_numbers
 
     def check_number_in_use(self, document_number):
         """Check if a document with the same number already exists, this can
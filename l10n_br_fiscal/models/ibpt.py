@@ -2,9 +2,12 @@
 # Copyright (C) 2019  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+import threading
+import time
 from collections import namedtuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from odoo import _
 from odoo.exceptions import UserError
@@ -18,13 +21,54 @@ WS_IBPT = {
 }
 
 
-DeOlhoNoImposto = namedtuple("Config", "token cnpj uf ibpt_request_timeout")
+DeOlhoNoImposto = namedtuple(
+    "Config",
+    "token cnpj uf ibpt_request_timeout session url",
+    defaults=(None, None),
+)
 
 
-def _request(ws_url, params, ibpt_request_timeout=30):
+def get_session(pool_size=10):
+    """HTTP session keeping up to pool_size connections to the IBPT alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Space the requests shared by several threads to at most rate
+    requests per second, a falsy rate disables the limit."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / float(rate) if rate else 0.0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _ws_url(config, service):
+    if config.url:
+        return "{}/{}?".format(
+            config.url.rstrip("/"), "produtos" if service == WS_PRODUTOS else "servicos"
+        )
+    return WS_IBPT[service]
+
+
+def _request(ws_url, params, ibpt_request_timeout=30, session=None):
     try:
-        response = requests.get(
-            ws_url, params=params, timeout=int(ibpt_request_timeout)
+        response = (session or requests).get(
+            ws_url, params=params, timeout=int(ibpt_request_timeout or 30)
         )
         if response.ok:
             data = response.json()
@@ -64,7 +108,12 @@ def get_ibpt_product(
         "gtin": gtin,
     }
 
-    return _request(WS_IBPT[WS_PRODUTOS], data, config.ibpt_request_timeout)
+    return _request(
+        _ws_url(config, WS_PRODUTOS),
+        data,
+        config.ibpt_request_timeout,
+        config.session,
+    )
 
 
 def get_ibpt_service(config, nbs, description="", uom="", amount="0"):
@@ -78,4 +127,9 @@ def get_ibpt_service(config, nbs, description="", uom="", amount="0"):
         "valor": amount,
     }
 
-    return _request(WS_IBPT[WS_SERVICOS], data, config.ibpt_request_timeout)
+    return _request(
+        _ws_url(config, WS_SERVICOS),
+        data,
+        config.ibpt_request_timeout,
+        config.session,
+    )
@@ -1,9 +1,11 @@
 # Copyright (C) 2019  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
+from collections import namedtuple
+
 from lxml import etree
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 
 from ..constants.fiscal import (
     FINAL_CUSTOMER_YES,
@@ -46,6 +48,92 @@ VIEW = """
 </page>
 """  # noqa
 
+TaxDefinitionEntry = namedtuple(
+    "TaxDefinitionEntry",
+    [
+        "id",
+        "state_from_id",
+        "state_to_ids",
+        "ncm_ids",
+        "nbm_ids",
+        "cest_ids",
+        "product_ids",
+        "is_benefit",
+        "ind_final",
+    ],
+)
+
+
+# Rank the candidates of a tax definition domain and keep the winners:
+# a single candidate always wins, otherwise benefit definitions matching
+# the product keys win over specific ones, which win over generic ones.
+# When a winner is restricted to final customers, ind_final must match.
+TAX_DEFINITION_SEARCH_QUERY = """
+    WITH candidate AS (
+        SELECT d.id,
+               d.ind_final,
+               (
+                   EXISTS (
+                       SELECT 1 FROM tax_definition_ncm_rel r
+                       WHERE r.tax_definition_id = d.id AND r.ncm_id = %s
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_nbm_rel r
+                       WHERE r.tax_definition_id = d.id AND r.nbm_id = %s
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_cest_rel r
+                       WHERE r.tax_definition_id = d.id AND r.cest_id = %s
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_product_rel r
+                       WHERE r.tax_definition_id = d.id AND r.product_id = %s
+                   )
+               ) AS is_specific,
+               NOT (
+                   EXISTS (
+                       SELECT 1 FROM tax_definition_ncm_rel r
+                       WHERE r.tax_definition_id = d.id
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_nbm_rel r
+                       WHERE r.tax_definition_id = d.id
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_cest_rel r
+                       WHERE r.tax_definition_id = d.id
+                   ) OR EXISTS (
+                       SELECT 1 FROM tax_definition_product_rel r
+                       WHERE r.tax_definition_id = d.id
+                   )
+               ) AS is_generic,
+               COALESCE(d.is_benefit, FALSE) AS is_benefit
+          FROM l10n_br_fiscal_tax_definition d
+         WHERE d.id IN (
+               SELECT "l10n_br_fiscal_tax_definition".id
+                 FROM {from_clause}
+                WHERE {where_clause}
+         )
+    ), ranked AS (
+        SELECT id,
+               ind_final,
+               CASE
+                   WHEN is_benefit AND is_specific THEN 1
+                   WHEN NOT is_benefit AND is_specific THEN 2
+                   WHEN NOT is_benefit AND is_generic THEN 3
+               END AS tier,
+               COUNT(*) OVER () AS candidates
+          FROM candidate
+    ), winner AS (
+        SELECT id, ind_final, candidates
+          FROM ranked
+         WHERE candidates = 1
+            OR tier = (SELECT MIN(tier) FROM ranked)
+    )
+    SELECT w.id
+      FROM winner w
+     WHERE w.candidates = 1
+        OR NOT EXISTS (SELECT 1 FROM winner x WHERE x.ind_final = %s)
+        OR w.ind_final = %s
+        OR (%s AND w.ind_final IS NULL)
+     ORDER BY w.id
+"""
+
 
 class ICMSRegulation(models.Model):
     _name = "l10n_br_fiscal.icms.regulation"
@@ -1896,6 +1984,13 @@ class ICMSRegulation(models.Model):
         ],
     )
 
+    def write(self, values):
+        result = super().write(values)
+        if {"icms_imported_tax_id"}.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     @api.model
     def fields_view_get(
         self, view_id=None, view_type="form", toolbar=False, submenu=False
@@ -1903,31 +1998,41 @@ class ICMSRegulation(models.Model):
         view_super = super().fields_view_get(view_id, view_type, toolbar, submenu)
 
         if view_type == "form":
-            doc = etree.fromstring(view_super.get("arch"))
+            view_super["arch"] = self._get_form_view_arch(view_super["arch"])
 
-            for node in doc.xpath("//notebook"):
-                br_states = self.env["res.country.state"].search(
-                    [("country_id", "=", self.env.ref("base.br").id)], order="code"
-                )
+        return view_super
+
+    @api.model
+    @tools.ormcache("arch", "self.env.lang")
+    def _get_form_view_arch(self, arch):
+        """Return the form arch with a notebook page per brazilian state.
+
+        The generated arch is kept until the registry caches are cleared,
+        on module install or update and when a state or a tax group changes.
+        """
+        doc = etree.fromstring(arch)
+
+        for node in doc.xpath("//notebook"):
+            br_states = self.env["res.country.state"].search(
+                [("country_id", "=", self.env.ref("base.br").id)], order="code"
+            )
 
-                i = 0
-                for state in br_states:
-                    i += 1
-                    state_page = VIEW.format(
-                        state.code.lower(),
-                        state.name,
-                        self.env.ref("l10n_br_fiscal.tax_group_icms").id,
-                        self.env.ref("l10n_br_fiscal.tax_group_icmsst").id,
-                        self.env.ref("l10n_br_fiscal.tax_group_icmsfcp").id,
-                        self.env.ref("l10n_br_fiscal.tax_group_icmsfcp_st").id,
-                        state.id,
-                    )
-                    node_page = etree.fromstring(state_page)
-                    node.insert(i, node_page)
-
-            view_super["arch"] = etree.tostring(doc, encoding="unicode")
+            i = 0
+            for state in br_states:
+                i += 1
+                state_page = VIEW.format(
+                    state.code.lower(),
+                    state.name,
+                    self.env.ref("l10n_br_fiscal.tax_group_icms").id,
+                    self.env.ref("l10n_br_fiscal.tax_group_icmsst").id,
+                    self.env.ref("l10n_br_fiscal.tax_group_icmsfcp").id,
+                    self.env.ref("l10n_br_fiscal.tax_group_icmsfcp_st").id,
+                    state.id,
+                )
+                node_page = etree.fromstring(state_page)
+                node.insert(i, node_page)
 
-        return view_super
+        return etree.tostring(doc, encoding="unicode")
 
     def _build_map_tax_def_domain(
         self,
@@ -1976,56 +2081,207 @@ class ICMSRegulation(models.Model):
         return domain
 
     def _tax_definition_search(self, domain, ncm, nbm, cest, product, ind_final=None):
+        """Return the winning tax definitions matching domain.
+
+        The precedence (benefit > specific > generic, then ind_final) is
+        resolved by a single query over the relation tables, so candidate
+        definitions and their many2many sets are never loaded."""
         tax_definitions = self.env["l10n_br_fiscal.tax.definition"]
-        icms_defs = tax_definitions.search(domain)
+        tax_definitions.flush()
+        query = tax_definitions._where_calc(domain)
+        tax_definitions._apply_ir_rules(query, "read")
+        from_clause, where_clause, where_params = query.get_sql()
+
+        def value(record):
+            return record and record.id or None
+
+        specific_params = [value(ncm), value(nbm), value(cest), value(product)]
+        self.env.cr.execute(
+            TAX_DEFINITION_SEARCH_QUERY.format(
+                from_clause=from_clause, where_clause=where_clause or "TRUE"
+            ),
+            specific_params
+            + where_params
+            + [FINAL_CUSTOMER_YES, ind_final or None, ind_final is False],
+        )
+        return tax_definitions.browse([row[0] for row in self.env.cr.fetchall()])
 
-        if len(icms_defs) == 1:
-            tax_definitions |= icms_defs
-        else:
-            icms_defs_benefit = icms_defs.filtered(
-                lambda d: (
-                    ncm.id in d.ncm_ids.ids
-                    or nbm.id in d.nbm_ids.ids
-                    or cest.id in d.cest_ids.ids
-                    or product.id in d.product_ids.ids
-                )
-                and d.is_benefit
+    @api.model
+    @tools.ormcache(
+        "self.env['l10n_br_fiscal.cache.version']"
+        "._get_version('l10n_br_fiscal.tax.definition')",
+        "self.env.uid",
+        "self.env.su",
+        "tuple(self.env.companies.ids)",
+        "regulation_id",
+        "tax_group_id",
+    )
+    def _get_tax_definition_index(self, regulation_id, tax_group_id):
+        """Compile the approved tax definitions of a regulation and tax
+        group into an in-memory index keyed by destination state.
+        The index lives in the registry cache, keyed by the version of the
+        tax definition caches which is bumped when they change. It is
+        searched with the record rules of the user, so it is also keyed
+        by the user and the allowed companies."""
+        tax_defs = self.env["l10n_br_fiscal.tax.definition"].search(
+            [
+                ("icms_regulation_id", "=", regulation_id),
+                ("state", "=", "approved"),
+                ("tax_group_id", "=", tax_group_id),
+            ],
+            order="id",
+        )
+        entries = tuple(
+            TaxDefinitionEntry(
+                id=d.id,
+                state_from_id=d.state_from_id.id,
+                state_to_ids=frozenset(d.state_to_ids.ids),
+                ncm_ids=frozenset(d.ncm_ids.ids),
+                nbm_ids=frozenset(d.nbm_ids.ids),
+                cest_ids=frozenset(d.cest_ids.ids),
+                product_ids=frozenset(d.product_ids.ids),
+                is_benefit=d.is_benefit,
+                ind_final=d.ind_final,
             )
-            icms_defs_specific = icms_defs.filtered(
-                lambda d: (
-                    ncm.id in d.ncm_ids.ids
-                    or nbm.id in d.nbm_ids.ids
-                    or cest.id in d.cest_ids.ids
-                    or product.id in d.product_ids.ids
-                )
-                and not d.is_benefit
+            for d in tax_defs
+        )
+
+        by_state_to = {}
+        for entry in entries:
+            for state_id in entry.state_to_ids or (False,):
+                by_state_to.setdefault(state_id, []).append(entry)
+
+        return entries, {k: tuple(v) for k, v in by_state_to.items()}
+
+    @api.model
+    def _rank_tax_definitions(
+        self, candidates, ncm_id, nbm_id, cest_id, product_id, ind_final=None
+    ):
+        """Same precedence as _tax_definition_search (benefit > specific >
+        generic, then ind_final) applied over index entries."""
+        if len(candidates) == 1:
+            return candidates
+
+        def is_specific(d):
+            return (
+                ncm_id in d.ncm_ids
+                or nbm_id in d.nbm_ids
+                or cest_id in d.cest_ids
+                or product_id in d.product_ids
             )
-            icms_defs_generic = icms_defs.filtered(
-                lambda d: not d.ncm_ids.ids
-                and not d.nbm_ids.ids
-                and not d.cest_ids.ids
-                and not d.product_ids.ids
+
+        result = [d for d in candidates if d.is_benefit and is_specific(d)]
+        if not result:
+            result = [d for d in candidates if not d.is_benefit and is_specific(d)]
+        if not result:
+            result = [
+                d
+                for d in candidates
+                if not d.ncm_ids
+                and not d.nbm_ids
+                and not d.cest_ids
+                and not d.product_ids
                 and not d.is_benefit
-            )
+            ]
 
-            if icms_defs_benefit:
-                tax_definitions |= icms_defs_benefit
-            else:
-                if icms_defs_specific:
-                    tax_definitions |= icms_defs_specific
-                else:
-                    tax_definitions |= icms_defs_generic
+        if any(d.ind_final == FINAL_CUSTOMER_YES for d in result):
+            result = [d for d in result if ind_final == d.ind_final]
 
-            tax_definitions_with_ind_final = tax_definitions.filtered(
-                lambda d: d.ind_final == FINAL_CUSTOMER_YES
-            )
+        return result
 
-            if tax_definitions_with_ind_final:
-                tax_definitions = tax_definitions.filtered(
-                    lambda d: ind_final == d.ind_final
-                )
+    @api.model
+    @tools.ormcache(
+        "self.env['l10n_br_fiscal.cache.version']"
+        "._get_version('l10n_br_fiscal.tax.definition')",
+        "self.env.uid",
+        "self.env.su",
+        "tuple(self.env.companies.ids)",
+        "regulation_id",
+        "tax_group_id",
+        "state_from_id",
+        "state_to_id",
+        "ncm_id",
+        "nbm_id",
+        "cest_id",
+        "product_id",
+        "ind_final",
+    )
+    def _get_tax_definition_ids(
+        self,
+        regulation_id,
+        tax_group_id,
+        state_from_id,
+        state_to_id,
+        ncm_id,
+        nbm_id,
+        cest_id,
+        product_id,
+        ind_final,
+    ):
+        """Resolve the winning tax definitions for a fiscal key, mirroring
+        the domain built by _build_map_tax_def_domain. Keyed like the
+        index it reads, by the user and the allowed companies."""
+        entries, by_state_to = self._get_tax_definition_index(
+            regulation_id, tax_group_id
+        )
+        tax_domain = (
+            self.env["l10n_br_fiscal.tax.group"].browse(tax_group_id).tax_domain
+        )
 
-        return tax_definitions
+        def x2m_match(ids, value):
+            return value in ids if value else not ids
+
+        if tax_domain in (
+            TAX_DOMAIN_ICMS,
+            TAX_DOMAIN_ICMS_ST,
+            TAX_DOMAIN_ICMS_FCP,
+            TAX_DOMAIN_ICMS_FCP_ST,
+        ):
+            candidates = by_state_to.get(state_to_id, ())
+        else:
+            candidates = entries
+
+        if tax_domain in (TAX_DOMAIN_ICMS, TAX_DOMAIN_ICMS_ST, TAX_DOMAIN_ICMS_FCP_ST):
+            candidates = [d for d in candidates if d.state_from_id == state_from_id]
+
+        if tax_domain in (TAX_DOMAIN_ICMS_ST, TAX_DOMAIN_ICMS_FCP_ST):
+            candidates = [
+                d
+                for d in candidates
+                if x2m_match(d.ncm_ids, ncm_id)
+                and x2m_match(d.nbm_ids, nbm_id)
+                and x2m_match(d.cest_ids, cest_id)
+            ]
+
+        tax_defs = self._rank_tax_definitions(
+            candidates, ncm_id, nbm_id, cest_id, product_id, ind_final
+        )
+        return tuple(d.id for d in tax_defs)
+
+    def _tax_definition_lookup(
+        self, company, partner, tax_group, ncm, nbm, cest, product, ind_final=None
+    ):
+        self.ensure_one()
+        if self.env.context.get("no_tax_definition_index"):
+            domain = self._build_map_tax_def_domain(
+                company, partner, tax_group, ncm, nbm, cest
+            )
+            return self._tax_definition_search(
+                domain, ncm, nbm, cest, product, ind_final
+            )
+
+        tax_definition_ids = self._get_tax_definition_ids(
+            self.id,
+            tax_group.id,
+            company.state_id.id,
+            partner.state_id.id,
+            ncm and ncm.id or False,
+            nbm and nbm.id or False,
+            cest and cest.id or False,
+            product and product.id or False,
+            ind_final,
+        )
+        return self.env["l10n_br_fiscal.tax.definition"].browse(tax_definition_ids)
 
     def _map_tax_def_icms(
         self,
@@ -2054,12 +2310,8 @@ class ICMSRegulation(models.Model):
             icms_taxes |= self.icms_imported_tax_id
         else:
             # ICMS
-            domain = self._build_map_tax_def_domain(
-                company, partner, tax_group_icms, ncm, nbm, cest
-            )
-
-            tax_definitions = self._tax_definition_search(
-                domain, ncm, nbm, cest, product, ind_final
+            tax_definitions = self._tax_definition_lookup(
+                company, partner, tax_group_icms, ncm, nbm, cest, product, ind_final
             )
         return icms_taxes, tax_definitions
 
@@ -2078,12 +2330,8 @@ class ICMSRegulation(models.Model):
         tax_group_icmsst = self.env.ref("l10n_br_fiscal.tax_group_icmsst")
 
         # ICMS ST
-        domain = self._build_map_tax_def_domain(
-            company, partner, tax_group_icmsst, ncm, nbm, cest
-        )
-
-        tax_definitions = self._tax_definition_search(
-            domain, ncm, nbm, cest, product, ind_final
+        tax_definitions = self._tax_definition_lookup(
+            company, partner, tax_group_icmsst, ncm, nbm, cest, product, ind_final
         )
         return tax_definitions
 
@@ -2109,12 +2357,8 @@ class ICMSRegulation(models.Model):
             or operation_line.fiscal_operation_id.fiscal_type == "return_in"
             and operation_line.fiscal_operation_type == FISCAL_IN
         ):
-            domain = self._build_map_tax_def_domain(
-                partner, partner, tax_group_icms, ncm, nbm, cest
-            )
-
-            tax_definitions = self._tax_definition_search(
-                domain, ncm, nbm, cest, product, ind_final
+            tax_definitions = self._tax_definition_lookup(
+                partner, partner, tax_group_icms, ncm, nbm, cest, product, ind_final
             )
         return tax_definitions.mapped("tax_id"), tax_definitions
 
@@ -2141,12 +2385,8 @@ class ICMSRegulation(models.Model):
             or operation_line.fiscal_operation_id.fiscal_type == "return_in"
             and operation_line.fiscal_operation_type == FISCAL_IN
         ):
-            domain = self._build_map_tax_def_domain(
-                partner, partner, tax_group_icmsfcp, ncm, nbm, cest
-            )
-
-            tax_definitions = self._tax_definition_search(
-                domain, ncm, nbm, cest, product, ind_final
+            tax_definitions = self._tax_definition_lookup(
+                partner, partner, tax_group_icmsfcp, ncm, nbm, cest, product, ind_final
             )
 
         return tax_definitions
@@ -2167,12 +2407,8 @@ class ICMSRegulation(models.Model):
         tax_group_icmsfcpst = self.env.ref("l10n_br_fiscal.tax_group_icmsfcp_st")
 
         # FCP ST
-        domain = self._build_map_tax_def_domain(
-            company, partner, tax_group_icmsfcpst, ncm, nbm, cest
-        )
-
-        tax_definitions = self._tax_definition_search(
-            domain, ncm, nbm, cest, product, ind_final
+        tax_definitions = self._tax_definition_lookup(
+            company, partner, tax_group_icmsfcpst, ncm, nbm, cest, product, ind_final
         )
 
         return tax_definitions
@@ -86,5 +86,12 @@ class Ncm(models.Model):
         )
     ]
 
+    def write(self, values):
+        result = super().write(values)
+        if {"tax_ipi_id", "tax_ii_id"}.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     def _get_ibpt(self, config, code_unmasked):
         return get_ibpt_product(config, code_unmasked)
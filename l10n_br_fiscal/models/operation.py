@@ -160,6 +160,13 @@ class Operation(models.Model):
         self.write({"state": "draft"})
         self.line_ids.write({"state": "draft"})
 
+    def write(self, values):
+        result = super().write(values)
+        if {"fiscal_operation_type", "fiscal_type"}.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     def unlink(self):
         operations = self.filtered(lambda line: line.state == "approved")
         if operations:
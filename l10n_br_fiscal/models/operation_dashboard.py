@@ -39,16 +39,17 @@ class Operation(models.Model):
     #         query = self._where_calc(args)
     #         self._apply_ir_rules(query, 'read')
     def _compute_kanban_dashboard(self):
+        counters = self._get_dashboard_counters()
         for operation in self:
             operation.kanban_dashboard = json.dumps(
-                operation.get_operation_dashboard_data()
+                operation.get_operation_dashboard_data(counters[operation.id])
             )
 
     kanban_dashboard = fields.Text(compute="_compute_kanban_dashboard")
 
     color = fields.Integer(string="Color Index", default=0)
 
-    def get_operation_dashboard_data(self):
+    def get_operation_dashboard_data(self, counters=None):
         self.ensure_one()
         title = ""
         if self.fiscal_type in ("sale", "purchase"):
@@ -58,16 +59,43 @@ class Operation(models.Model):
                 else _("Invoices owed to you")
             )
 
-        number_2confirm = self._get_number_2confirm_documents()
-        number_authorized = self._get_authorized_documents()
-        number_cancelled = self._get_cancelled_documents()
+        if counters is None:
+            counters = self._get_dashboard_counters()[self.id]
 
-        return {
-            "number_2confirm": number_2confirm,
-            "number_authorized": number_authorized,
-            "number_cancelled": number_cancelled,
-            "title": title,
+        return dict(counters, title=title)
+
+    def _get_dashboard_document_domain(self):
+        return [("fiscal_operation_id", "in", self.ids)]
+
+    def _get_dashboard_counters(self):
+        """Count the documents of all operations by dashboard column
+        with a single grouped query"""
+        counters = {
+            operation.id: {
+                "number_2confirm": 0,
+                "number_authorized": 0,
+                "number_cancelled": 0,
+            }
+            for operation in self
         }
+        if not self.ids:
+            return counters
+
+        groups = self._fiscal_document_object().read_group(
+            self._get_dashboard_document_domain(),
+            ["fiscal_operation_id", "state_edoc"],
+            ["fiscal_operation_id", "state_edoc"],
+            lazy=False,
+        )
+        for group in groups:
+            operation_counters = counters[group["fiscal_operation_id"][0]]
+            if group["state_edoc"] in EDOC_2_CONFIRM:
+                operation_counters["number_2confirm"] += group["__count"]
+            elif group["state_edoc"] == SITUACAO_EDOC_AUTORIZADA:
+                operation_counters["number_authorized"] += group["__count"]
+            elif group["state_edoc"] in EDOC_CANCELED:
+                operation_counters["number_cancelled"] += group["__count"]
+        return counters
 
     def _fiscal_document_object(self):
         return self.env["l10n_br_fiscal.document"]
@@ -1,8 +1,9 @@
 # Copyright (C) 2019  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError
+from odoo.tools.cache import STAT
 
 from ..constants.fiscal import (
     CFOP_DESTINATION_EXPORT,
@@ -205,122 +206,274 @@ class OperationLine(models.Model):
         service_type=None,
         ind_final=None,
     ):
-        mapping_result = {
-            "taxes": {},
-            "cfop": False,
-            "ipi_guideline": self.env.ref("l10n_br_fiscal.tax_guideline_999"),
-            "icms_tax_benefit_id": False,
+        return self.map_fiscal_taxes_multi(
+            company,
+            partner,
+            [
+                {
+                    "product": product,
+                    "ncm": ncm,
+                    "nbm": nbm,
+                    "nbs": nbs,
+                    "cest": cest,
+                    "city_taxation_code": city_taxation_code,
+                    "service_type": service_type,
+                    "ind_final": ind_final,
+                }
+            ],
+        )[0]
+
+    def _get_fiscal_mapping_key(self, values):
+        return tuple(
+            values[name].id if values.get(name) else False
+            for name in (
+                "product",
+                "ncm",
+                "nbm",
+                "nbs",
+                "cest",
+                "city_taxation_code",
+                "service_type",
+            )
+        ) + (values.get("ind_final"),)
+
+    def _get_fiscal_mapping_signature(self, company, partner, values):
+        """Everything map_fiscal_taxes depends on besides the tax
+        definitions, the ICMS regulation and the CFOP themselves, whose
+        changes clear the cache (see clear_caches calls and the version of
+        the tax definition caches)."""
+        product = values.get("product")
+        ncm = values.get("ncm") or product.ncm_id
+        nbm = values.get("nbm") or product.nbm_id
+        cest = values.get("cest") or product.cest_id
+        return (
+            company.id,
+            company.tax_framework,
+            company.state_id.id,
+            company.country_id.id,
+            partner.state_id.id,
+            partner.country_id.id,
+            partner.ind_ie_dest,
+            partner.fiscal_profile_id.id,
+            product.id,
+            product.icms_origin,
+            product.tax_icms_or_issqn,
+            ncm.id,
+            nbm.id,
+            cest.id,
+            values.get("nbs") and values["nbs"].id,
+            values.get("city_taxation_code") and values["city_taxation_code"].id,
+            values.get("service_type") and values["service_type"].id,
+            values.get("ind_final"),
+        )
+
+    @api.model
+    def _freeze_mapping_result(self, mapping_result):
+        return (
+            tuple(
+                (tax_domain, tuple(taxes.ids))
+                for tax_domain, taxes in mapping_result["taxes"].items()
+            ),
+            mapping_result["cfop"].id,
+            mapping_result["ipi_guideline"].id,
+            mapping_result["icms_tax_benefit_id"],
+        )
+
+    @api.model
+    def _thaw_mapping_result(self, frozen_result):
+        taxes, cfop_id, ipi_guideline_id, icms_tax_benefit_id = frozen_result
+        tax_model = self.env["l10n_br_fiscal.tax"]
+        return {
+            "taxes": {
+                tax_domain: tax_model.browse(tax_ids) for tax_domain, tax_ids in taxes
+            },
+            "cfop": self.env["l10n_br_fiscal.cfop"].browse(cfop_id),
+            "ipi_guideline": self.env["l10n_br_fiscal.tax.ipi.guideline"].browse(
+                ipi_guideline_id
+            ),
+            "icms_tax_benefit_id": icms_tax_benefit_id,
         }
 
+    @tools.ormcache(
+        "self.env['l10n_br_fiscal.cache.version']"
+        "._get_version('l10n_br_fiscal.tax.definition')",
+        "self.env.uid",
+        "self.env.su",
+        "tuple(self.env.companies.ids)",
+        "self.id",
+        "signature",
+    )
+    def _get_fiscal_mapping_cached(self, signature, key, compute_batch):
+        return self._freeze_mapping_result(compute_batch()[key])
+
+    @api.model
+    def get_fiscal_mapping_cache_stats(self):
+        """Hit and miss counters of the fiscal mapping cache of this
+        database, since the worker started."""
+        stats = {"hit": 0, "miss": 0}
+        for (db_name, model_name, method), counter in STAT.items():
+            if (
+                db_name == self.pool.db_name
+                and model_name == self._name
+                and method.__name__ == "_get_fiscal_mapping_cached"
+            ):
+                stats["hit"] += counter.hit
+                stats["miss"] += counter.miss
+        return stats
+
+    def map_fiscal_taxes_multi(self, company, partner, lines):
+        """Map the fiscal taxes of several document lines at once.
+
+        :param lines: list of dicts with the product, ncm, nbm, nbs, cest,
+            city_taxation_code, service_type and ind_final of each line
+            (same keywords as map_fiscal_taxes)
+        :return: list with one mapping result per line, in the same order
+
+        Identical lines are mapped only once and the results are memoized
+        in the registry cache by fiscal signature. Lines missing from the
+        cache are mapped together, reading the tax definitions of the
+        company, operation line, CFOP and partner profile in a single
+        batch.
+        """
         self.ensure_one()
 
-        # Define CFOP
-        mapping_result["cfop"] = self._get_cfop(company, partner)
+        unique_keys = {}
+        for values in lines:
+            unique_keys.setdefault(self._get_fiscal_mapping_key(values), values)
 
-        # 1 Get Tax Defs from Company
-        for tax_definition in company.tax_definition_ids.map_tax_definition(
-            company,
-            partner,
-            product,
-            ncm=ncm,
-            nbm=nbm,
-            nbs=nbs,
-            cest=cest,
-            city_taxation_code=city_taxation_code,
-            service_type=service_type,
-        ):
-            self._build_mapping_result(mapping_result, tax_definition)
-
-        # 2 From NCM
-        if not ncm and product:
-            ncm = product.ncm_id
-
-        if company.tax_framework == TAX_FRAMEWORK_NORMAL:
-            tax_ipi = ncm.tax_ipi_id
-            tax_ii = ncm.tax_ii_id
-            mapping_result["taxes"][tax_ipi.tax_domain] = tax_ipi
-
-            if mapping_result["cfop"].destination == CFOP_DESTINATION_EXPORT:
-                mapping_result["taxes"][tax_ii.tax_domain] = tax_ii
-
-            # 3 From ICMS Regulation
-            if company.icms_regulation_id:
-                icms_taxes, icms_tax_defs = company.icms_regulation_id.map_tax(
-                    company=company,
-                    partner=partner,
-                    product=product,
-                    ncm=ncm,
-                    nbm=nbm,
-                    cest=cest,
-                    operation_line=self,
-                    ind_final=ind_final,
+        batch = {}
+
+        def compute_batch():
+            if not batch:
+                batch.update(
+                    self._map_fiscal_taxes_batch(company, partner, unique_keys)
                 )
+            return batch
 
-                for tax_def in icms_tax_defs:
-                    self._build_mapping_result_icms(mapping_result, tax_def)
+        mappings = {
+            key: self._get_fiscal_mapping_cached(
+                self._get_fiscal_mapping_signature(company, partner, values),
+                key,
+                compute_batch,
+            )
+            for key, values in unique_keys.items()
+        }
 
-                for tax in icms_taxes:
-                    mapping_result["taxes"][tax.tax_domain] = tax
+        return [
+            self._thaw_mapping_result(mappings[self._get_fiscal_mapping_key(values)])
+            for values in lines
+        ]
 
-        # 4 From Operation Line
-        for tax_definition in self.tax_definition_ids.map_tax_definition(
-            company,
-            partner,
-            product,
-            ncm=ncm,
-            nbm=nbm,
-            nbs=nbs,
-            cest=cest,
-            city_taxation_code=city_taxation_code,
-            service_type=service_type,
-        ):
-            self._build_mapping_result(mapping_result, tax_definition)
-
-        # 5 From CFOP
-        for tax_definition in mapping_result[
-            "cfop"
-        ].tax_definition_ids.map_tax_definition(
-            company,
-            partner,
-            product,
-            ncm=ncm,
-            nbm=nbm,
-            nbs=nbs,
-            cest=cest,
-            city_taxation_code=city_taxation_code,
-            service_type=service_type,
-        ):
-            self._build_mapping_result(mapping_result, tax_definition)
-
-        # 6 From Partner Profile
-        for (
-            tax_definition
-        ) in partner.fiscal_profile_id.tax_definition_ids.map_tax_definition(
-            company,
-            partner,
-            product,
-            ncm=ncm,
-            nbm=nbm,
-            nbs=nbs,
-            cest=cest,
-            city_taxation_code=city_taxation_code,
-            service_type=service_type,
-        ):
-            self._build_mapping_result(mapping_result, tax_definition)
-
-        if product.tax_icms_or_issqn == TAX_DOMAIN_ICMS:
-            mapping_result["taxes"].pop(TAX_DOMAIN_ISSQN, None)
-        elif product.tax_icms_or_issqn == TAX_DOMAIN_ISSQN:
-            mapping_result["taxes"].pop(TAX_DOMAIN_ICMS, None)
-        else:
-            mapping_result["taxes"].pop(TAX_DOMAIN_ICMS, None)
-            mapping_result["taxes"].pop(TAX_DOMAIN_ISSQN, None)
+    def _map_fiscal_taxes_batch(self, company, partner, unique_keys):
+        self.ensure_one()
+        keys = list(unique_keys.values())
+
+        # Define CFOP
+        cfop = self._get_cfop(company, partner)
+        ipi_guideline = self.env.ref("l10n_br_fiscal.tax_guideline_999")
+
+        # 1 Company, 4 Operation Line, 5 CFOP, 6 Partner Profile
+        company_defs = company.tax_definition_ids.map_tax_definition_multi(
+            company, partner, keys
+        )
+        operation_line_defs = self.tax_definition_ids.map_tax_definition_multi(
+            company, partner, keys
+        )
+        cfop_defs = cfop.tax_definition_ids.map_tax_definition_multi(
+            company, partner, keys
+        )
+        profile_defs = (
+            partner.fiscal_profile_id.tax_definition_ids.map_tax_definition_multi(
+                company, partner, keys
+            )
+        )
+
+        mappings = {}
+        for index, (key, values) in enumerate(unique_keys.items()):
+            product = values.get("product")
+            ncm = values.get("ncm")
+            mapping_result = {
+                "taxes": {},
+                "cfop": cfop,
+                "ipi_guideline": ipi_guideline,
+                "icms_tax_benefit_id": False,
+            }
 
-        return mapping_result
+            # 1 Get Tax Defs from Company
+            for tax_definition in company_defs[index]:
+                self._build_mapping_result(mapping_result, tax_definition)
+
+            # 2 From NCM
+            if not ncm and product:
+                ncm = product.ncm_id
+
+            if company.tax_framework == TAX_FRAMEWORK_NORMAL:
+                tax_ipi = ncm.tax_ipi_id
+                tax_ii = ncm.tax_ii_id
+                mapping_result["taxes"][tax_ipi.tax_domain] = tax_ipi
+
+                if cfop.destination == CFOP_DESTINATION_EXPORT:
+                    mapping_result["taxes"][tax_ii.tax_domain] = tax_ii
+
+                # 3 From ICMS Regulation
+                if company.icms_regulation_id:
+                    icms_taxes, icms_tax_defs = company.icms_regulation_id.map_tax(
+                        company=company,
+                        partner=partner,
+                        product=product,
+                        ncm=ncm,
+                        nbm=values.get("nbm"),
+                        cest=values.get("cest"),
+                        operation_line=self,
+                        ind_final=values.get("ind_final"),
+                    )
+
+                    for tax_def in icms_tax_defs:
+                        self._build_mapping_result_icms(mapping_result, tax_def)
+
+                    for tax in icms_taxes:
+                        mapping_result["taxes"][tax.tax_domain] = tax
+
+            # 4 From Operation Line
+            for tax_definition in operation_line_defs[index]:
+                self._build_mapping_result(mapping_result, tax_definition)
+
+            # 5 From CFOP
+            for tax_definition in cfop_defs[index]:
+                self._build_mapping_result(mapping_result, tax_definition)
+
+            # 6 From Partner Profile
+            for tax_definition in profile_defs[index]:
+                self._build_mapping_result(mapping_result, tax_definition)
+
+            if product.tax_icms_or_issqn == TAX_DOMAIN_ICMS:
+                mapping_result["taxes"].pop(TAX_DOMAIN_ISSQN, None)
+            elif product.tax_icms_or_issqn == TAX_DOMAIN_ISSQN:
+                mapping_result["taxes"].pop(TAX_DOMAIN_ICMS, None)
+            else:
+                mapping_result["taxes"].pop(TAX_DOMAIN_ICMS, None)
+                mapping_result["taxes"].pop(TAX_DOMAIN_ISSQN, None)
+
+            mappings[key] = mapping_result
+
+        return mappings
 
     def action_review(self):
         self.write({"state": "review"})
 
+    def write(self, values):
+        result = super().write(values)
+        if {
+            "fiscal_operation_id",
+            "cfop_internal_id",
+            "cfop_external_id",
+            "cfop_export_id",
+            "tax_definition_ids",
+        }.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     def unlink(self):
         lines = self.filtered(lambda line: line.state == "approved")
         if lines:
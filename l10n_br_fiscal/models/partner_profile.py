@@ -46,7 +46,11 @@ class PartnerProfile(models.Model):
     )
 
     partner_ids = fields.One2many(
-        comodel_name="res.partner", string="Partner", compute="_compute_partner_info"
+        comodel_name="res.partner",
+        inverse_name="fiscal_profile_id",
+        string="Partner",
+        readonly=True,
+        context={"active_test": False},
     )
 
     partner_qty = fields.Integer(
@@ -68,17 +72,18 @@ class PartnerProfile(models.Model):
     ]
 
     def _compute_partner_info(self):
-        for record in self:
-            partners = record.env["res.partner"].search(
-                [
-                    ("fiscal_profile_id", "=", record.id),
-                    "|",
-                    ("active", "=", False),
-                    ("active", "=", True),
-                ]
+        partner_counts = {
+            group["fiscal_profile_id"][0]: group["fiscal_profile_id_count"]
+            for group in self.env["res.partner"]
+            .with_context(active_test=False)
+            .read_group(
+                [("fiscal_profile_id", "in", self.ids)],
+                ["fiscal_profile_id"],
+                ["fiscal_profile_id"],
             )
-            record.partner_ids = partners
-            record.partner_qty = len(partners)
+        }
+        for record in self:
+            record.partner_qty = partner_counts.get(record.id, 0)
 
     @api.constrains("default", "is_company")
     def _check_default(self):
@@ -107,6 +112,13 @@ class PartnerProfile(models.Model):
         if not self.is_company:
             self.tax_framework = False
 
+    def write(self, values):
+        result = super().write(values)
+        if {"tax_definition_ids"}.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        return result
+
     def action_view_partners(self):
         self.ensure_one()
         action = self.env.ref("base.action_partner_other_form").read()[0]
@@ -4,10 +4,15 @@
 
 import logging
 
-from odoo import api, fields, models
+from dateutil.relativedelta import relativedelta
+
+from odoo import SUPERUSER_ID, api, fields, models, registry
+from odoo.tools import date_utils, sql
 
 from ..constants.fiscal import (
     COEFFICIENT_R,
+    FISCAL_IN,
+    FISCAL_OUT,
     INDUSTRY_TYPE,
     INDUSTRY_TYPE_TRANSFORMATION,
     PROCESSADOR,
@@ -29,6 +34,8 @@ from ..constants.fiscal import (
     TAX_DOMAIN_ISSQN_WH,
     TAX_DOMAIN_PIS,
     TAX_DOMAIN_PIS_WH,
+    TAX_ENGINE,
+    TAX_ENGINE_DEFAULT,
     TAX_FRAMEWORK,
     TAX_FRAMEWORK_NORMAL,
     TAX_FRAMEWORK_SIMPLES,
@@ -37,6 +44,25 @@ from ..constants.fiscal import (
 
 _logger = logging.getLogger(__name__)
 
+# Gross revenue of the authorized sale documents of each company per month,
+# summed over the last 12 months for the Simples Nacional RBT12.
+COMPANY_REVENUE_TABLE = "l10n_br_fiscal_company_revenue"
+
+COMPANY_REVENUE_QUERY = f"""
+    SELECT d.company_id,
+           date_trunc('month', d.document_date)::date,
+           SUM(CASE WHEN d.fiscal_operation_type = '{FISCAL_OUT}'
+                    THEN d.amount_untaxed ELSE -d.amount_untaxed END)
+      FROM l10n_br_fiscal_document d
+      JOIN l10n_br_fiscal_operation o ON o.id = d.fiscal_operation_id
+     WHERE d.state_edoc = 'autorizada'
+       AND d.document_date IS NOT NULL
+       AND ((d.fiscal_operation_type = '{FISCAL_OUT}' AND o.fiscal_type = 'sale')
+            OR (d.fiscal_operation_type = '{FISCAL_IN}'
+                AND o.fiscal_type = 'sale_refund'))
+     GROUP BY 1, 2
+"""
+
 
 class ResCompany(models.Model):
     _inherit = "res.company"
@@ -60,6 +86,7 @@ class ResCompany(models.Model):
 
     @api.depends("cnae_main_id", "annual_revenue", "payroll_amount")
     def _compute_simplified_tax(self):
+        simplified_tax = self.env["l10n_br_fiscal.simplified.tax"]
         for record in self:
             record.coefficient_r = False
             if record.payroll_amount and record.annual_revenue:
@@ -68,25 +95,20 @@ class ResCompany(models.Model):
                     record.coefficient_r = True
                 record.coefficient_r_percent = coefficient_r_percent
 
-            simplified_tax_id = self.env["l10n_br_fiscal.simplified.tax"].search(
-                [
-                    ("cnae_ids", "=", record.cnae_main_id.id),
-                    ("coefficient_r", "=", record.coefficient_r),
-                ]
+            simplified_tax_id, tax_ranges = simplified_tax._get_simplified_tax_ranges(
+                record.cnae_main_id.id, record.coefficient_r
             )
             record.simplified_tax_id = simplified_tax_id
 
             if simplified_tax_id:
-                tax_range = record.env["l10n_br_fiscal.simplified.tax.range"].search(
-                    [
-                        ("simplified_tax_id", "=", simplified_tax_id.id),
-                        ("inital_revenue", "<=", record.annual_revenue),
-                        ("final_revenue", ">=", record.annual_revenue),
-                        ("simplified_tax_id.coefficient_r", "=", record.coefficient_r),
-                    ],
-                    limit=1,
+                record.simplified_tax_range_id = next(
+                    (
+                        range_id
+                        for range_id, inital_revenue, final_revenue in tax_ranges
+                        if inital_revenue <= record.annual_revenue <= final_revenue
+                    ),
+                    False,
                 )
-                record.simplified_tax_range_id = tax_range
 
                 if record.simplified_tax_range_id and record.annual_revenue:
                     record.simplified_tax_percent = round(
@@ -105,6 +127,110 @@ class ResCompany(models.Model):
                         record.currency_id.decimal_places,
                     )
 
+    def init(self):
+        if sql.table_exists(self.env.cr, COMPANY_REVENUE_TABLE):
+            return
+        self.env.cr.execute(
+            f"""
+            CREATE TABLE {COMPANY_REVENUE_TABLE} (
+                company_id INTEGER NOT NULL
+                    REFERENCES res_company(id) ON DELETE CASCADE,
+                month DATE NOT NULL,
+                amount NUMERIC NOT NULL DEFAULT 0,
+                PRIMARY KEY (company_id, month)
+            )
+            """
+        )
+        # Fill in the revenue of the documents of an existing database
+        if sql.column_exists(self.env.cr, "l10n_br_fiscal_document", "state_edoc"):
+            self.search([])._rebuild_fiscal_revenue()
+
+    def _rebuild_fiscal_revenue(self):
+        """Recompute the monthly revenue of the companies from their documents."""
+        if not self:
+            return
+        self.env["l10n_br_fiscal.document"].flush()
+        self.env.cr.execute(
+            f"DELETE FROM {COMPANY_REVENUE_TABLE} WHERE company_id IN %s",
+            (tuple(self.ids),),
+        )
+        self.env.cr.execute(
+            f"INSERT INTO {COMPANY_REVENUE_TABLE} (company_id, month, amount)"
+            f" SELECT * FROM ({COMPANY_REVENUE_QUERY}) r WHERE r.company_id IN %s",
+            (tuple(self.ids),),
+        )
+        self._refresh_annual_revenue()
+
+    def _add_fiscal_revenue(self, date, amount):
+        """Add the revenue of a document of this date to the accumulator."""
+        self.ensure_one()
+        month = date_utils.start_of(fields.Date.to_date(date), "month")
+        self.env.cr.execute(
+            f"""
+            INSERT INTO {COMPANY_REVENUE_TABLE} AS r (company_id, month, amount)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (company_id, month)
+            DO UPDATE SET amount = r.amount + EXCLUDED.amount
+            """,
+            (self.id, month, amount),
+        )
+        # The current month only counts in the RBT12 of the next ones
+        if month < date_utils.start_of(fields.Date.context_today(self), "month"):
+            self._refresh_annual_revenue_after_commit()
+
+    def _get_rbt12(self, date=None):
+        """Return the gross revenue of the 12 months before the date month."""
+        self.ensure_one()
+        period = date_utils.start_of(
+            fields.Date.to_date(date) or fields.Date.context_today(self), "month"
+        )
+        self.env.cr.execute(
+            f"SELECT COALESCE(SUM(amount), 0) FROM {COMPANY_REVENUE_TABLE}"
+            " WHERE company_id = %s AND month >= %s AND month < %s",
+            (self.id, period - relativedelta(months=12), period),
+        )
+        return float(self.env.cr.fetchone()[0])
+
+    def _refresh_annual_revenue(self):
+        """Update the annual revenue with the RBT12, which recomputes the
+        simplified tax range and percent when the revenue changes."""
+        for company in self.sudo().filtered("annual_revenue_auto"):
+            rbt12 = company._get_rbt12()
+            if company.currency_id.compare_amounts(rbt12, company.annual_revenue):
+                company.annual_revenue = rbt12
+
+    def _refresh_annual_revenue_after_commit(self):
+        """Refresh the annual revenue of the companies in a transaction of its
+        own once the current one is committed, so that the documents being
+        authorized do not lock the company rows (the daily scheduled action
+        catches up on the refreshes that fail)."""
+        postcommit = self.env.cr.postcommit
+        company_ids = postcommit.data.get(COMPANY_REVENUE_TABLE)
+        if company_ids is None:
+            company_ids = postcommit.data[COMPANY_REVENUE_TABLE] = set()
+            dbname = self.env.cr.dbname
+
+            @postcommit.add
+            def refresh_annual_revenue():
+                db_registry = registry(dbname)
+                try:
+                    with api.Environment.manage(), db_registry.cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        companies = env["res.company"].browse(company_ids).exists()
+                        companies._refresh_annual_revenue()
+                except Exception:
+                    _logger.warning(
+                        "Failed to refresh the annual revenue of the companies %s",
+                        sorted(company_ids),
+                        exc_info=True,
+                    )
+
+        company_ids.update(self.ids)
+
+    @api.model
+    def _scheduled_refresh_annual_revenue(self):
+        self.search([("annual_revenue_auto", "=", True)])._refresh_annual_revenue()
+
     cnae_main_id = fields.Many2one(
         comodel_name="l10n_br_fiscal.cnae",
         compute="_compute_address",
@@ -149,6 +275,12 @@ class ResCompany(models.Model):
         currency_field="currency_id",
     )
 
+    annual_revenue_auto = fields.Boolean(
+        string="Annual Revenue from Documents",
+        help="Keep the annual revenue up to date with the gross revenue of the "
+        "authorized sale documents of the last 12 months (RBT12).",
+    )
+
     simplified_tax_id = fields.Many2one(
         comodel_name="l10n_br_fiscal.simplified.tax",
         compute="_compute_simplified_tax",
@@ -321,12 +453,36 @@ class ResCompany(models.Model):
         default="line",
     )
 
+    fiscal_tax_engine = fields.Selection(
+        selection=TAX_ENGINE,
+        default=TAX_ENGINE_DEFAULT,
+        required=True,
+        help="Define how the taxes of the document lines are computed. "
+        "The Document engine computes all lines of a document together; "
+        "the validation mode keeps the line by line results and logs any "
+        "difference found with the Document engine.",
+    )
+
     anonymous_partner_id = fields.Many2one(
         comodel_name="res.partner",
         string="Anonymous Partner",
         help="Partner used to create anonymous fiscal documents",
     )
 
+    def write(self, values):
+        result = super().write(values)
+        if {
+            "tax_framework",
+            "icms_regulation_id",
+            "tax_definition_ids",
+            "state_id",
+        }.intersection(values):
+            # Drop the memoized fiscal mappings on every worker
+            self.clear_caches()
+        if values.get("annual_revenue_auto"):
+            self._refresh_annual_revenue()
+        return result
+
     def _del_tax_definition(self, tax_domain):
         tax_def = self.tax_definition_ids.filtered(
             lambda d: d.tax_group_id.tax_domain != tax_domain
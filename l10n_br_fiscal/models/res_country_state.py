@@ -2,7 +2,7 @@
 # Copyright (C) 2016  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class ResCountryState(models.Model):
@@ -13,3 +13,24 @@ class ResCountryState(models.Model):
         string="Tax Definitions",
         domain="['|', ('state_from_ids', '=', id), ('state_to_ids', '=', id)]",
     )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        states = super().create(vals_list)
+        # Drop the ICMS regulation form arch, with a page per state, on
+        # every worker
+        self.clear_caches()
+        return states
+
+    def write(self, values):
+        result = super().write(values)
+        if {"name", "code", "country_id"}.intersection(values):
+            # Drop the ICMS regulation form arch on every worker
+            self.clear_caches()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        # Drop the ICMS regulation form arch on every worker
+        self.clear_caches()
+        return result
@@ -54,6 +54,7 @@ class ResPartner(models.Model):
         domain="[('is_company', '=', is_company)]",
         default=_default_fiscal_profile_id,
         tracking=True,
+        index=True,
     )
 
     is_public_entity = fields.Boolean(
@@ -2,7 +2,7 @@
 # Copyright (C) 2020  Luis Felipe Mileo - KMEE
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import fields, models
+from odoo import api, fields, models, tools
 
 
 class SimplifiedTax(models.Model):
@@ -30,3 +30,48 @@ class SimplifiedTax(models.Model):
     coefficient_r = fields.Boolean(
         readonly=True,
     )
+
+    @api.model
+    @tools.ormcache(
+        "self.env['l10n_br_fiscal.cache.version']._get_version(self._name)",
+        "cnae_id",
+        "coefficient_r",
+    )
+    def _get_simplified_tax_ranges(self, cnae_id, coefficient_r):
+        """Return the simplified tax of a CNAE and its revenue ranges.
+
+        :return: (simplified tax id, ((range id, initial, final revenue), ...))
+        """
+        simplified_tax = self.search(
+            [("cnae_ids", "=", cnae_id), ("coefficient_r", "=", coefficient_r)],
+            limit=1,
+        )
+        if not simplified_tax:
+            return False, ()
+        return simplified_tax.id, tuple(
+            (tax_range.id, tax_range.inital_revenue, tax_range.final_revenue)
+            for tax_range in self.env["l10n_br_fiscal.simplified.tax.range"].search(
+                [("simplified_tax_id", "=", simplified_tax.id)]
+            )
+        )
+
+    @api.model
+    def _clear_simplified_tax_ranges_cache(self):
+        self.env["l10n_br_fiscal.cache.version"]._bump_version(self._name)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        result = super().create(vals_list)
+        self._clear_simplified_tax_ranges_cache()
+        return result
+
+    def write(self, values):
+        result = super().write(values)
+        if {"cnae_ids", "coefficient_r"}.intersection(values):
+            self._clear_simplified_tax_ranges_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self._clear_simplified_tax_ranges_cache()
+        return result
@@ -1,7 +1,7 @@
 # Copyright (C) 2019  Renato Lima - Akretion
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class SimplifiedTaxRange(models.Model):
@@ -66,3 +66,24 @@ class SimplifiedTaxRange(models.Model):
     tax_pis_percent = fields.Float(
         string="Tax PIS Percent", digits="Fiscal Tax Percent"
     )
+
+    @api.model
+    def _clear_simplified_tax_ranges_cache(self):
+        self.env["l10n_br_fiscal.simplified.tax"]._clear_simplified_tax_ranges_cache()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        result = super().create(vals_list)
+        self._clear_simplified_tax_ranges_cache()
+        return result
+
+    def write(self, values):
+        result = super().write(values)
+        if {"simplified_tax_id", "inital_revenue", "final_revenue"} & set(values):
+            self._clear_simplified_tax_ranges_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self._clear_simplified_tax_ranges_cache()
+        return result
@@ -319,18 +319,23 @@ class Tax(models.Model):
             op_line.fiscal_operation_type == FISCAL_OUT
             and op_line.fiscal_operation_id.fiscal_type == "sale"
         ):
+            estimate = self.env["l10n_br_fiscal.tax.estimate"]
             if nbs:
-                amount_estimate_tax = currency.round(
-                    amount_total * (nbs.estimate_tax_national / 100)
+                national, _imported = estimate._get_estimate_percents(
+                    company.id, "nbs_id", nbs.id
                 )
+                amount_estimate_tax = currency.round(amount_total * (national / 100))
             elif ncm:
+                national, imported = estimate._get_estimate_percents(
+                    company.id, "ncm_id", ncm.id
+                )
                 if icms_origin in ICMS_ORIGIN_TAX_IMPORTED:
                     amount_estimate_tax = currency.round(
-                        amount_total * (ncm.estimate_tax_imported / 100)
+                        amount_total * (imported / 100)
                     )
                 else:
                     amount_estimate_tax = currency.round(
-                        amount_total * (ncm.estimate_tax_national / 100)
+                        amount_total * (national / 100)
                     )
 
         return amount_estimate_tax
@@ -676,6 +681,25 @@ class Tax(models.Model):
                 'taxes': dict
             }
         """
+        return self._compute_taxes_from_plan(
+            self._get_compute_taxes_plan(**kwargs), kwargs
+        )
+
+    def _get_compute_taxes_plan(self, **kwargs):
+        """Sorted taxes and CST to be computed for these taxes. The plan
+        only depends on the taxes, the operation line and the CFOP, so it
+        is shared by every line with the same values in compute_taxes_multi.
+        """
+        sequence = self._compute_tax_sequence({}, **kwargs)
+        operation_line = kwargs.get("operation_line")
+        plan = []
+        for tax in self.sorted(key=lambda t: sequence.get(t.tax_domain)):
+            fiscal_operation_type = operation_line.fiscal_operation_type or FISCAL_OUT
+            plan.append((tax, tax.cst_from_tax(fiscal_operation_type)))
+        return plan
+
+    @api.model
+    def _compute_taxes_from_plan(self, plan, kwargs):
         result_amounts = {
             "amount_included": 0.00,
             "amount_not_included": 0.00,
@@ -684,14 +708,11 @@ class Tax(models.Model):
             "taxes": {},
         }
         taxes = {}
-        sequence = self._compute_tax_sequence(taxes, **kwargs)
 
-        for tax in self.sorted(key=lambda t: sequence.get(t.tax_domain)):
+        for tax, cst in plan:
             taxes[tax.tax_domain] = dict(TAX_DICT_VALUES)
             # Define CST FROM TAX
-            operation_line = kwargs.get("operation_line")
-            fiscal_operation_type = operation_line.fiscal_operation_type or FISCAL_OUT
-            kwargs.update({"cst": tax.cst_from_tax(fiscal_operation_type)})
+            kwargs.update({"cst": cst})
             try:
                 compute_method = getattr(self, "_compute_%s" % tax.tax_domain)
                 taxes[tax.tax_domain].update(compute_method(tax, taxes, **kwargs))
@@ -718,6 +739,43 @@ class Tax(models.Model):
         result_amounts["taxes"] = taxes
         return result_amounts
 
+    @api.model
+    def compute_taxes_multi(self, lines):
+        """Document engine: compute the taxes of many lines at once.
+
+        arguments:
+            lines: list of (taxes, kwargs) tuples, where kwargs are the
+            compute_taxes arguments of the line
+        return
+            list with the compute_taxes result of each line
+
+        The taxes of all lines and their groups and CSTs are prefetched
+        together and the sorted compute plan is built once per distinct
+        (taxes, operation line, CFOP). The per-tax arithmetic is the same
+        as compute_taxes, so both engines return the same values.
+        """
+        all_taxes = self.browse()
+        for taxes, _kwargs in lines:
+            all_taxes |= taxes
+        all_taxes.mapped("tax_group_id")
+        all_taxes.mapped("cst_in_id")
+        all_taxes.mapped("cst_out_id")
+
+        plans = {}
+        results = []
+        for taxes, kwargs in lines:
+            plan_key = (
+                tuple(taxes.ids),
+                kwargs.get("operation_line") and kwargs["operation_line"].id,
+                kwargs.get("cfop") and kwargs["cfop"].id,
+            )
+            if plan_key not in plans:
+                plans[plan_key] = taxes._get_compute_taxes_plan(**kwargs)
+            results.append(
+                taxes._compute_taxes_from_plan(plans[plan_key], dict(kwargs))
+            )
+        return results
+
     @api.onchange("icmsst_base_type")
     def _onchange_icmsst_base_type(self):
         if self.icmsst_base_type:
@@ -4,7 +4,6 @@
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 
-from .. import tools
 from ..constants.fiscal import (
     FINAL_CUSTOMER,
     FISCAL_IN_OUT,
@@ -14,6 +13,56 @@ from ..constants.fiscal import (
 )
 from ..constants.icms import ICMS_TAX_BENEFIT_TYPE
 
+# Relation tables matched by map_tax_definition_multi for each key column,
+# a definition with an empty relation applies to any value.
+TAX_DEFINITION_LOOKUP_KEYS = (
+    ("state_to_id", "tax_definition_state_to_rel", "state_id"),
+    ("ncm_id", "tax_definition_ncm_rel", "ncm_id"),
+    ("nbm_id", "tax_definition_nbm_rel", "nbm_id"),
+    ("cest_id", "tax_definition_cest_rel", "cest_id"),
+    ("product_id", "tax_definition_product_rel", "product_id"),
+    (
+        "city_taxation_code_id",
+        "tax_definition_city_taxation_code_rel",
+        "city_taxation_code_id",
+    ),
+    ("service_type_id", "tax_definition_service_type_rel", "service_type_id"),
+)
+
+# Fields read by the cached tax definition lookups of the ICMS regulations
+# and by the memoized fiscal mappings of the operation lines.
+TAX_DEFINITION_CACHE_FIELDS = {
+    "tax_group_id",
+    "tax_id",
+    "cst_id",
+    "company_id",
+    "state_from_id",
+    "state_to_ids",
+    "ncm_ids",
+    "nbm_ids",
+    "cest_ids",
+    "product_ids",
+    "city_taxation_code_ids",
+    "service_type_ids",
+    "ind_final",
+    "state",
+    "ipi_guideline_id",
+    "fiscal_profile_id",
+    "fiscal_operation_line_id",
+    "icms_regulation_id",
+    "cfop_id",
+    "is_benefit",
+}
+
+# Relations of the definitions derived from code lists: comodel code
+# size and the fields listing the codes, the excluded codes and the
+# NCM exceptions (2 digits) to keep.
+TAX_DEFINITION_CODE_LISTS = {
+    "ncm_ids": (8, ("ncms", "not_in_ncms", "ncm_exception")),
+    "cest_ids": (7, ("cests", None, None)),
+    "nbm_ids": (10, ("nbms", "not_in_nbms", None)),
+}
+
 
 class TaxDefinition(models.Model):
     _name = "l10n_br_fiscal.tax.definition"
@@ -335,90 +384,102 @@ class TaxDefinition(models.Model):
             raise UserError(
                 _("You cannot delete an Tax Definition which is not draft !")
             )
-        return super().unlink()
-
-    def action_search_ncms(self):
-        ncm = self.env["l10n_br_fiscal.ncm"]
-        for r in self:
-            domain = []
-
-            if r.ncms:
-                domain += tools.domain_field_codes(r.ncms)
+        result = super().unlink()
+        self._clear_tax_definition_caches()
+        return result
 
-            if r.not_in_ncms:
-                domain += tools.domain_field_codes(
-                    field_codes=r.not_in_ncms, operator1="!=", operator2="not ilike"
+    @api.model
+    def _clear_tax_definition_caches(self):
+        """Drop the cached tax definition lookups and fiscal mappings on
+        every worker, keeping the rest of the registry cache."""
+        self.env["l10n_br_fiscal.cache.version"]._bump_version(self._name)
+
+    def _expand_code_lists(self, relations=tuple(TAX_DEFINITION_CODE_LISTS)):
+        """Resolve the code lists of all the definitions at once.
+
+        The codes are matched against prefix trees of the comodels and
+        each relation table is rewritten with a single insert.
+        """
+        if not self:
+            return
+        self.flush()
+        for fname in relations:
+            code_size, code_fields = TAX_DEFINITION_CODE_LISTS[fname]
+            codes, exclude, exception = code_fields
+            field = self._fields[fname]
+            comodel = self.env[field.comodel_name]
+            trie = comodel._get_code_trie(code_size)
+            exception_trie = None
+
+            rows = []
+            for record in self:
+                if not any(record[f] for f in code_fields if f):
+                    continue
+                if record[codes]:
+                    ids = trie.match_codes(record[codes])
+                else:
+                    ids = trie.all_ids()
+                if exclude and record[exclude]:
+                    ids -= trie.match_codes(record[exclude])
+                if exception and record[exception]:
+                    if exception_trie is None:
+                        exception_trie = comodel._get_code_trie(2, "exception")
+                    ids &= exception_trie.match_codes(record[exception])
+                rows.extend((record.id, comodel_id) for comodel_id in ids)
+
+            self.env.cr.execute(
+                f"DELETE FROM {field.relation} WHERE {field.column1} IN %s",
+                (tuple(self.ids),),
+            )
+            if rows:
+                definition_ids, comodel_ids = zip(*rows)
+                self.env.cr.execute(
+                    f"INSERT INTO {field.relation} ({field.column1}, {field.column2})"
+                    " SELECT * FROM unnest(%s::int[], %s::int[])",
+                    (list(definition_ids), list(comodel_ids)),
                 )
 
-            if r.ncm_exception:
-                domain += tools.domain_field_codes(
-                    field_codes=r.ncm_exception, field_name="exception", code_size=2
-                )
+        self.invalidate_cache(list(relations), self.ids)
+        for fname in relations:
+            self.env[self._fields[fname].comodel_name].invalidate_cache(
+                ["tax_definition_ids"]
+            )
+        self._clear_tax_definition_caches()
 
-            if domain:
-                r.ncm_ids = ncm.search(domain)
-            else:
-                r.ncm_ids = False
+    def action_search_ncms(self):
+        self._expand_code_lists(["ncm_ids"])
 
     def action_search_cests(self):
-        cest = self.env["l10n_br_fiscal.cest"]
-        for r in self:
-            domain = []
-
-            if r.cests:
-                domain += tools.domain_field_codes(r.cests, code_size=7)
-
-            if domain:
-                r.cest_ids = cest.search(domain)
-            else:
-                r.cest_ids = False
+        self._expand_code_lists(["cest_ids"])
 
     def action_search_nbms(self):
-        nbm = self.env["l10n_br_fiscal.nbm"]
-        for r in self:
-            domain = []
-
-            if r.nbms:
-                domain += tools.domain_field_codes(r.nbms, code_size=10)
-
-            if r.not_in_nbms:
-                domain += tools.domain_field_codes(
-                    field_codes=r.not_in_nbms,
-                    operator1="!=",
-                    operator2="not ilike",
-                    code_size=10,
-                )
-
-            if domain:
-                r.nbm_ids = nbm.search(domain)
-            else:
-                r.nbm_ids = False
+        self._expand_code_lists(["nbm_ids"])
+
+    def _expand_code_lists_for(self, fnames_list):
+        """Expand the relations whose code lists are in each fnames."""
+        for fname, (_size, code_fields) in TAX_DEFINITION_CODE_LISTS.items():
+            records = self.browse(
+                [
+                    record.id
+                    for record, fnames in zip(self, fnames_list)
+                    if set(code_fields).intersection(fnames)
+                ]
+            )
+            records._expand_code_lists([fname])
 
     @api.model_create_multi
     def create(self, vals_list):
         create_super = super().create(vals_list)
-        ncm_fields_list = ("ncms", "not_in_ncms", "ncm_exception")
-        for index, values in enumerate(vals_list):
-            if set(ncm_fields_list).intersection(values.keys()):
-                create_super[index].with_context(do_not_write=True).action_search_ncms()
-            if "cests" in values.keys():
-                create_super[index].with_context(
-                    do_not_write=True
-                ).action_search_cests()
-            if "nbms" in values.keys():
-                create_super[index].with_context(do_not_write=True).action_search_nbms()
+        create_super._expand_code_lists_for(vals_list)
+        self._clear_tax_definition_caches()
         return create_super
 
     def write(self, values):
         write_super = super().write(values)
-        ncm_fields_list = ("ncms", "not_in_ncms", "ncm_exception")
-        do_not_write = self.env.context.get("do_not_write")
-        if set(ncm_fields_list).intersection(values.keys()) and not do_not_write:
-            self.with_context(do_not_write=True).action_search_ncms()
-        if "cests" in values.keys() and not do_not_write:
-            self.with_context(do_not_write=True).action_search_cests()
-        if "nbms" in values.keys() and not do_not_write:
-            self.with_context(do_not_write=True).action_search_nbms()
+        if not self.env.context.get("do_not_write"):
+            self._expand_code_lists_for([values] * len(self))
+        if TAX_DEFINITION_CACHE_FIELDS.intersection(values):
+            self._clear_tax_definition_caches()
         return write_super
 
     def map_tax_definition(
@@ -470,6 +531,82 @@ class TaxDefinition(models.Model):
 
         return self.search(domain)
 
+    def map_tax_definition_multi(self, company, partner, keys):
+        """Batch version of map_tax_definition.
+
+        :param keys: list of dicts with the product, ncm, nbm, cest,
+            city_taxation_code and service_type of each line
+        :return: list with the matching tax definitions of each key
+
+        The keys are matched in a single query, each relation of the
+        definitions being checked on its own (see TAX_DEFINITION_LOOKUP_KEYS).
+        With the
+        no_tax_definition_lookup context key, every key is resolved by
+        the map_tax_definition domain instead.
+        """
+        if not self:
+            return [self] * len(keys)
+
+        if self.env.context.get("no_tax_definition_lookup"):
+            return [
+                self.map_tax_definition(
+                    company,
+                    partner,
+                    key.get("product"),
+                    ncm=key.get("ncm"),
+                    nbm=key.get("nbm"),
+                    cest=key.get("cest"),
+                    city_taxation_code=key.get("city_taxation_code"),
+                    service_type=key.get("service_type"),
+                )
+                for key in keys
+            ]
+
+        key_values = []
+        for index, key in enumerate(keys):
+            product = key.get("product")
+            key_values.append(
+                (
+                    index,
+                    partner.state_id.id or 0,
+                    (key.get("ncm") or product.ncm_id).id or 0,
+                    (key.get("nbm") or product.nbm_id).id or 0,
+                    (key.get("cest") or product.cest_id).id or 0,
+                    product.id or 0,
+                    key.get("city_taxation_code") and key["city_taxation_code"].id or 0,
+                    key.get("service_type") and key["service_type"].id or 0,
+                )
+            )
+
+        self.flush()
+        self.env.cr.execute(
+            "SELECT k.idx, d.id"
+            " FROM (VALUES {values}) AS k (idx, {columns})"
+            " JOIN l10n_br_fiscal_tax_definition d"
+            " ON d.id IN %s AND d.state != 'expired'"
+            " WHERE {conditions}"
+            " ORDER BY k.idx, d.id".format(
+                values=", ".join(
+                    "(" + ", ".join(["%s"] * len(v)) + ")" for v in key_values
+                ),
+                columns=", ".join(k[0] for k in TAX_DEFINITION_LOOKUP_KEYS),
+                conditions=" AND ".join(
+                    f"(NOT EXISTS (SELECT 1 FROM {rel} r"
+                    f" WHERE r.tax_definition_id = d.id)"
+                    f" OR EXISTS (SELECT 1 FROM {rel} r"
+                    f" WHERE r.tax_definition_id = d.id"
+                    f" AND r.{rel_column} = k.{column}))"
+                    for column, rel, rel_column in TAX_DEFINITION_LOOKUP_KEYS
+                ),
+            ),
+            [value for values in key_values for value in values] + [tuple(self.ids)],
+        )
+
+        results = [[] for _key in keys]
+        for index, tax_definition_id in self.env.cr.fetchall():
+            results[index].append(tax_definition_id)
+        return [self.browse(ids) for ids in results]
+
     @api.onchange("is_taxed")
     def _onchange_tribute(self):
         if not self.is_taxed:
@@ -496,98 +633,121 @@ class TaxDefinition(models.Model):
         if self.cfop_id:
             self.type_in_out = self.cfop_id.type_in_out
 
+    def _shared_relation_sql(self, fname):
+        """SQL condition true when record and other share a fname value."""
+        field = self._fields[fname]
+        return (
+            f"EXISTS (SELECT 1 FROM {field.relation} r1"
+            f" JOIN {field.relation} r2 ON r2.{field.column2} = r1.{field.column2}"
+            f" WHERE r1.{field.column1} = record.id"
+            f" AND r2.{field.column1} = other.id)"
+        )
+
+    def _get_duplicate_definitions(self, column, conditions=""):
+        """Return the definitions of self and the ones they duplicate.
+
+        All the records are checked with one self-join: other definitions
+        visible to the user with the same column value, tax group and tax,
+        and matching the extra SQL conditions.
+        """
+        if not self:
+            return []
+        self.flush()
+        query = self._where_calc([])
+        self._apply_ir_rules(query, "read")
+        from_clause, where_clause, where_params = query.get_sql()
+        where_clause = where_clause or "TRUE"
+        self.env.cr.execute(
+            f"""
+            SELECT record.id, other.id
+              FROM {self._table} record
+              JOIN {self._table} other
+                ON other.id != record.id
+               AND other.{column} = record.{column}
+               AND other.tax_group_id IS NOT DISTINCT FROM record.tax_group_id
+               AND other.tax_id IS NOT DISTINCT FROM record.tax_id
+               {conditions}
+             WHERE record.id IN %s
+               AND other.id IN (
+                   SELECT "{self._table}".id FROM {from_clause}
+                    WHERE {where_clause}
+               )
+             ORDER BY record.id, other.id
+            """,
+            [tuple(self.ids)] + where_params,
+        )
+        return [
+            (self.browse(record_id), self.browse(other_id))
+            for record_id, other_id in self.env.cr.fetchall()
+        ]
+
+    def _check_duplicate_definitions(self, message, column, conditions=""):
+        duplicates = self._get_duplicate_definitions(column, conditions)
+        if duplicates:
+            raise ValidationError(
+                "\n".join(
+                    [message]
+                    + [
+                        f"{record.display_name} / {other.display_name}"
+                        for record, other in duplicates
+                    ]
+                )
+            )
+
     @api.constrains("fiscal_profile_id")
     def _check_fiscal_profile_id(self):
-        for record in self:
-            if record.fiscal_profile_id:
-                domain = [
-                    ("id", "!=", record.id),
-                    ("fiscal_profile_id", "=", record.fiscal_profile_id.id),
-                    ("tax_group_id", "=", record.tax_group_id.id),
-                    ("tax_id", "=", record.tax_id.id),
-                ]
-
-                if record.env["l10n_br_fiscal.tax.definition"].search_count(domain):
-                    raise ValidationError(
-                        _(
-                            "Tax Definition already exists "
-                            "for this Partner Profile and Tax Group !"
-                        )
-                    )
+        self._check_duplicate_definitions(
+            _("Tax Definition already exists for this Partner Profile and Tax Group !"),
+            "fiscal_profile_id",
+        )
 
     @api.constrains("fiscal_operation_line_id")
     def _check_fiscal_operation_line_id(self):
-        for record in self:
-            if record.fiscal_operation_line_id:
-                domain = [
-                    ("id", "!=", record.id),
-                    (
-                        "fiscal_operation_line_id",
-                        "=",
-                        record.fiscal_operation_line_id.id,
-                    ),
-                    ("tax_group_id", "=", record.tax_group_id.id),
-                    ("tax_id", "=", record.tax_id.id),
-                ]
-
-                if record.env["l10n_br_fiscal.tax.definition"].search_count(domain):
-                    raise ValidationError(
-                        _(
-                            "Tax Definition already exists "
-                            "for this Operation Line and Tax Group !"
-                        )
-                    )
+        self._check_duplicate_definitions(
+            _("Tax Definition already exists for this Operation Line and Tax Group !"),
+            "fiscal_operation_line_id",
+        )
 
     @api.constrains("icms_regulation_id", "state_from_id")
     def _check_icms(self):
-        for record in self:
-            if record.icms_regulation_id:
-                domain = self._get_search_domain(record)
-                if record.env["l10n_br_fiscal.tax.definition"].search_count(domain):
-                    raise ValidationError(
-                        _(
-                            "Tax Definition already exists "
-                            "for this ICMS and Tax Group !"
-                        )
-                    )
+        # Same conditions as the domain of _get_search_domain
+        benefit_conditions = [
+            "other.is_benefit",
+            "(COALESCE(record.ncm_exception, '') = ''"
+            " OR other.ncm_exception = record.ncm_exception)",
+        ]
+        for fname in ("ncm_ids", "cest_ids", "nbm_ids", "product_ids"):
+            field = self._fields[fname]
+            benefit_conditions.append(
+                f"(NOT EXISTS (SELECT 1 FROM {field.relation}"
+                f" WHERE {field.column1} = record.id)"
+                f" OR {self._shared_relation_sql(fname)})"
+            )
+        benefit_conditions = " AND ".join(benefit_conditions)
+        self._check_duplicate_definitions(
+            _("Tax Definition already exists for this ICMS and Tax Group !"),
+            "icms_regulation_id",
+            f"""
+               AND other.state_from_id IS NOT DISTINCT FROM record.state_from_id
+               AND {self._shared_relation_sql("state_to_ids")}
+               AND (NOT COALESCE(record.is_benefit, FALSE)
+                    OR ({benefit_conditions}))
+            """,
+        )
 
     @api.constrains("company_id")
     def _check_company_id(self):
-        for record in self:
-            if record.company_id:
-                domain = [
-                    ("id", "!=", record.id),
-                    ("company_id", "=", record.company_id.id),
-                    ("tax_group_id", "=", record.tax_group_id.id),
-                    ("tax_id", "=", record.tax_id.id),
-                ]
-
-                if record.env["l10n_br_fiscal.tax.definition"].search_count(domain):
-                    raise ValidationError(
-                        _(
-                            "Tax Definition already exists "
-                            "for this Company and Tax Group !"
-                        )
-                    )
+        self._check_duplicate_definitions(
+            _("Tax Definition already exists for this Company and Tax Group !"),
+            "company_id",
+        )
 
     @api.constrains("cfop_id")
     def _check_cfop_id(self):
-        for record in self:
-            if record.cfop_id:
-                domain = [
-                    ("id", "!=", record.id),
-                    ("cfop_id", "=", record.cfop_id.id),
-                    ("tax_group_id", "=", record.tax_group_id.id),
-                    ("tax_id", "=", record.tax_id.id),
-                ]
-
-                if record.env["l10n_br_fiscal.tax.definition"].search_count(domain):
-                    raise ValidationError(
-                        _(
-                            "Tax Definition already exists "
-                            "for this CFOP and Tax Group !"
-                        )
-                    )
+        self._check_duplicate_definitions(
+            _("Tax Definition already exists for this CFOP and Tax Group !"),
+            "cfop_id",
+        )
 
     @api.constrains("is_benefit", "code", "benefit_type", "state_from_id")
     def _check_tax_benefit_code(self):
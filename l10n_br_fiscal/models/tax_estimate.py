@@ -1,7 +1,42 @@
 # Copyright (C) 2012  Renato Lima - Akretion <renato.lima@akretion.com.br>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
 
-from odoo import fields, models
+import csv
+import io
+import logging
+import os
+import re
+
+from psycopg2.extras import execute_values
+
+from odoo import _, api, fields, models, tools
+from odoo.tools import config as odooconfig
+
+_logger = logging.getLogger(__name__)
+
+IBPT_CSV_CHUNK_SIZE = 5000
+
+IBPT_CSV_FILENAME = re.compile(r"TabelaIBPTax([A-Z]{2})", re.IGNORECASE)
+
+# IBPT table type column: 0 NCM, 1 NBS (2 LC 116 is not imported)
+# (estimate field, code table, join condition with the staging table)
+IBPT_CSV_OBJECTS = {
+    "0": (
+        "ncm_id",
+        "l10n_br_fiscal_ncm",
+        "r.code_unmasked = i.code AND COALESCE(r.exception, '') = i.ex",
+    ),
+    "1": ("nbs_id", "l10n_br_fiscal_nbs", "r.code_unmasked = i.code"),
+}
+
+# Latest estimate percents of each NCM and NBS per company, read by the
+# tax engine instead of searching the estimates of the code of each line.
+TAX_ESTIMATE_SNAPSHOT_TABLE = "l10n_br_fiscal_tax_estimate_snapshot"
+
+TAX_ESTIMATE_SNAPSHOT_FIELDS = {
+    "ncm_id": "l10n_br_fiscal_ncm",
+    "nbs_id": "l10n_br_fiscal_nbs",
+}
 
 
 class TaxEstimate(models.Model):
@@ -48,3 +83,324 @@ class TaxEstimate(models.Model):
         string="Company",
         default=lambda self: self.env.company,
     )
+
+    def init(self):
+        self.env.cr.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_name = %s",
+            (TAX_ESTIMATE_SNAPSHOT_TABLE,),
+        )
+        if self.env.cr.fetchone():
+            return
+        self.env.cr.execute(
+            "CREATE TABLE {table} ("
+            " company_id INTEGER NOT NULL"
+            " REFERENCES res_company(id) ON DELETE CASCADE,"
+            " {columns},"
+            " estimate_tax_national NUMERIC NOT NULL DEFAULT 0,"
+            " estimate_tax_imported NUMERIC NOT NULL DEFAULT 0)".format(
+                table=TAX_ESTIMATE_SNAPSHOT_TABLE,
+                columns=", ".join(
+                    f"{field} INTEGER REFERENCES {table}(id) ON DELETE CASCADE"
+                    for field, table in TAX_ESTIMATE_SNAPSHOT_FIELDS.items()
+                ),
+            )
+        )
+        for field in TAX_ESTIMATE_SNAPSHOT_FIELDS:
+            self.env.cr.execute(
+                f"CREATE UNIQUE INDEX {TAX_ESTIMATE_SNAPSHOT_TABLE}_{field}_idx"
+                f" ON {TAX_ESTIMATE_SNAPSHOT_TABLE} (company_id, {field})"
+                f" WHERE {field} IS NOT NULL"
+            )
+            self.env.cr.execute(
+                f"SELECT DISTINCT company_id FROM {self._table}"
+                f" WHERE {field} IS NOT NULL AND company_id IS NOT NULL"
+            )
+            for (company_id,) in self.env.cr.fetchall():
+                self._refresh_estimate_snapshot(company_id, field)
+
+    @api.model
+    def _refresh_estimate_snapshot(self, company_id, object_field, record_ids=None):
+        """Store the latest estimate percents of the codes of a company.
+
+        :param object_field: ncm_id or nbs_id
+        :param record_ids: NCM or NBS ids, all codes when None
+        """
+        self.flush(
+            [
+                "company_id",
+                object_field,
+                "federal_taxes_national",
+                "federal_taxes_import",
+                "state_taxes",
+                "municipal_taxes",
+            ]
+        )
+        params = {"company_id": company_id, "ids": tuple(record_ids or ()) or (0,)}
+        if record_ids is None:
+            where = f"{object_field} IS NOT NULL"
+        else:
+            where = f"{object_field} IN %(ids)s"
+        self.env.cr.execute(
+            f"DELETE FROM {TAX_ESTIMATE_SNAPSHOT_TABLE}"
+            f" WHERE company_id = %(company_id)s AND {where}",
+            params,
+        )
+        self.env.cr.execute(
+            f"""
+            INSERT INTO {TAX_ESTIMATE_SNAPSHOT_TABLE} (
+                company_id, {object_field},
+                estimate_tax_national, estimate_tax_imported
+            )
+            SELECT DISTINCT ON ({object_field})
+                   company_id, {object_field},
+                   COALESCE(federal_taxes_national, 0)
+                       + COALESCE(state_taxes, 0) + COALESCE(municipal_taxes, 0),
+                   COALESCE(federal_taxes_import, 0)
+                       + COALESCE(state_taxes, 0) + COALESCE(municipal_taxes, 0)
+              FROM {self._table}
+             WHERE company_id = %(company_id)s AND {where}
+             ORDER BY {object_field}, create_date DESC, id DESC
+            """,
+            params,
+        )
+        self.env["l10n_br_fiscal.cache.version"]._bump_version(self._name)
+
+    def _get_estimate_snapshot_keys(self, keys=None):
+        """Return {(company id, ncm_id or nbs_id): code ids} of the estimates"""
+        keys = keys if keys is not None else {}
+        for estimate in self:
+            for field in TAX_ESTIMATE_SNAPSHOT_FIELDS:
+                if estimate[field] and estimate.company_id:
+                    keys.setdefault((estimate.company_id.id, field), set()).add(
+                        estimate[field].id
+                    )
+        return keys
+
+    @api.model
+    def _refresh_estimate_snapshot_keys(self, keys):
+        for (company_id, field), record_ids in keys.items():
+            self._refresh_estimate_snapshot(company_id, field, record_ids)
+
+    @api.model
+    @tools.ormcache(
+        "self.env['l10n_br_fiscal.cache.version']._get_version(self._name)",
+        "company_id",
+        "object_field",
+        "record_id",
+    )
+    def _get_estimate_percents(self, company_id, object_field, record_id):
+        """Return the (national, imported) estimate percents of a code,
+        cached until the snapshot is refreshed."""
+        self.env.cr.execute(
+            f"SELECT estimate_tax_national, estimate_tax_imported"
+            f" FROM {TAX_ESTIMATE_SNAPSHOT_TABLE}"
+            f" WHERE company_id = %s AND {object_field} = %s",
+            (company_id, record_id),
+        )
+        row = self.env.cr.fetchone()
+        return (float(row[0]), float(row[1])) if row else (0.0, 0.0)
+
+    @api.model
+    def _get_estimate_percents_multi(self, company_id, object_field, record_ids):
+        """Return {code id: (national, imported)} of the codes with estimates"""
+        self.env.cr.execute(
+            f"SELECT {object_field}, estimate_tax_national, estimate_tax_imported"
+            f" FROM {TAX_ESTIMATE_SNAPSHOT_TABLE}"
+            f" WHERE company_id = %s AND {object_field} IN %s",
+            (company_id, tuple(record_ids) or (0,)),
+        )
+        return {
+            record_id: (float(national), float(imported))
+            for record_id, national, imported in self.env.cr.fetchall()
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        estimates = super().create(vals_list)
+        self._refresh_estimate_snapshot_keys(estimates._get_estimate_snapshot_keys())
+        return estimates
+
+    def write(self, values):
+        keys = self._get_estimate_snapshot_keys()
+        result = super().write(values)
+        self._refresh_estimate_snapshot_keys(self._get_estimate_snapshot_keys(keys))
+        return result
+
+    def unlink(self):
+        keys = self._get_estimate_snapshot_keys()
+        result = super().unlink()
+        self._refresh_estimate_snapshot_keys(keys)
+        return result
+
+    @api.model
+    def _ibpt_csv_rows(self, file):
+        """Yield the rows of an IBPT "De Olho no Imposto" CSV table"""
+        reader = csv.DictReader(
+            io.TextIOWrapper(file, encoding="latin-1", newline=""), delimiter=";"
+        )
+
+        def number(value):
+            return float((value or "0").replace(",", ".") or 0)
+
+        for row in reader:
+            row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+            if row.get("tipo") not in IBPT_CSV_OBJECTS:
+                continue
+            yield (
+                row["codigo"],
+                row.get("ex", ""),
+                row["tipo"],
+                number(row.get("nacionalfederal")),
+                number(row.get("importadosfederal")),
+                number(row.get("estadual")),
+                number(row.get("municipal")),
+                row.get("chave", "")[:32],
+                row.get("fonte", "")[:32],
+            )
+
+    @api.model
+    def import_ibpt_csv(self, file, state, company=None):
+        """Upsert the estimates of an IBPT CSV table of one state.
+
+        The file is streamed in chunks into a staging table, then the
+        estimates of every NCM and NBS are updated (same IBPT key) or
+        inserted with a few set-based statements, and the estimate
+        percents of the codes are recomputed in bulk.
+        :param file: binary file object of the CSV table
+        :return: dict with the number of estimates per code model
+        """
+        company = company or self.env.company
+        cr = self.env.cr
+        self.flush()
+        cr.execute("DROP TABLE IF EXISTS ibpt_import")
+        cr.execute(
+            """
+            CREATE TEMP TABLE ibpt_import (
+                code VARCHAR, ex VARCHAR, tipo VARCHAR,
+                national NUMERIC, imported NUMERIC,
+                state_taxes NUMERIC, municipal NUMERIC,
+                key VARCHAR, origin VARCHAR
+            ) ON COMMIT DROP
+            """
+        )
+        rows = []
+        for row in self._ibpt_csv_rows(file):
+            rows.append(row)
+            if len(rows) >= IBPT_CSV_CHUNK_SIZE:
+                execute_values(cr, "INSERT INTO ibpt_import VALUES %s", rows)
+                rows = []
+        if rows:
+            execute_values(cr, "INSERT INTO ibpt_import VALUES %s", rows)
+
+        params = {"state_id": state.id, "company_id": company.id, "uid": self.env.uid}
+        result = {}
+        for tipo, (object_field, table, condition) in IBPT_CSV_OBJECTS.items():
+            matched = f"""
+                SELECT r.id, i.*
+                  FROM ibpt_import i
+                  JOIN {table} r ON {condition}
+                 WHERE i.tipo = '{tipo}'
+            """
+            cr.execute(
+                f"""
+                UPDATE l10n_br_fiscal_tax_estimate e
+                   SET federal_taxes_national = m.national,
+                       federal_taxes_import = m.imported,
+                       state_taxes = m.state_taxes,
+                       municipal_taxes = m.municipal,
+                       origin = m.origin,
+                       write_uid = %(uid)s,
+                       write_date = now() at time zone 'UTC'
+                  FROM ({matched}) m
+                 WHERE e.{object_field} = m.id
+                   AND e.state_id = %(state_id)s
+                   AND e.company_id = %(company_id)s
+                   AND e.key = m.key
+                """,
+                params,
+            )
+            updated = cr.rowcount
+            cr.execute(
+                f"""
+                INSERT INTO l10n_br_fiscal_tax_estimate (
+                    {object_field}, state_id, company_id,
+                    federal_taxes_national, federal_taxes_import,
+                    state_taxes, municipal_taxes, key, origin,
+                    create_uid, create_date, write_uid, write_date
+                )
+                SELECT m.id, %(state_id)s, %(company_id)s,
+                       m.national, m.imported, m.state_taxes, m.municipal,
+                       m.key, m.origin,
+                       %(uid)s, now() at time zone 'UTC',
+                       %(uid)s, now() at time zone 'UTC'
+                  FROM ({matched}) m
+                 WHERE NOT EXISTS (
+                       SELECT 1 FROM l10n_br_fiscal_tax_estimate e
+                        WHERE e.{object_field} = m.id
+                          AND e.state_id = %(state_id)s
+                          AND e.company_id = %(company_id)s
+                          AND e.key = m.key
+                 )
+                """,
+                params,
+            )
+            result[self._fields[object_field].comodel_name] = updated + cr.rowcount
+            cr.execute(f"SELECT DISTINCT id FROM ({matched}) m")
+            record_ids = [record_id for (record_id,) in cr.fetchall()]
+            self._refresh_estimate_snapshot(company.id, object_field, record_ids)
+            cr.execute(
+                f"""
+                UPDATE {table} r
+                   SET estimate_tax_national = s.estimate_tax_national,
+                       estimate_tax_imported = s.estimate_tax_imported
+                  FROM {TAX_ESTIMATE_SNAPSHOT_TABLE} s
+                 WHERE s.company_id = %(company_id)s
+                   AND s.{object_field} = r.id
+                   AND r.id IN %(ids)s
+                """,
+                dict(params, ids=tuple(record_ids) or (0,)),
+            )
+        cr.execute("DROP TABLE ibpt_import")
+
+        self.invalidate_cache()
+        for model in result:
+            self.env[model].invalidate_cache(
+                ["tax_estimate_ids", "estimate_tax_national", "estimate_tax_imported"]
+            )
+        _logger.info(
+            "IBPT table of %s imported for %s: %s", state.code, company.name, result
+        )
+        return result
+
+    @api.model
+    def _scheduled_import_ibpt_csv(self):
+        """Import the IBPT CSV tables found in the ibpt_csv_path directory
+        (TabelaIBPTax<UF>*.csv) for the companies of each state"""
+        path = odooconfig.get("ibpt_csv_path") or self.env[
+            "ir.config_parameter"
+        ].sudo().get_param("ibpt_csv_path")
+        if not path or not os.path.isdir(path):
+            _logger.warning(_("IBPT CSV directory %s not found."), path)
+            return
+
+        for filename in sorted(os.listdir(path)):
+            state = self._get_ibpt_csv_state(filename)
+            if not state:
+                continue
+            companies = self.env["res.company"].search([("state_id", "=", state.id)])
+            for company in companies:
+                with open(os.path.join(path, filename), "rb") as file:
+                    self.import_ibpt_csv(file, state, company)
+
+    @api.model
+    def _get_ibpt_csv_state(self, filename):
+        match = IBPT_CSV_FILENAME.search(filename or "")
+        if not match or not filename.lower().endswith(".csv"):
+            return self.env["res.country.state"]
+        return self.env["res.country.state"].search(
+            [
+                ("country_id", "=", self.env.ref("base.br").id),
+                ("code", "=", match.group(1).upper()),
+            ],
+            limit=1,
+        )
@@ -2,6 +2,9 @@
 
 from . import (
     test_cnae,
+    test_company_revenue,
+    test_document_serie,
+    test_fiscal_benchmark,
     test_fiscal_document_generic,
     test_fiscal_document_nfse,
     test_fiscal_tax,
@@ -10,6 +13,7 @@ from . import (
     test_ibpt_service,
     test_icms_regulation,
     test_ncm,
+    test_operation_line,
     test_partner_profile,
     test_service_type,
     test_subsequent_operation,
@@ -0,0 +1,105 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import fields
+from odoo.tests import SavepointCase
+
+from ..constants.fiscal import SITUACAO_EDOC_AUTORIZADA
+from ..models.res_company import COMPANY_REVENUE_TABLE
+
+
+class TestCompanyRevenue(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref("l10n_br_base.empresa_simples_nacional")
+        cls.today = fields.Date.context_today(cls.company)
+
+    def test_rbt12(self):
+        rbt12 = self.company._get_rbt12()
+        self.company._add_fiscal_revenue(self.today - relativedelta(months=2), 1000)
+        self.company._add_fiscal_revenue(self.today - relativedelta(months=2), 500)
+        # The current month and the months before the last 12 are not counted
+        self.company._add_fiscal_revenue(self.today, 700)
+        self.company._add_fiscal_revenue(self.today - relativedelta(months=13), 900)
+        self.assertEqual(self.company._get_rbt12(), rbt12 + 1500)
+        self.assertEqual(
+            self.company._get_rbt12(self.today + relativedelta(months=1)),
+            rbt12 + 2200,
+        )
+
+    def test_annual_revenue_auto(self):
+        self.company._add_fiscal_revenue(
+            self.today - relativedelta(months=1), 1200000.0
+        )
+        self.company.annual_revenue_auto = True
+        annual_revenue = self.company._get_rbt12()
+        self.assertEqual(self.company.annual_revenue, annual_revenue)
+
+        # The simplified tax range follows the revenue band
+        tax_range = self.env["l10n_br_fiscal.simplified.tax.range"].search(
+            [
+                ("simplified_tax_id", "=", self.company.simplified_tax_id.id),
+                ("inital_revenue", "<=", annual_revenue),
+                ("final_revenue", ">=", annual_revenue),
+            ],
+            limit=1,
+        )
+        self.assertEqual(self.company.simplified_tax_range_id, tax_range)
+
+        self.company._add_fiscal_revenue(
+            self.today - relativedelta(months=3), 2000000.0
+        )
+        # The annual revenue is refreshed once the transaction is committed
+        self.assertEqual(self.company.annual_revenue, annual_revenue)
+        self.assertIn(
+            self.company.id, self.env.cr.postcommit.data[COMPANY_REVENUE_TABLE]
+        )
+        self.company._refresh_annual_revenue()
+        self.assertEqual(self.company.annual_revenue, annual_revenue + 2000000.0)
+        self.assertNotEqual(self.company.simplified_tax_range_id, tax_range)
+
+    def test_simplified_tax_ranges_cache(self):
+        simplified_tax = self.company.simplified_tax_id
+        simplified_tax_model = self.env["l10n_br_fiscal.simplified.tax"]
+        args = (simplified_tax.cnae_ids[:1].id, simplified_tax.coefficient_r)
+        ranges = simplified_tax_model._get_simplified_tax_ranges(*args)[1]
+        tax_range = self.env["l10n_br_fiscal.simplified.tax.range"].browse(ranges[0][0])
+        # The cached ranges follow the changes of the revenue bands
+        tax_range.final_revenue += 1
+        self.assertIn(
+            (tax_range.id, tax_range.inital_revenue, tax_range.final_revenue),
+            simplified_tax_model._get_simplified_tax_ranges(*args)[1],
+        )
+
+    def test_authorize_document_fiscal_user(self):
+        document = self.env.ref("l10n_br_fiscal.demo_nfe_same_state")
+        company = document.company_id
+        company.annual_revenue_auto = True
+        document.document_date = fields.Datetime.now() - relativedelta(months=1)
+        user = self.env["res.users"].create(
+            {
+                "name": "Fiscal User",
+                "login": "fiscal_revenue_user",
+                "company_id": company.id,
+                "company_ids": [(6, 0, company.ids)],
+                "groups_id": [
+                    (
+                        6,
+                        0,
+                        [
+                            self.env.ref("base.group_user").id,
+                            self.env.ref("l10n_br_fiscal.group_user").id,
+                        ],
+                    )
+                ],
+            }
+        )
+        rbt12 = company._get_rbt12()
+        document.with_user(user).write({"state_edoc": SITUACAO_EDOC_AUTORIZADA})
+        self.assertEqual(company._get_rbt12(), rbt12 + document.amount_untaxed)
+        self.assertIn(company.id, self.env.cr.postcommit.data[COMPANY_REVENUE_TABLE])
+
+        company.with_user(user)._refresh_annual_revenue()
+        self.assertEqual(company.annual_revenue, rbt12 + document.amount_untaxed)
@@ -0,0 +1,52 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests import SavepointCase
+
+from ..constants.fiscal import DOCUMENT_ISSUER_COMPANY
+
+
+class TestDocumentSerie(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref("l10n_br_base.empresa_lucro_presumido")
+        cls.document_type = cls.env.ref("l10n_br_fiscal.document_55")
+        cls.serie = cls.env["l10n_br_fiscal.document.serie"].create(
+            {
+                "code": "900",
+                "name": "Serie 900",
+                "document_type_id": cls.document_type.id,
+                "company_id": cls.company.id,
+            }
+        )
+        cls.env["l10n_br_fiscal.invalidate.number"].create(
+            {
+                "company_id": cls.company.id,
+                "document_type_id": cls.document_type.id,
+                "document_serie_id": cls.serie.id,
+                "number_start": 3,
+                "number_end": 5,
+                "justification": "Invalidated numbers for tests",
+                "state": "done",
+            }
+        )
+        cls.env["l10n_br_fiscal.document"].create(
+            {
+                "company_id": cls.company.id,
+                "document_type_id": cls.document_type.id,
+                "document_serie_id": cls.serie.id,
+                "issuer": DOCUMENT_ISSUER_COMPANY,
+                "document_number": "7",
+            }
+        )
+
+    def test_is_invalid_number(self):
+        self.assertFalse(self.serie._is_invalid_number("2"))
+        self.assertTrue(self.serie._is_invalid_number("3"))
+        self.assertTrue(self.serie._is_invalid_number("5"))
+        self.assertFalse(self.serie._is_invalid_number("6"))
+
+    def test_reserve_numbers(self):
+        self.assertEqual(self.serie.reserve_numbers(5), ["1", "2", "6", "8", "9"])
+        self.assertEqual(self.serie.next_seq_number(), "10")
+        self.assertEqual(self.serie.sequence_number_next, 11)
@@ -0,0 +1,217 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from odoo import fields
+from odoo.tests import SavepointCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+BENCHMARK_OUTPUT = os.environ.get(
+    "L10N_BR_FISCAL_BENCHMARK_OUTPUT",
+    os.path.join(tempfile.gettempdir(), "l10n_br_fiscal_benchmark.json"),
+)
+
+# Commit of the measured tree, from git unless given in the environment.
+BENCHMARK_COMMIT = os.environ.get("L10N_BR_FISCAL_BENCHMARK_COMMIT")
+
+BENCHMARK_LINES = (1, 50, 500, 2000)
+
+BENCHMARK_SCENARIOS = {
+    "simples_nacional": {
+        "document": "l10n_br_fiscal.demo_nfe_sn_same_state",
+    },
+    "lucro_presumido": {
+        "document": "l10n_br_fiscal.demo_nfe_same_state",
+    },
+    "lucro_real": {
+        "document": "l10n_br_fiscal.demo_nfe_same_state",
+        "profit_calculation": "real",
+    },
+    "icms_st": {
+        "document": "l10n_br_fiscal.demo_nfe_same_state",
+        "icmsst_tax": "l10n_br_fiscal.tax_icmsst_40",
+    },
+    "difal": {
+        "document": "l10n_br_fiscal.demo_nfe_nao_contribuinte",
+    },
+    "imported": {
+        "document": "l10n_br_fiscal.demo_nfe_other_state",
+        "icms_origin": "1",
+    },
+}
+
+
+def _get_benchmark_commit():
+    if BENCHMARK_COMMIT:
+        return BENCHMARK_COMMIT
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@tagged("post_install", "-at_install", "-standard", "fiscal_benchmark")
+class TestFiscalBenchmark(SavepointCase):
+    """Time the fiscal hot path over synthetic NF-e documents.
+
+    Not run by default, use: --test-tags fiscal_benchmark
+    Each step is timed with cold registry caches, then again warm.
+    The results are written as JSON to L10N_BR_FISCAL_BENCHMARK_OUTPUT,
+    with the commit of the tree (L10N_BR_FISCAL_BENCHMARK_COMMIT or git).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = []
+
+    @contextmanager
+    def _measure(self, scenario, lines, step, cache):
+        self.env["base"].flush()
+        if cache == "cold":
+            self.env["base"].clear_caches()
+        queries = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        yield
+        self.env["base"].flush()
+        self.results.append(
+            {
+                "scenario": scenario,
+                "lines": lines,
+                "step": step,
+                "cache": cache,
+                "seconds": round(time.perf_counter() - start, 6),
+                "queries": self.env.cr.sql_log_count - queries,
+            }
+        )
+
+    def _create_document(self, template, line_count):
+        document = template.copy()
+        template_lines = template.fiscal_line_ids
+        vals_list = []
+        for index in range(line_count):
+            line = template_lines[index % len(template_lines)]
+            vals = line.copy_data({"document_id": document.id})[0]
+            vals["quantity"] = 1 + index % 7
+            vals_list.append(vals)
+        document.fiscal_line_ids = self.env["l10n_br_fiscal.document.line"].create(
+            vals_list
+        )
+        return document
+
+    def _run_scenario(self, name, scenario, line_count):
+        template = self.env.ref(scenario["document"])
+        document = self._create_document(template, line_count)
+        lines = document.fiscal_line_ids
+
+        def onchange_product():
+            for line in lines:
+                line._onchange_product_id_fiscal()
+
+        def map_fiscal_taxes():
+            for line in lines:
+                line.fiscal_operation_line_id.map_fiscal_taxes(
+                    company=line.company_id,
+                    partner=line._get_fiscal_partner(),
+                    **line._get_fiscal_mapping_values(),
+                )
+
+        def compute_taxes():
+            for line in lines:
+                line._compute_taxes(line.fiscal_tax_ids)
+
+        steps = (
+            ("_onchange_product_id_fiscal", onchange_product),
+            ("map_fiscal_taxes", map_fiscal_taxes),
+            ("compute_taxes", compute_taxes),
+            ("_compute_amounts", lines._compute_amounts),
+            ("document_compute_amount", document._compute_amount),
+        )
+        for step, run in steps:
+            for cache in ("cold", "warm"):
+                with self._measure(name, line_count, step, cache):
+                    run()
+
+        if scenario.get("icmsst_tax"):
+            self.assertEqual(
+                lines.mapped("icmsst_tax_id"), self.env.ref(scenario["icmsst_tax"])
+            )
+
+    def _create_icmsst_definition(self, template, tax):
+        """Approve an ICMS ST definition of the regulation of the company
+        for the NCMs of the document, so that the mapping reaches it."""
+        company = template.company_id
+        return self.env["l10n_br_fiscal.tax.definition"].create(
+            {
+                "icms_regulation_id": company.icms_regulation_id.id,
+                "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_icmsst").id,
+                "tax_id": tax.id,
+                "state_from_id": company.state_id.id,
+                "state_to_ids": [(6, 0, template.partner_id.state_id.ids)],
+                "ncm_ids": [
+                    (6, 0, template.fiscal_line_ids.mapped("product_id.ncm_id").ids)
+                ],
+                "is_taxed": True,
+                "is_debit_credit": True,
+                "custom_tax": True,
+                "state": "approved",
+            }
+        )
+
+    def _set_profit_calculation(self, company, profit_calculation):
+        # apply the default taxes of the regime as the company form does
+        company.profit_calculation = profit_calculation
+        company._onchange_profit_calculation()
+
+    def test_fiscal_benchmark(self):
+        for name, scenario in BENCHMARK_SCENARIOS.items():
+            template = self.env.ref(scenario["document"])
+            company = template.company_id
+            products = template.fiscal_line_ids.mapped("product_id")
+            profit_calculation = company.profit_calculation
+            icms_origins = {p: p.icms_origin for p in products}
+            if scenario.get("profit_calculation"):
+                self._set_profit_calculation(company, scenario["profit_calculation"])
+            if scenario.get("icms_origin"):
+                products.write({"icms_origin": scenario["icms_origin"]})
+            icmsst_definition = self.env["l10n_br_fiscal.tax.definition"]
+            if scenario.get("icmsst_tax"):
+                icmsst_definition = self._create_icmsst_definition(
+                    template, self.env.ref(scenario["icmsst_tax"])
+                )
+            try:
+                for line_count in BENCHMARK_LINES:
+                    self._run_scenario(name, scenario, line_count)
+            finally:
+                if scenario.get("profit_calculation"):
+                    self._set_profit_calculation(company, profit_calculation)
+                for product, icms_origin in icms_origins.items():
+                    product.icms_origin = icms_origin
+                icmsst_definition.write({"state": "expired"})
+
+        with open(BENCHMARK_OUTPUT, "w") as output:
+            json.dump(
+                {
+                    "date": fields.Datetime.to_string(fields.Datetime.now()),
+                    "commit": _get_benchmark_commit(),
+                    "results": self.results,
+                },
+                output,
+                indent=2,
+            )
+        _logger.info("Fiscal benchmark results written to %s", BENCHMARK_OUTPUT)
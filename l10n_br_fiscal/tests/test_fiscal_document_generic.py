@@ -1058,6 +1058,44 @@ class TestFiscalDocumentGeneric(SavepointCase):
             # correct
         )
 
+    def test_comment_template_cache(self):
+        comment = self.env["l10n_br_fiscal.comment"].create(
+            {
+                "name": "Test",
+                "comment": "Doc ${doc.name}",
+                "object": "l10n_br_fiscal.document.mixin",
+            }
+        )
+        vals = {"doc": self.nfe_same_state}
+        self.assertEqual(
+            comment.compute_message(vals), f"Doc {self.nfe_same_state.name}"
+        )
+        # Changing the comment compiles it again
+        comment.comment = "Total ${format_amount(10)}"
+        self.assertEqual(
+            comment.compute_message_multi(
+                [(comment, vals, "manual"), (comment, vals, None)]
+            ),
+            [
+                "manual - Total R$\N{NO-BREAK SPACE}10,00",
+                "Total R$\N{NO-BREAK SPACE}10,00",
+            ],
+        )
+
+    def test_operation_dashboard_counters(self):
+        self.nfe_same_state.action_document_confirm()
+        operations = self.env["l10n_br_fiscal.operation"].search([])
+        counters = operations._get_dashboard_counters()
+        for operation in operations:
+            self.assertEqual(
+                counters[operation.id],
+                {
+                    "number_2confirm": operation._get_number_2confirm_documents(),
+                    "number_authorized": operation._get_authorized_documents(),
+                    "number_cancelled": operation._get_cancelled_documents(),
+                },
+            )
+
     def test_fields_freight_insurance_other_costs(self):
         """Test fields Freight, Insurance and Other Costs when
         defined or By Line or By Total.
@@ -1,10 +1,18 @@
 # Copyright 2020 Akretion - Renato Lima <renato.lima@akretion.com.br>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from unittest import mock
+
 from odoo.tests import SavepointCase
 from odoo.tools import float_compare
 
-from ..constants.fiscal import FINAL_CUSTOMER_NO, FINAL_CUSTOMER_YES
+from ..constants.fiscal import (
+    FINAL_CUSTOMER_NO,
+    FINAL_CUSTOMER_YES,
+    TAX_ENGINE_DOCUMENT,
+    TAX_ENGINE_LINE,
+    TAX_ENGINE_VALIDATE,
+)
 from ..constants.icms import ICMS_ORIGIN_DEFAULT
 
 
@@ -303,3 +311,77 @@ class TestFiscalTax(SavepointCase):
         }
 
         self._check_compute_taxes_result(test_result, compute_result, currency)
+
+    def test_compute_taxes_multi(self):
+        """Document engine must return the same values as compute_taxes"""
+
+        kwargs = self._create_compute_taxes_kwargs()
+        currency = kwargs["company"].currency_id
+
+        fiscal_taxes = (
+            self.env.ref("l10n_br_fiscal.tax_icms_7")
+            + self.env.ref("l10n_br_fiscal.tax_ipi_15")
+            + self.env.ref("l10n_br_fiscal.tax_pis_0_65")
+            + self.env.ref("l10n_br_fiscal.tax_cofins_3")
+        )
+        lines = []
+        for quantity in (1.0, 11.0, 37.0):
+            line_kwargs = dict(kwargs, quantity=quantity, fiscal_quantity=quantity)
+            lines.append((fiscal_taxes, line_kwargs))
+            lines.append(
+                (fiscal_taxes - self.env.ref("l10n_br_fiscal.tax_ipi_15"), line_kwargs)
+            )
+
+        document_results = self.env["l10n_br_fiscal.tax"].compute_taxes_multi(lines)
+
+        self.assertEqual(len(document_results), len(lines))
+        for (taxes, line_kwargs), document_result in zip(lines, document_results):
+            line_result = taxes.compute_taxes(**line_kwargs)
+            test_result = dict(line_result)
+            test_result["taxes"] = {
+                tax_domain: {
+                    field: tax_dict[field]
+                    for field in ("base", "percent_amount", "tax_value")
+                }
+                for tax_domain, tax_dict in line_result["taxes"].items()
+            }
+            self._check_compute_taxes_result(test_result, document_result, currency)
+
+    def test_compute_taxes_multi_engine(self):
+        """The tax engine of the company selects how the lines are computed"""
+
+        document = self.env.ref("l10n_br_fiscal.demo_nfe_same_state")
+        lines = document.fiscal_line_ids
+        company = document.company_id
+        currency = company.currency_id
+        tax_model = type(self.env["l10n_br_fiscal.tax"])
+
+        results = {}
+        for engine in (TAX_ENGINE_LINE, TAX_ENGINE_DOCUMENT, TAX_ENGINE_VALIDATE):
+            company.fiscal_tax_engine = engine
+            with mock.patch.object(
+                tax_model,
+                "compute_taxes_multi",
+                autospec=True,
+                side_effect=tax_model.compute_taxes_multi,
+            ) as compute_taxes_multi, mock.patch(
+                "odoo.addons.l10n_br_fiscal.models."
+                "document_line_mixin_methods._logger"
+            ) as logger:
+                results[engine] = lines._compute_taxes_multi()
+            self.assertEqual(
+                compute_taxes_multi.called, engine != TAX_ENGINE_LINE, engine
+            )
+            # the validation mode logs the differences between the engines
+            logger.warning.assert_not_called()
+
+        for engine in (TAX_ENGINE_DOCUMENT, TAX_ENGINE_VALIDATE):
+            for line_result, result in zip(results[TAX_ENGINE_LINE], results[engine]):
+                test_result = dict(line_result)
+                test_result["taxes"] = {
+                    tax_domain: {
+                        field: tax_dict[field] for field in ("base", "tax_value")
+                    }
+                    for tax_domain, tax_dict in line_result["taxes"].items()
+                }
+                self._check_compute_taxes_result(test_result, result, currency)
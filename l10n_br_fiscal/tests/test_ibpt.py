@@ -1,9 +1,12 @@
 # Copyright 2019 Akretion - Renato Lima <renato.lima@akretion.com.br>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import json
 import logging
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler
 from os import environ
+from urllib.parse import parse_qs, urlparse
 
 from decorator import decorate
 from erpbrasil.base import misc
@@ -40,6 +43,44 @@ def not_every_day_test(method):
     return decorate(method, _not_every_day_test)
 
 
+IBPT_RESPONSE = {
+    "Codigo": "85030010",
+    "UF": "ES",
+    "EX": 0,
+    "Descricao": "Partes de motores/geradores de pot<=75kva",
+    "Nacional": 16.67,
+    "Estadual": 25.0,
+    "Importado": 23.98,
+    "Municipal": 0.0,
+    "Tipo": "0",
+    "VigenciaInicio": "20/05/2023",
+    "VigenciaFim": "30/06/2023",
+    "Chave": "FADD79",
+    "Versao": "23.1.F",
+    "Fonte": "IBPT/empresometro.com.br",
+    "Valor": 0.0,
+    "ValorTributoNacional": 0.0,
+    "ValorTributoEstadual": 0.0,
+    "ValorTributoImportado": 0.0,
+    "ValorTributoMunicipal": 0.0,
+}
+
+
+class IbptRequestHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the IBPT webservice"""
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        body = json.dumps(dict(IBPT_RESPONSE, Codigo=params["codigo"][0]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
 def mocked_requests_get(*args, **kwargs):
     class MockResponse:
         def __init__(self, json_data, status_code):
@@ -53,30 +94,7 @@ def mocked_requests_get(*args, **kwargs):
             return self.json_data
 
     # the same as rates during 2 days:
-    return MockResponse(
-        {
-            "Codigo": "85030010",
-            "UF": "ES",
-            "EX": 0,
-            "Descricao": "Partes de motores/geradores de pot<=75kva",
-            "Nacional": 16.67,
-            "Estadual": 25.0,
-            "Importado": 23.98,
-            "Municipal": 0.0,
-            "Tipo": "0",
-            "VigenciaInicio": "20/05/2023",
-            "VigenciaFim": "30/06/2023",
-            "Chave": "FADD79",
-            "Versao": "23.1.F",
-            "Fonte": "IBPT/empresometro.com.br",
-            "Valor": 0.0,
-            "ValorTributoNacional": 0.0,
-            "ValorTributoEstadual": 0.0,
-            "ValorTributoImportado": 0.0,
-            "ValorTributoMunicipal": 0.0,
-        },
-        200,
-    )
+    return MockResponse(IBPT_RESPONSE, 200)
 
 
 class TestIbpt(SavepointCase):
@@ -1,9 +1,17 @@
 # Copyright 2019 Akretion - Renato Lima <renato.lima@akretion.com.br>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import io
+import threading
+from http.server import HTTPServer
 from unittest import mock
 
-from .test_ibpt import TestIbpt, mocked_requests_get, not_every_day_test
+from .test_ibpt import (
+    IbptRequestHandler,
+    TestIbpt,
+    mocked_requests_get,
+    not_every_day_test,
+)
 
 
 class TestIbptProduct(TestIbpt):
@@ -25,8 +33,9 @@ class TestIbptProduct(TestIbpt):
             name="Product Test 3 - With NCM: 8501.40.29", ncm=cls.ncm_85014029
         )
 
+    @mock.patch("requests.Session.get", side_effect=mocked_requests_get)
     @mock.patch("requests.get", side_effect=mocked_requests_get)
-    def test_mock(self, mock_get):
+    def test_mock(self, mock_get, mock_session_get):
         api_status = self.env.company.ibpt_api
         self.env.company.ibpt_api = True  # force to run the mocked query
         self.ncm_85030010.action_ibpt_inquiry()
@@ -36,6 +45,88 @@ class TestIbptProduct(TestIbpt):
         ncms._scheduled_update()
         self.env.company.ibpt_api = api_status
 
+    def test_ibpt_refresh_local_server(self):
+        """Check the batched IBPT refresh against a local server"""
+        server = HTTPServer(("127.0.0.1", 0), IbptRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.env["ir.config_parameter"].sudo().set_param(
+            "ibpt_api_url", f"http://127.0.0.1:{server.server_port}/api/v1"
+        )
+        ncms = self.ncm_85030010 | self.ncm_85014029
+        try:
+            self.assertTrue(set(ncms.ids) <= set(self.ncm_model._get_ibpt_stale_ids()))
+            created, failed = self.ncm_model._ibpt_refresh(ncms.ids)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual((created, failed), (2, 0))
+        self.assertEqual(self.ncm_85030010.tax_estimate_ids.key, "FADD79")
+        self.assertEqual(self.ncm_85014029.estimate_tax_national, 41.67)
+        self.assertFalse(set(ncms.ids) & set(self.ncm_model._get_ibpt_stale_ids()))
+
+    def test_import_ibpt_csv(self):
+        """Check the IBPT CSV table import"""
+        table = (
+            "codigo;ex;tipo;descricao;nacionalfederal;importadosfederal;"
+            "estadual;municipal;vigenciainicio;vigenciafim;chave;versao;fonte\n"
+            "85030010;;0;Partes;16.67;23.98;25.00;0.00;"
+            "20/05/2023;30/06/2023;FADD79;23.1.F;IBPT\n"
+            "85014029;;0;Motores;13.45;15.00;18.00;0.00;"
+            "20/05/2023;30/06/2023;FADD79;23.1.F;IBPT\n"
+            "0101;;2;Servico LC 116;13.45;15.00;0.00;2.00;"
+            "20/05/2023;30/06/2023;FADD79;23.1.F;IBPT\n"
+        )
+        state = self.env.ref("base.state_br_es")
+        for _i in range(2):
+            result = self.tax_estimate_model.import_ibpt_csv(
+                io.BytesIO(table.encode("latin-1")), state, self.company
+            )
+            self.assertEqual(result["l10n_br_fiscal.ncm"], 2)
+
+        # the second import updates the estimates of the same IBPT key
+        self.assertEqual(
+            self.tax_estimate_model.search_count(
+                [
+                    ("ncm_id", "=", self.ncm_85030010.id),
+                    ("company_id", "=", self.company.id),
+                ]
+            ),
+            1,
+        )
+        self.assertEqual(self.ncm_85030010.estimate_tax_national, 41.67)
+        self.assertEqual(self.ncm_85030010.estimate_tax_imported, 48.98)
+        self.assertEqual(self.ncm_85014029.estimate_tax_national, 31.45)
+
+        # the tax engine reads the estimates snapshot of the company
+        percents = self.tax_estimate_model._get_estimate_percents
+        self.assertEqual(
+            percents(self.company.id, "ncm_id", self.ncm_85030010.id), (41.67, 48.98)
+        )
+        other_company = self.env["res.company"].create({"name": "Other Company"})
+        self.assertEqual(
+            percents(other_company.id, "ncm_id", self.ncm_85030010.id), (0.0, 0.0)
+        )
+        # new estimates only drop the cached percents, keyed by a version
+        cache_version = self.env["l10n_br_fiscal.cache.version"]
+        version = cache_version._get_version(self.tax_estimate_model._name)
+        self.tax_estimate_model.create(
+            {
+                "ncm_id": self.ncm_85030010.id,
+                "state_id": state.id,
+                "company_id": self.company.id,
+                "federal_taxes_national": 10.0,
+                "federal_taxes_import": 20.0,
+                "state_taxes": 5.0,
+            }
+        )
+        self.assertEqual(
+            percents(self.company.id, "ncm_id", self.ncm_85030010.id), (15.0, 25.0)
+        )
+        self.assertNotEqual(
+            cache_version._get_version(self.tax_estimate_model._name), version
+        )
+
     @not_every_day_test
     def test_update_ibpt_product(self):
         """Check tax estimate update"""
@@ -59,6 +59,73 @@ class TestICMSRegulation(SavepointCase):
         )
         self.assertEqual(tax_icms.percent_amount, 12.00)
 
+    def test_icms_regulation_form_view(self):
+        regulation = self.env["l10n_br_fiscal.icms.regulation"]
+        arch = regulation.fields_view_get(view_type="form")["arch"]
+        states = self.env["res.country.state"].search(
+            [("country_id", "=", self.env.ref("base.br").id)]
+        )
+        for state in states:
+            self.assertIn(f'name="uf_{state.code.lower()}"', arch)
+        # The generated arch is reused
+        self.assertIs(regulation.fields_view_get(view_type="form")["arch"], arch)
+
+        # until a state changes
+        states[0].name = "Test State"
+        arch = regulation.fields_view_get(view_type="form")["arch"]
+        self.assertIn('string="Test State"', arch)
+
+    def test_icms_index_matches_domain_search(self):
+        for ind_final in (FINAL_CUSTOMER_YES, FINAL_CUSTOMER_NO):
+            for ncm in (self.ncm_48191000_id, self.ncm_energia_id):
+                tax_icms = self.find_icms_tax(
+                    in_state_id=self.sc_state_id,
+                    out_state_id=self.sc_state_id,
+                    ncm_id=ncm,
+                    ind_final=ind_final,
+                )
+                self.icms_regulation = self.icms_regulation.with_context(
+                    no_tax_definition_index=True
+                )
+                tax_icms_domain = self.find_icms_tax(
+                    in_state_id=self.sc_state_id,
+                    out_state_id=self.sc_state_id,
+                    ncm_id=ncm,
+                    ind_final=ind_final,
+                )
+                self.icms_regulation = self.icms_regulation.with_context(
+                    no_tax_definition_index=False
+                )
+                self.assertEqual(tax_icms, tax_icms_domain)
+
+    def test_icms_index_invalidation(self):
+        tax_icms = self.find_icms_tax(
+            in_state_id=self.sc_state_id,
+            out_state_id=self.sc_state_id,
+            ncm_id=self.ncm_48191000_id,
+            ind_final=FINAL_CUSTOMER_NO,
+        )
+        self.assertEqual(tax_icms.percent_amount, 12.00)
+
+        self.env["l10n_br_fiscal.tax.definition"].create(
+            {
+                "icms_regulation_id": self.icms_regulation.id,
+                "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_icms").id,
+                "tax_id": self.env.ref("l10n_br_fiscal.tax_icms_9").id,
+                "state_from_id": self.sc_state_id.id,
+                "state_to_ids": [(6, 0, self.sc_state_id.ids)],
+                "ncm_ids": [(6, 0, self.ncm_48191000_id.ids)],
+                "state": "approved",
+            }
+        )
+        tax_icms = self.find_icms_tax(
+            in_state_id=self.sc_state_id,
+            out_state_id=self.sc_state_id,
+            ncm_id=self.ncm_48191000_id,
+            ind_final=FINAL_CUSTOMER_NO,
+        )
+        self.assertEqual(tax_icms.percent_amount, 9.00)
+
     def find_icms_tax(self, in_state_id, out_state_id, ncm_id, ind_final):
         self.partner.state_id = in_state_id
         self.company.partner_id.inscr_est = False
@@ -2,9 +2,13 @@
 #   Felipe Motter Pereira <felipe@engenere.one>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+from erpbrasil.base import misc
+
 from odoo.exceptions import AccessError
 from odoo.tests import SavepointCase
 
+from ..hooks import load_fiscal_csv
+
 
 class TestNcm(SavepointCase):
     @classmethod
@@ -46,3 +50,61 @@ class TestNcm(SavepointCase):
     def test_action_unarchive_no_rights(self):
         with self.assertRaises(AccessError):
             self.test_record.with_user(self.test_user).action_unarchive()
+
+    def test_load_fiscal_csv(self):
+        ncm = self.env.ref("l10n_br_fiscal.ncm_73239900")
+        ncm.write({"name": "Changed", "code": "0000.00.01"})
+        load_fiscal_csv(self.env, "demo/l10n_br_fiscal.ncm-demo.csv")
+        self.assertEqual(ncm.code, "7323.99.00")
+        self.assertEqual(ncm.code_unmasked, "73239900")
+        self.assertNotEqual(ncm.name, "Changed")
+        # code_unmasked is computed by the ORM, as for records it creates
+        for record in self.env["l10n_br_fiscal.ncm"].search([]):
+            self.assertEqual(record.code_unmasked, misc.punctuation_rm(record.code))
+        # Loading the same file again changes nothing
+        self.assertEqual(
+            load_fiscal_csv(self.env, "demo/l10n_br_fiscal.ncm-demo.csv"), (0, 0)
+        )
+
+        load_fiscal_csv(self.env, "demo/l10n_br_fiscal.cest-demo.csv")
+        cests = self.env["l10n_br_fiscal.cest"].search([("ncms", "!=", False)])
+        for cest in cests:
+            ncm_ids = cest.ncm_ids
+            cest.action_search_ncms()
+            self.assertEqual(cest.ncm_ids, ncm_ids)
+
+    def test_name_search_code_prefix(self):
+        ncm = self.env.ref("l10n_br_fiscal.ncm_73239900")
+        ncm_model = self.env["l10n_br_fiscal.ncm"]
+        for name in ("7323", "7323.9", "732399"):
+            self.assertIn(ncm.id, [r[0] for r in ncm_model.name_search(name)])
+        self.assertNotIn(ncm.id, [r[0] for r in ncm_model.name_search("3239")])
+
+        # Digit only searches still match the names and the masked codes
+        new_ncm = ncm_model.create(
+            {"code": "7323.99.99", "name": "Test", "tax_ipi_id": ncm.tax_ipi_id.id}
+        )
+        self.assertIn(new_ncm.id, [r[0] for r in ncm_model.name_search("7323.99")])
+        new_ncm.name = "Test 1984"
+        self.assertIn(new_ncm.id, [r[0] for r in ncm_model.name_search("1984")])
+        new_ncm.active = False
+        self.assertNotIn(new_ncm.id, [r[0] for r in ncm_model.name_search("7323.99")])
+
+    def test_name_search_code_prefix_index(self):
+        ncm_model = self.env["l10n_br_fiscal.ncm"]
+        self.env.cr.execute(
+            "SELECT 1 FROM pg_indexes WHERE indexname = %s",
+            (f"{ncm_model._table}_name_trgm_idx",),
+        )
+        if not self.env.cr.fetchone():
+            self.skipTest("The pg_trgm extension is not available")
+        query = ncm_model._name_search("7323.9")
+        query.order = query.limit = None
+        query_str, params = query.select()
+        # without a sequential scan, the plan must use the code prefix index
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+        self.env.cr.execute(f"EXPLAIN {query_str}", params)
+        plan = "\n".join(row[0] for row in self.env.cr.fetchall())
+        self.env.cr.execute("SET LOCAL enable_seqscan = on")
+        self.assertIn(f"{ncm_model._table}_code_unmasked_prefix_idx", plan)
+        self.assertNotIn("Seq Scan", plan)
@@ -0,0 +1,215 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.exceptions import ValidationError
+from odoo.tests import SavepointCase
+
+from .. import tools
+from ..constants.fiscal import FINAL_CUSTOMER_NO, FINAL_CUSTOMER_YES, TAX_DOMAIN_IPI
+
+
+class TestOperationLine(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref("l10n_br_base.empresa_lucro_presumido")
+        cls.partner = cls.env.ref("l10n_br_base.res_partner_cliente5_pe")
+        cls.operation_line = cls.env.ref("l10n_br_fiscal.fo_venda_venda")
+        cls.products = (
+            cls.env.ref("product.product_product_1")
+            | cls.env.ref("product.product_product_12")
+            | cls.env.ref("product.product_product_25")
+        )
+
+    def test_map_fiscal_taxes_multi(self):
+        lines = [
+            {"product": product, "ind_final": ind_final}
+            for product in self.products
+            for ind_final in (FINAL_CUSTOMER_NO, FINAL_CUSTOMER_YES)
+        ]
+        # repeated lines must be mapped once and get the same result
+        lines += lines
+
+        mapping_results = self.operation_line.map_fiscal_taxes_multi(
+            self.company, self.partner, lines
+        )
+
+        self.assertEqual(len(mapping_results), len(lines))
+        for values, mapping_result in zip(lines, mapping_results):
+            expected = self.operation_line.with_context(
+                no_tax_definition_index=True, no_tax_definition_lookup=True
+            ).map_fiscal_taxes(
+                company=self.company,
+                partner=self.partner,
+                product=values["product"],
+                ind_final=values["ind_final"],
+            )
+            self.assertEqual(mapping_result, expected)
+
+        # results are independent copies
+        mapping_results[0]["taxes"].clear()
+        self.assertTrue(mapping_results[len(lines) // 2]["taxes"])
+
+    def test_map_tax_definition_lookup(self):
+        tax_definitions = self.env["l10n_br_fiscal.tax.definition"].search([])
+        keys = [{"product": product} for product in self.products]
+        results = tax_definitions.map_tax_definition_multi(
+            self.company, self.partner, keys
+        )
+        for key, result in zip(keys, results):
+            self.assertEqual(
+                result,
+                tax_definitions.map_tax_definition(
+                    self.company, self.partner, key["product"]
+                ),
+            )
+
+        # The lookup follows the changes of the definitions
+        tax_definition = self.env["l10n_br_fiscal.tax.definition"].create(
+            {
+                "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_ipi").id,
+                "tax_id": self.env.ref("l10n_br_fiscal.tax_ipi_300").id,
+                "product_ids": [(6, 0, self.products[:1].ids)],
+                "state": "approved",
+            }
+        )
+        results = tax_definition.map_tax_definition_multi(
+            self.company, self.partner, keys
+        )
+        self.assertEqual([bool(r) for r in results], [True, False, False])
+        tax_definition.product_ids = self.products[1:2]
+        results = tax_definition.map_tax_definition_multi(
+            self.company, self.partner, keys
+        )
+        self.assertEqual([bool(r) for r in results], [False, True, False])
+
+        # and the changes made from the other side of the relations
+        product = self.products[1].copy()
+        tax_definition.product_ids = product
+        results = tax_definition.map_tax_definition_multi(
+            self.company, self.partner, keys
+        )
+        self.assertEqual([bool(r) for r in results], [False, False, False])
+        product.unlink()
+        results = tax_definition.map_tax_definition_multi(
+            self.company, self.partner, keys
+        )
+        self.assertEqual([bool(r) for r in results], [True, True, True])
+
+    def test_map_fiscal_taxes_cache(self):
+        product = self.env.ref("product.product_product_12")
+        kwargs = {
+            "company": self.company,
+            "partner": self.partner,
+            "product": product,
+            "ind_final": FINAL_CUSTOMER_NO,
+        }
+        self.operation_line.clear_caches()
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        stats = self.operation_line.get_fiscal_mapping_cache_stats()
+        mapping_result = self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            self.operation_line.get_fiscal_mapping_cache_stats()["hit"],
+            stats["hit"] + 1,
+        )
+
+        # Changing a tax definition source invalidates the cache
+        cfop = mapping_result["cfop"]
+        tax_definition = self.env["l10n_br_fiscal.tax.definition"].create(
+            {
+                "cfop_id": cfop.id,
+                "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_ipi").id,
+                "tax_id": self.env.ref("l10n_br_fiscal.tax_ipi_300").id,
+                "state": "approved",
+            }
+        )
+        mapping_result = self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            mapping_result["taxes"][TAX_DOMAIN_IPI],
+            self.env.ref("l10n_br_fiscal.tax_ipi_300"),
+        )
+
+        # Only the changes of the fields used by the mapping invalidate it
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        stats = self.operation_line.get_fiscal_mapping_cache_stats()
+        cfop.write({"small_name": "Test"})
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            self.operation_line.get_fiscal_mapping_cache_stats()["hit"],
+            stats["hit"] + 1,
+        )
+        cfop.write({"destination": cfop.destination})
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            self.operation_line.get_fiscal_mapping_cache_stats()["hit"],
+            stats["hit"] + 1,
+        )
+
+        # and the tax definitions only drop their own caches
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        stats = self.operation_line.get_fiscal_mapping_cache_stats()
+        tax_definition.write({"description": "Test"})
+        self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            self.operation_line.get_fiscal_mapping_cache_stats()["hit"],
+            stats["hit"] + 1,
+        )
+        tax_definition.write({"tax_id": self.env.ref("l10n_br_fiscal.tax_ipi_nt").id})
+        mapping_result = self.operation_line.map_fiscal_taxes(**kwargs)
+        self.assertEqual(
+            self.operation_line.get_fiscal_mapping_cache_stats()["hit"],
+            stats["hit"] + 1,
+        )
+        self.assertEqual(
+            mapping_result["taxes"][TAX_DOMAIN_IPI],
+            self.env.ref("l10n_br_fiscal.tax_ipi_nt"),
+        )
+
+    def test_expand_code_lists(self):
+        tax_definition = self.env["l10n_br_fiscal.tax.definition"].create(
+            {
+                "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_ipi").id,
+                "tax_id": self.env.ref("l10n_br_fiscal.tax_ipi_300").id,
+                "ncms": "7323,8525.80,94052000",
+                "not_in_ncms": "732399",
+                "cests": "21.124.00,2106",
+            }
+        )
+        ncm_domain = tools.domain_field_codes("7323,852580,94052000")
+        ncm_domain += tools.domain_field_codes(
+            "732399", operator1="!=", operator2="not ilike"
+        )
+        self.assertEqual(
+            tax_definition.ncm_ids, self.env["l10n_br_fiscal.ncm"].search(ncm_domain)
+        )
+        self.assertEqual(
+            tax_definition.cest_ids,
+            self.env["l10n_br_fiscal.cest"].search(
+                tools.domain_field_codes("2112400,2106", code_size=7)
+            ),
+        )
+        self.assertFalse(tax_definition.nbm_ids)
+
+        tax_definition.not_in_ncms = False
+        self.assertEqual(
+            tax_definition.ncm_ids,
+            self.env["l10n_br_fiscal.ncm"].search(
+                tools.domain_field_codes("7323,852580,94052000")
+            ),
+        )
+
+    def test_check_duplicate_tax_definitions(self):
+        values = {
+            "cfop_id": self.env.ref("l10n_br_fiscal.cfop_5102").id,
+            "tax_group_id": self.env.ref("l10n_br_fiscal.tax_group_ipi").id,
+            "tax_id": self.env.ref("l10n_br_fiscal.tax_ipi_300").id,
+        }
+        tax_definition = self.env["l10n_br_fiscal.tax.definition"]
+        # Every conflict of the batch is reported at once
+        with self.assertRaises(ValidationError) as error:
+            tax_definition.create([values, values, values])
+        self.assertEqual(len(error.exception.args[0].splitlines()), 7)
+
+        # Another tax of the group is not a duplicate
+        tax_definition.create(
+            [values, dict(values, tax_id=self.env.ref("l10n_br_fiscal.tax_ipi_5").id)]
+        )
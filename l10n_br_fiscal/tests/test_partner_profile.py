@@ -16,3 +16,22 @@ class TestPartnerFiscalProfile(TransactionCase):
             self.env["l10n_br_fiscal.partner.profile"].create(
                 {"code": "TESTE", "default": True, "is_company": True}
             )
+
+    def test_partner_qty(self):
+        profile = self.env["l10n_br_fiscal.partner.profile"].create(
+            {"code": "TESTE", "default": False}
+        )
+        partners = self.env["res.partner"].create(
+            [
+                {"name": "Partner 1", "fiscal_profile_id": profile.id},
+                {"name": "Partner 2", "fiscal_profile_id": profile.id},
+            ]
+        )
+        partners[1].active = False
+        profile.invalidate_cache()
+        self.assertEqual(profile.partner_qty, 2)
+        self.assertEqual(profile.partner_ids, partners)
+        self.assertEqual(
+            profile.action_view_partners()["domain"],
+            [("fiscal_profile_id", "=", profile.id)],
+        )
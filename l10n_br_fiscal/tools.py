@@ -45,6 +45,64 @@ def domain_field_codes(
     return domain
 
 
+def parse_field_codes(field_codes, delimiter=","):
+    """Return the codes of a list like the ones of domain_field_codes."""
+    codes = field_codes.replace(".", "").split(delimiter)
+    return [code.strip() for code in codes if code.strip()]
+
+
+class CodeTrie:
+    """Prefix tree of codes used to resolve many code lists at once.
+
+    A code as long as code_size matches exactly, a shorter one matches
+    every code starting with it (case-insensitive), like the domain of
+    domain_field_codes.
+    """
+
+    def __init__(self, rows=(), code_size=8):
+        self.code_size = code_size
+        self.root = {"ids": set(), "exact": set()}
+        for record_id, code in rows:
+            self.add(code, record_id)
+
+    def add(self, code, record_id):
+        node = self.root
+        node["ids"].add(record_id)
+        for char in code.lower():
+            node = node.setdefault(char, {"ids": set(), "exact": set()})
+            node["ids"].add(record_id)
+        node["exact"].add(record_id)
+
+    def _find(self, code):
+        node = self.root
+        for char in code.lower():
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def all_ids(self):
+        return set(self.root["ids"])
+
+    def match(self, code):
+        """Return the ids matched by one code of a list."""
+        if len(code) > self.code_size:
+            return set()
+        node = self._find(code)
+        if node is None:
+            return set()
+        if len(code) == self.code_size:
+            return set(node["exact"])
+        return set(node["ids"])
+
+    def match_codes(self, field_codes):
+        """Return the ids matched by any code of a comma separated list."""
+        ids = set()
+        for code in parse_field_codes(field_codes):
+            ids |= self.match(code)
+        return ids
+
+
 def path_edoc_company(company_id):
     db_name = company_id._cr.dbname
     filestore = config.filestore(db_name)
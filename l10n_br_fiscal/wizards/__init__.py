@@ -1,2 +1,3 @@
 from . import base_wizard_mixin
 from . import document_status_wizard
+from . import ibpt_import_wizard
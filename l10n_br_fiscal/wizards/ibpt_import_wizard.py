@@ -0,0 +1,49 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import base64
+import io
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+
+class IbptImportWizard(models.TransientModel):
+    _name = "l10n_br_fiscal.ibpt.import.wizard"
+    _description = "Import IBPT Table"
+
+    company_id = fields.Many2one(
+        comodel_name="res.company",
+        required=True,
+        default=lambda self: self.env.company,
+    )
+
+    state_id = fields.Many2one(
+        comodel_name="res.country.state",
+        domain=lambda self: [("country_id", "=", self.env.ref("base.br").id)],
+        help="State of the IBPT table, taken from the file name when empty "
+        "(TabelaIBPTax<UF>...csv).",
+    )
+
+    file = fields.Binary(string="IBPT Table (CSV)", required=True)
+
+    filename = fields.Char()
+
+    @api.onchange("filename")
+    def _onchange_filename(self):
+        state = self.env["l10n_br_fiscal.tax.estimate"]._get_ibpt_csv_state(
+            self.filename
+        )
+        if state:
+            self.state_id = state
+
+    def doit(self):
+        for wizard in self:
+            state = wizard.state_id or wizard.env[
+                "l10n_br_fiscal.tax.estimate"
+            ]._get_ibpt_csv_state(wizard.filename)
+            if not state:
+                raise UserError(_("Inform the state of the IBPT table."))
+            wizard.env["l10n_br_fiscal.tax.estimate"].import_ibpt_csv(
+                io.BytesIO(base64.b64decode(wizard.file)), state, wizard.company_id
+            )
+        return {"type": "ir.actions.act_window_close"}
@@ -34,6 +34,7 @@
         "views/l10n_br_fiscal_menu.xml",
         # Wizards
         "wizards/document_import_wizard_mixin.xml",
+        "wizards/document_import_batch_wizard.xml",
     ],
     "installable": True,
 }
@@ -5,3 +5,4 @@ from . import document_cancel_wizard
 from . import document_correction_wizard
 from . import invalidate_number_wizard
 from . import document_import_wizard_mixin
+from . import document_import_batch_wizard
@@ -0,0 +1,234 @@
+# License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html
+
+import base64
+import io
+import logging
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from xsdata.formats.dataclass.parsers import XmlParser
+except ImportError:
+    _logger.error(_("xsdata Python lib not installed!"))
+
+
+def _parse_xml_file(xml_file):
+    """Parse a (name, content) XML file into its binding.
+
+    Run in the processes of the import pool, so it must stay a
+    module level function without access to the environment.
+    """
+    name, content = xml_file
+    try:
+        return name, XmlParser().from_bytes(content), None
+    except Exception as e:
+        return name, None, str(e) or e.__class__.__name__
+
+
+class DocumentImportBatchWizard(models.TransientModel):
+    _name = "l10n_br_fiscal.document.import.batch.wizard"
+    _description = "Import Fiscal Documents in Batch"
+
+    company_id = fields.Many2one(
+        comodel_name="res.company",
+        string="Company",
+        default=lambda self: self.env.company.id,
+    )
+
+    file = fields.Binary(string="ZIP File")
+
+    file_name = fields.Char()
+
+    chunk_size = fields.Integer(
+        default=50,
+        help="Number of documents imported in each savepoint.",
+    )
+
+    state = fields.Selection(
+        selection=[("draft", "Draft"), ("done", "Done")],
+        default="draft",
+    )
+
+    document_ids = fields.Many2many(
+        comodel_name="l10n_br_fiscal.document",
+        string="Imported Documents",
+    )
+
+    imported_qty = fields.Integer(string="Imported", readonly=True)
+
+    skipped_qty = fields.Integer(
+        string="Already Imported",
+        readonly=True,
+    )
+
+    failed_qty = fields.Integer(string="Failed", readonly=True)
+
+    report = fields.Text(string="Failure Report", readonly=True)
+
+    def action_import(self):
+        self.ensure_one()
+        if not self.file:
+            raise UserError(_("Please select a ZIP file of XML documents."))
+        self._import_files(self._read_zip_files(base64.b64decode(self.file)))
+        return {
+            "name": _("Import Fiscal Documents"),
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_open_documents(self):
+        return {
+            "name": _("Imported Documents"),
+            "type": "ir.actions.act_window",
+            "res_model": "l10n_br_fiscal.document",
+            "view_mode": "tree,form",
+            "domain": [("id", "in", self.document_ids.ids)],
+        }
+
+    @api.model
+    def import_directory(self, path, company=None):
+        """Import the XML files of a directory, for scripts and scheduled
+        actions. Return the wizard holding the import report."""
+        xml_files = []
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(".xml"):
+                with open(os.path.join(path, name), "rb") as xml_file:
+                    xml_files.append((name, xml_file.read()))
+        wizard = self.create({"company_id": (company or self.env.company).id})
+        wizard._import_files(xml_files)
+        return wizard
+
+    @api.model
+    def _read_zip_files(self, zip_data):
+        try:
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as archive:
+                return [
+                    (info.filename, archive.read(info))
+                    for info in archive.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith(".xml")
+                ]
+        except zipfile.BadZipFile as e:
+            raise UserError(_("Invalid ZIP file!")) from e
+
+    @api.model
+    def _parse_files(self, xml_files):
+        """Parse the XML files in a process pool of fiscal_import_max_workers
+        processes (in the current process for small batches)."""
+        max_workers = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("fiscal_import_max_workers", 4)
+        )
+        if max_workers < 2 or len(xml_files) < 2 * max_workers:
+            return [_parse_xml_file(xml_file) for xml_file in xml_files]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    _parse_xml_file,
+                    xml_files,
+                    chunksize=max(1, len(xml_files) // (max_workers * 4)),
+                )
+            )
+
+    def _import_files(self, xml_files):
+        """Parse, dedupe and import the (name, content) XML files."""
+        self.ensure_one()
+        failures = []
+        to_import = {}
+        importer = self.env["l10n_br_fiscal.document.import.wizard.mixin"]
+        contents = dict(xml_files)
+        for name, binding, error in self._parse_files(xml_files):
+            if error:
+                failures.append((name, _("Invalid XML: %s") % error))
+                continue
+            try:
+                wizard_name = importer._detect_binding(binding)[1]
+                document_key = self.env[wizard_name]._document_key_from_binding(binding)
+            except Exception as e:
+                failures.append((name, str(e)))
+                continue
+            if document_key.chave not in to_import:
+                to_import[document_key.chave] = (
+                    name,
+                    contents[name],
+                    binding,
+                    wizard_name,
+                )
+
+        existing_keys = {
+            r["document_key"]
+            for r in self.env["l10n_br_fiscal.document"].search_read(
+                [("document_key", "in", list(to_import))], ["document_key"]
+            )
+        }
+        skipped_qty = len(xml_files) - len(failures) - len(to_import)
+        skipped_qty += len(existing_keys)
+        items = [
+            values for key, values in to_import.items() if key not in existing_keys
+        ]
+
+        documents = self.env["l10n_br_fiscal.document"]
+        chunk_size = max(self.chunk_size, 1)
+        env = self._get_import_env()
+        for index in range(0, len(items), chunk_size):
+            chunk = items[index : index + chunk_size]
+            try:
+                with self.env.cr.savepoint():
+                    chunk_documents = documents.browse()
+                    for item in chunk:
+                        chunk_documents |= self._import_binding(env, *item)
+                documents |= chunk_documents
+            except Exception:
+                # retry the chunk document by document to isolate the failures,
+                # the lookups of the session may hold records rolled back
+                env = self._get_import_env()
+                for item in chunk:
+                    try:
+                        with self.env.cr.savepoint():
+                            documents |= self._import_binding(env, *item)
+                    except Exception as e:
+                        failures.append((item[0], str(e)))
+                        env = self._get_import_env()
+            _logger.info(
+                "Fiscal documents batch import: %s/%s processed",
+                min(index + chunk_size, len(items)),
+                len(items),
+            )
+
+        self.write(
+            {
+                "state": "done",
+                "document_ids": [(6, 0, documents.ids)],
+                "imported_qty": len(documents),
+                "skipped_qty": skipped_qty,
+                "failed_qty": len(failures),
+                "report": "\n".join(f"{name}: {error}" for name, error in failures),
+            }
+        )
+        return documents
+
+    def _get_import_env(self):
+        """Return the environment the documents are built in: they share
+        the record lookups of an import session when they are built from
+        spec bindings."""
+        env = self.with_company(self.company_id).env
+        if "spec.mixin_import" in env:
+            env = env["spec.mixin_import"].with_import_session().env
+        return env
+
+    def _import_binding(self, env, name, content, binding, wizard_name):
+        """Import the document through the wizard of its kind, so that it is
+        checked and built as if its file was imported alone."""
+        wizard = env[wizard_name].create(
+            {"company_id": self.company_id.id, "file": base64.b64encode(content)}
+        )
+        return wizard._import_binding(binding)
@@ -65,6 +65,16 @@ class DocumentImportWizardMixin(models.TransientModel):
     def _fill_wizard_from_binding(self):
         pass  # meant to be overriden
 
+    def _import_binding(self, binding):
+        """
+        Check and build the fiscal document of the wizard file from its
+        already parsed binding, without the wizard preview. Used by the
+        batch import, meant to be overriden.
+        """
+        raise UserError(
+            _("Batch importation not implemented for %s!") % type(binding).__name__
+        )
+
     def action_open_document(self):
         return {
             "name": _("Document Imported"),
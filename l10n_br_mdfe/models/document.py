@@ -825,9 +825,13 @@ class MDFe(spec_models.StackedModel):
 
     def _serialize(self, edocs):
         edocs = super()._serialize(edocs)
-        for record in self.with_context(lang="pt_BR").filtered(
+        records = self.with_context(lang="pt_BR").filtered(
             filtered_processador_edoc_mdfe
-        ):
+        )
+        if records:
+            records._prefetch_binding("mdfe", "30")
+            records.mapped("mdfe30_infMDFeSupl")._prefetch_binding("mdfe", "30")
+        for record in records:
             inf_mdfe = record._build_binding("mdfe", "30")
 
             inf_mdfe_supl = None
@@ -14,7 +14,9 @@ class Cest(models.Model):
 
         if rec_dict.get("code_unmasked"):
             domain = [("code_unmasked", "=", rec_dict.get("code_unmasked"))]
-            match = self.search(domain, limit=1)
+            match = self.env["spec.mixin_import"]._search_import_session(
+                self, "code_unmasked", rec_dict["code_unmasked"], domain, limit=1
+            )
             if match:
                 return match.id
         return False
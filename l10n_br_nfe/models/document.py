@@ -893,11 +893,14 @@ class NFe(spec_models.StackedModel):
 
     def _serialize(self, edocs):
         edocs = super()._serialize(edocs)
-        for record in self.with_context(lang="pt_BR").filtered(
-            filter_processador_edoc_nfe
-        ):
-            record.flush()
-            record.invalidate_cache()
+        records = self.with_context(lang="pt_BR").filtered(filter_processador_edoc_nfe)
+        if records:
+            records.flush()
+            records.invalidate_cache()
+            # read the whole batch at once, then build the bindings from cache
+            records._prefetch_binding("nfe", "40")
+            records.mapped("nfe40_infNFeSupl")._prefetch_binding("nfe", "40")
+        for record in records:
             inf_nfe = record._build_binding("nfe", "40")
 
             inf_nfe_supl = None
@@ -1370,6 +1373,15 @@ class NFe(spec_models.StackedModel):
 
         return document
 
+    def preview_binding_nfe(self, binding, edoc_type="in"):
+        """Return the values and matches an NF-e binding would be imported
+        with, see preview_from_binding."""
+        return (
+            self.env["nfe.40.infnfe"]
+            .with_context(edoc_type=edoc_type)
+            .preview_from_binding("nfe", "40", binding.NFe.infNFe)
+        )
+
     def _document_cancel(self, justificative):
         if self.document_type_id.code in [MODELO_FISCAL_NFE]:
             if not justificative or len(justificative) < 15:
@@ -171,7 +171,9 @@ class MDe(models.Model):
             self.document_id = document_id
 
     def import_document_multi(self):
-        for rec in self.filtered(
+        # the documents imported together share their record lookups
+        session_env = self.env["spec.mixin_import"].with_import_session().env
+        for rec in self.with_env(session_env).filtered(
             lambda m: m.state in (SIT_MANIF_PENDENTE[0], SIT_MANIF_CIENTE[0])
         ):
             rec.import_document()
@@ -11,6 +11,18 @@ class ProductProduct(models.Model):
     _nfe_search_keys = ["default_code", "barcode"]
 
     def match_or_create_m2o(self, rec_dict, parent_dict, model=None):
+        # the same products are often found in many lines of the imported NF-e
+        importer = self.env["spec.mixin_import"]
+        prod_key = tuple(
+            parent_dict.get(k) for k in ("nfe40_cProd", "nfe40_xProd", "nfe40_cEANTrib")
+        )
+        rec_id = importer._get_import_session_record(self, "nfe40_prod", prod_key)
+        if not rec_id:
+            rec_id = self._match_or_create_product(rec_dict, parent_dict)
+            importer._set_import_session_record(self, "nfe40_prod", prod_key, rec_id)
+        return rec_id
+
+    def _match_or_create_product(self, rec_dict, parent_dict):
         domain_name, domain_barcode, domain_default_code = [], [], []
 
         if parent_dict.get("nfe40_xProd") and parent_dict.get("nfe40_cProd"):
@@ -42,6 +54,8 @@ class ProductProduct(models.Model):
         match = self.search(domain, limit=1)
         if match:
             return match.id
+        if self._context.get("spec_import_preview"):
+            return False
 
         if self._context.get("dry_run"):
             rec_id = self.new(rec_dict).id
@@ -16,7 +16,9 @@ class ResCity(models.Model):
 
         if rec_dict.get("ibge_code"):
             domain = [("ibge_code", "=", rec_dict.get("ibge_code"))]
-            match = self.search(domain, limit=1)
+            match = self.env["spec.mixin_import"]._search_import_session(
+                self, "ibge_code", rec_dict["ibge_code"], domain, limit=1
+            )
             if match:
                 return match.id
         return False
@@ -14,7 +14,9 @@ class Country(models.Model):
 
         if rec_dict.get("bc_code"):
             domain = [("bc_code", "=", rec_dict.get("bc_code"))]
-            match = self.search(domain, limit=1)
+            match = self.env["spec.mixin_import"]._search_import_session(
+                self, "bc_code", rec_dict["bc_code"], domain, limit=1
+            )
             if match:
                 return match.id
         return False
@@ -16,7 +16,9 @@ class ResCountryState(models.Model):
 
         if rec_dict.get("code"):
             domain = [("code", "=", rec_dict.get("code")), ("ibge_code", "!=", False)]
-            match = self.search(domain, limit=1)
+            match = self.env["spec.mixin_import"]._search_import_session(
+                self, "code", rec_dict["code"], domain, limit=1
+            )
             if match:
                 return match.id
         return False
@@ -300,15 +300,20 @@ class ResPartner(spec_models.SpecModel):
         if rec_dict.get("nfe40_CNPJ", False):
             rec_dict["cnpj_cpf"] = rec_dict["nfe40_CNPJ"]
 
+        importer = self.env["spec.mixin_import"]
         if rec_dict.get("cnpj_cpf", False):
             domain_cnpj = [
                 "|",
                 ("cnpj_cpf", "=", rec_dict["cnpj_cpf"]),
                 ("cnpj_cpf", "=", cnpj_cpf.formata(rec_dict["cnpj_cpf"])),
             ]
-            match = self.search(domain_cnpj, limit=1)
+            match = importer._search_import_session(
+                self, "cnpj_cpf", rec_dict["cnpj_cpf"], domain_cnpj, limit=1
+            )
             if match:
                 return match.id
+        if self._context.get("spec_import_preview"):
+            return False
 
         vals = self._prepare_import_dict(
             rec_dict, model=model, parent_dict=parent_dict, defaults_model=model
@@ -317,6 +322,10 @@ class ResPartner(spec_models.SpecModel):
             rec_id = self.new(vals).id
         else:
             rec_id = self.with_context(parent_dict=parent_dict).create(vals).id
+        if rec_dict.get("cnpj_cpf", False):
+            importer._set_import_session_record(
+                self, "cnpj_cpf", rec_dict["cnpj_cpf"], rec_id
+            )
         return rec_id
 
     def _export_field(self, xsd_field, class_obj, member_spec, export_value=None):
@@ -13,7 +13,9 @@ class Uom(models.Model):
 
         if rec_dict.get("code"):
             domain = [("code", "=", rec_dict.get("code"))]
-            match = self.search(domain, limit=1)
+            match = self.env["spec.mixin_import"]._search_import_session(
+                self, "code", rec_dict["code"], domain, limit=1
+            )
             if match:
                 return match.id
         return False
@@ -52,6 +52,73 @@ class NFeImportTest(SavepointCase):
         assert isinstance(nfe.id, int)
         self._check_nfe(nfe)
 
+    def test_import_session(self):
+        res_items = (
+            "nfe",
+            "samples",
+            "v4_0",
+            "leiauteNFe",
+            "35180834128745000152550010000474281920007498-nfe.xml",
+        )
+        resource_path = "/".join(res_items)
+        nfe_stream = pkg_resources.resource_stream(nfelib.__name__, resource_path)
+        binding = TnfeProc.from_xml(nfe_stream.read().decode())
+        importer = (
+            self.env["nfe.40.infnfe"]
+            .with_context(tracking_disable=True, edoc_type="in")
+            .with_import_session()
+        )
+        session = importer._context["spec_import_session"]
+        nfe = importer.build_from_binding("nfe", "40", binding.NFe.infNFe, dry_run=True)
+        self._check_nfe(nfe)
+        hits = session.hits
+
+        # the 2nd import of the session reuses the records looked up by the 1st
+        nfe = importer.build_from_binding("nfe", "40", binding.NFe.infNFe, dry_run=True)
+        self._check_nfe(nfe)
+        self.assertGreater(session.hits, hits)
+
+        # dry run records are never matched by a real import
+        nfe = importer.build_from_binding(
+            "nfe", "40", binding.NFe.infNFe, dry_run=False
+        )
+        assert isinstance(nfe.id, int)
+        assert isinstance(nfe.partner_id.id, int)
+        self._check_nfe(nfe)
+
+    def test_import_preview(self):
+        res_items = (
+            "nfe",
+            "samples",
+            "v4_0",
+            "leiauteNFe",
+            "35180834128745000152550010000474281920007498-nfe.xml",
+        )
+        resource_path = "/".join(res_items)
+        nfe_stream = pkg_resources.resource_stream(nfelib.__name__, resource_path)
+        binding = TnfeProc.from_xml(nfe_stream.read().decode())
+        partner_qty = self.env["res.partner"].search_count([])
+
+        values = self.env["l10n_br_fiscal.document"].preview_binding_nfe(binding)
+        self.assertEqual(self.env["res.partner"].search_count([]), partner_qty)
+        self.assertTrue(values["imported_document"])
+        # the supplier is matched by its CNPJ, without creating it
+        partner_match = values["__matches__"]["partner_id"]
+        self.assertEqual(partner_match["values"]["cnpj_cpf"], "34128745000152")
+        self.assertEqual(
+            partner_match["id"],
+            self.env["res.partner"]
+            .search(
+                [("cnpj_cpf", "in", ("34.128.745/0001-52", "34128745000152"))],
+                limit=1,
+            )
+            .id,
+        )
+        self.assertEqual(values["partner_id"], partner_match["id"])
+        # the lines are plain dicts
+        self.assertEqual(len(values["nfe40_det"]), len(binding.NFe.infNFe.det))
+        self.assertIsInstance(values["nfe40_det"][0], dict)
+
     def _check_nfe(self, nfe):
         self.assertEqual(type(nfe)._name, "l10n_br_fiscal.document")
 
@@ -1,12 +1,15 @@
 import base64
+import io
 import os
 import re
+import zipfile
 from unittest.mock import MagicMock, patch
 
 from odoo.exceptions import UserError
 from odoo.tests import SavepointCase
 
 from odoo.addons import l10n_br_nfe
+from odoo.addons.l10n_br_fiscal_edi.wizards import document_import_batch_wizard
 
 from ..wizards.import_document import NfeImport
 
@@ -217,3 +220,92 @@ class NFeImportWizardTest(SavepointCase):
         self.assertEqual(taxes["vICMS"], 100)
         self.assertEqual(taxes["pIPI"], 5)
         self.assertEqual(taxes["vIPI"], 100)
+
+    def test_import_batch(self):
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data, "w") as archive:
+            archive.writestr("nfe.xml", self.xml_1)
+            archive.writestr("copy/nfe.xml", self.xml_1)
+            archive.writestr("dummy.xml", "dummy")
+            archive.writestr("readme.txt", "not imported")
+        wizard = self.env["l10n_br_fiscal.document.import.batch.wizard"].create(
+            {
+                "company_id": self.env.ref("base.main_company").id,
+                "file": base64.b64encode(zip_data.getvalue()),
+                "chunk_size": 1,
+            }
+        )
+        wizard.action_import()
+        self.assertEqual(wizard.imported_qty, 1)
+        self.assertEqual(wizard.skipped_qty, 1)
+        self.assertEqual(wizard.failed_qty, 1)
+        self.assertTrue(wizard.report.startswith("dummy.xml: "))
+        document = wizard.document_ids
+        self.assertEqual(
+            document.document_key,
+            "35200181583054000129550010000000052062777166",
+        )
+        # the document is built by the NF-e import wizard helpers
+        self.assertTrue(
+            self.env["ir.attachment"].search_count(
+                [
+                    ("res_model", "=", "l10n_br_fiscal.document"),
+                    ("res_id", "=", document.id),
+                ]
+            )
+        )
+
+        # the products are matched and get the supplier info of the partner
+        supplier_info = self.env["product.supplierinfo"].search(
+            [
+                ("name", "=", self.env.ref("l10n_br_base.lucro_presumido_partner").id),
+                ("product_code", "=", "E-COM11"),
+            ]
+        )
+        self.assertEqual(
+            supplier_info.product_id, self.env.ref("product.product_product_10")
+        )
+
+        # already imported documents are skipped
+        wizard = self.env["l10n_br_fiscal.document.import.batch.wizard"].create(
+            {"file": base64.b64encode(zip_data.getvalue())}
+        )
+        wizard.action_import()
+        self.assertEqual(wizard.imported_qty, 0)
+        self.assertEqual(wizard.skipped_qty, 2)
+
+    def test_import_batch_process_pool(self):
+        # same NF-e with a NFC-e (model 65) access key
+        xml_nfce = self.xml_1.replace(
+            b"35200181583054000129550010000000052062777166",
+            b"35200181583054000129650010000000052062777169",
+        ).replace(b"<mod>55</mod>", b"<mod>65</mod>")
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data, "w") as archive:
+            archive.writestr("nfe.xml", self.xml_1)
+            archive.writestr("copy/nfe.xml", self.xml_1)
+            archive.writestr("nfce.xml", xml_nfce)
+            archive.writestr("dummy.xml", "dummy")
+        self.env["ir.config_parameter"].sudo().set_param("fiscal_import_max_workers", 2)
+        wizard = self.env["l10n_br_fiscal.document.import.batch.wizard"].create(
+            {
+                "company_id": self.env.ref("base.main_company").id,
+                "file": base64.b64encode(zip_data.getvalue()),
+            }
+        )
+        executor = document_import_batch_wizard.ProcessPoolExecutor
+        with patch.object(
+            document_import_batch_wizard, "ProcessPoolExecutor", wraps=executor
+        ) as pool:
+            wizard.action_import()
+        pool.assert_called_once_with(max_workers=2)
+        self.assertEqual(wizard.imported_qty, 1)
+        self.assertEqual(wizard.skipped_qty, 1)
+        self.assertEqual(wizard.failed_qty, 2)
+        # the NFC-e is rejected by the NF-e import wizard checks
+        self.assertIn("nfce.xml: ", wizard.report)
+        self.assertFalse(
+            self.env["l10n_br_fiscal.document"].search_count(
+                [("document_key", "=", "35200181583054000129650010000000052062777169")]
+            )
+        )
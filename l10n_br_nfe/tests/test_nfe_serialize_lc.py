@@ -26,3 +26,11 @@ class TestNFeExportLC(TestNFeExport):
             diff = self.serialize_xml(nfe_data)
             _logger.info(f"Diff with expected XML (if any): {diff}")
             assert len(diff) == 0
+
+    def test_serialize_batch(self):
+        nfes = self.nfe_list[0]["nfe"] | self.nfe_list[1]["nfe"]
+        # a batch gives the same bindings as the documents one by one
+        edocs = nfes.serialize()
+        self.assertEqual(len(edocs), 2)
+        for nfe, edoc in zip(nfes, edocs):
+            self.assertEqual(edoc, nfe.serialize()[0])
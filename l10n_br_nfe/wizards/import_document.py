@@ -60,20 +60,24 @@ class NfeImport(models.TransientModel):
         self.document_serie = int(document_key.numero_serie)
         self.xml_partner_cpf_cnpj = document_key.cnpj_cpf_emitente
         self.xml_partner_name = infNFe.emit.xFant or infNFe.emit.xNome
-        self.partner_id = self.env["res.partner"].search(
-            [
-                "|",
-                ("cnpj_cpf", "=", infNFe.emit.CNPJ),
-                ("nfe40_xNome", "=", infNFe.emit.xNome),
-            ],
-            limit=1,
-        )
+        self.partner_id = self._find_partner(binding)
         self.nat_op = infNFe.ide.natOp
         self.fiscal_operation_id = self._find_fiscal_operation(
             infNFe.det[0].prod.CFOP, self.nat_op, self.fiscal_operation_type
         )
         self._create_imported_products_by_xml()
 
+    def _find_partner(self, binding):
+        emit = binding.NFe.infNFe.emit
+        return self.env["res.partner"].search(
+            [
+                "|",
+                ("cnpj_cpf", "=", emit.CNPJ),
+                ("nfe40_xNome", "=", emit.xNome),
+            ],
+            limit=1,
+        )
+
     def _parse_file(self):
         binding = super()._parse_file()
         return self._edit_parsed_xml(binding)
@@ -93,8 +97,8 @@ class NfeImport(models.TransientModel):
                 )
             )
 
-    def _create_imported_products_by_xml(self):
-        xml = self._parse_file()
+    def _create_imported_products_by_xml(self, binding=None):
+        xml = binding or self._parse_file()
         product_ids = []
         for product in xml.NFe.infNFe.det:
             product_ids.append(
@@ -205,6 +209,19 @@ class NfeImport(models.TransientModel):
 
     def _create_edoc_from_file(self):
         binding = self._parse_file()
+        edoc = self._create_edoc_from_binding(binding)
+        self._update_imported_products(edoc)
+        return binding, edoc
+
+    def _update_imported_products(self, edoc):
+        """Keep the supplier info of the matched products of inbound NF-e"""
+        if not self.partner_id:
+            self.partner_id = edoc.partner_id
+
+        if self.fiscal_operation_type == "in":
+            self.imported_products_ids._find_or_create_product_supplierinfo()
+
+    def _create_edoc_from_binding(self, binding):
         edoc = self.env["l10n_br_fiscal.document"].import_binding_nfe(
             binding,
             edoc_type=self.fiscal_operation_type,
@@ -213,18 +230,26 @@ class NfeImport(models.TransientModel):
         for line in edoc.fiscal_line_ids:
             line.fiscal_operation_id = self.fiscal_operation_id
 
-        if not self.partner_id:
-            self.partner_id = edoc.partner_id
-
         self._attach_original_nfe_xml_to_document(edoc)
+        return edoc
 
-        if self.fiscal_operation_type == "in":
-            self.imported_products_ids._find_or_create_product_supplierinfo()
-
-        return binding, edoc
+    def _import_binding(self, binding):
+        """Import the binding as the file is, once its products are matched
+        (the matches can't be reviewed by the user)."""
+        infNFe = binding.NFe.infNFe
+        self._check_xml_data(binding)
+        self._set_fiscal_operation_type(binding)
+        self.partner_id = self._find_partner(binding)
+        self.fiscal_operation_id = self._find_fiscal_operation(
+            infNFe.det[0].prod.CFOP, infNFe.ide.natOp, self.fiscal_operation_type
+        )
+        self._create_imported_products_by_xml(binding)
+        edoc = self._create_edoc_from_binding(self._edit_parsed_xml(binding))
+        self._update_imported_products(edoc)
+        return edoc
 
-    def _set_fiscal_operation_type(self):
-        document_key = self._document_key_from_binding(self._parse_file())
+    def _set_fiscal_operation_type(self, binding=None):
+        document_key = self._document_key_from_binding(binding or self._parse_file())
         if document_key.cnpj_cpf_emitente == self.company_id.cnpj_cpf:
             self.fiscal_operation_type = "out"
         else:
@@ -27,12 +27,10 @@ class DocumentLine(models.Model):
             self.fiscal_deductions_value = self.product_id.fiscal_deductions_value
         return result
 
-    def _compute_taxes(self, taxes, cst=None):
-        discount_value = self.discount_value
-        self.discount_value += self.fiscal_deductions_value
-        res = super()._compute_taxes(taxes, cst)
-        self.discount_value = discount_value
-        return res
+    def _get_compute_taxes_kwargs(self):
+        kwargs = super()._get_compute_taxes_kwargs()
+        kwargs["discount_value"] = self.discount_value + self.fiscal_deductions_value
+        return kwargs
 
     @api.model
     def fields_view_get(
@@ -3,11 +3,38 @@
 
 import logging
 import sys
+from collections import namedtuple
+from functools import lru_cache
 
 from odoo import api, fields, models
 
 _logger = logging.getLogger(__name__)
 
+# How a record is exported to a binding class, compiled once per registry
+# for each (Odoo model, spec model, schema version) by _get_export_plan.
+ExportPlan = namedtuple(
+    "ExportPlan",
+    ["binding_class", "binding_attrs", "xsd_fields", "stacking_points", "fields"],
+)
+
+# How a single xsd field is exported: the binding attribute and its
+# dataclass field, the Odoo field used for the type dispatch and its
+# xsd metadata.
+ExportField = namedtuple(
+    "ExportField",
+    ["attr", "spec", "field", "type", "xsd_required", "xsd_type", "choice_required"],
+)
+
+
+@lru_cache(maxsize=None)
+def _float_format(xsd_type):
+    """Return the % format of a float with the precision of its TDec type."""
+    if xsd_type and xsd_type.startswith("TDec"):
+        tdec = "".join(filter(lambda x: x.isdigit(), xsd_type))[-2:]
+    else:
+        tdec = ""
+    return f"%.{tdec}f"
+
 
 class SpecMixinExport(models.AbstractModel):
     _name = "spec.mixin_export"
@@ -42,6 +69,78 @@ class SpecMixinExport(models.AbstractModel):
             spec_classes.append(c)
         return spec_classes
 
+    @api.model
+    def _get_export_plan(self, class_obj):
+        """Return the export plan of this model to the class_obj binding.
+
+        The plans are kept in the registry and keyed by the model classes,
+        so they are compiled again when the modules are updated.
+        """
+        key = (type(self), type(class_obj), self._spec_prefix())
+        plans = getattr(self.pool, "_spec_export_plans", None)
+        if plans is None:
+            plans = self.pool._spec_export_plans = {}
+        plan = plans.get(key)
+        if plan is None:
+            binding_class = self._get_binding_class(class_obj)
+            plan = plans[key] = ExportPlan(
+                binding_class=binding_class,
+                binding_attrs=tuple(binding_class.__dataclass_fields__.keys()),
+                xsd_fields=tuple(
+                    name
+                    for name in class_obj._fields
+                    if name.startswith(f"{self._spec_prefix()}_")
+                    and "_choice" not in name
+                ),
+                stacking_points=self._get_stacking_points(),
+                fields={},
+            )
+        return plan
+
+    @api.model
+    def _get_export_field(self, class_obj, xsd_field):
+        """Return the compiled ExportField of a xsd field, None when the
+        field is not exported to the binding."""
+        plan = self._get_export_plan(class_obj)
+        if xsd_field not in plan.fields:
+            plan.fields[xsd_field] = self._compile_export_field(
+                plan, class_obj, xsd_field
+            )
+        return plan.fields[xsd_field]
+
+    @api.model
+    def _compile_export_field(self, plan, class_obj, xsd_field):
+        if (not self._fields.get(xsd_field)) and xsd_field not in plan.stacking_points:
+            return None
+        binding_class_spec = plan.binding_class.__dataclass_fields__
+        field_spec_name = xsd_field.split("_")[1]  # remove schema prefix
+        field_spec = False
+        for fname, fspec in binding_class_spec.items():
+            if fspec.metadata.get("name", {}) == field_spec_name:
+                field_spec_name = fname
+            if field_spec_name == fname:
+                field_spec = fspec
+        if field_spec and not field_spec.init:
+            # case of xsd fixed values, we should not try to write them
+            return None
+
+        if not binding_class_spec.get(field_spec_name):
+            # this can happen with a o2m generated foreign key for instance
+            return None
+
+        field = class_obj._fields.get(xsd_field, plan.stacking_points.get(xsd_field))
+        return ExportField(
+            attr=field_spec_name,
+            spec=binding_class_spec[field_spec_name],
+            field=field,
+            type=field.type
+            if field.type == "many2one"
+            else self._fields[xsd_field].type,
+            xsd_required=getattr(field, "xsd_required", None),
+            xsd_type=getattr(field, "xsd_type", None),
+            choice_required=hasattr(field, "xsd_choice_required"),
+        )
+
     def _export_fields(self, xsd_fields, class_obj, export_dict):
         """
         Iterate over the record fields and map them in an dict of values
@@ -56,8 +155,7 @@ class SpecMixinExport(models.AbstractModel):
         field export.
         """
         self.ensure_one()
-        binding_class = self._get_binding_class(class_obj)
-        binding_class_spec = binding_class.__dataclass_fields__
+        stacking_points = self._get_export_plan(class_obj).stacking_points
 
         class_name = class_obj._name.replace(".", "_")
         export_method_name = "_export_fields_%s" % class_name
@@ -69,36 +167,23 @@ class SpecMixinExport(models.AbstractModel):
         for xsd_field in xsd_fields:
             if not xsd_field:
                 continue
-            if (
-                not self._fields.get(xsd_field)
-            ) and xsd_field not in self._get_stacking_points().keys():
+            export_field = self._get_export_field(class_obj, xsd_field)
+            if not export_field:
                 continue
-            field_spec_name = xsd_field.split("_")[1]  # remove schema prefix
-            field_spec = False
-            for fname, fspec in binding_class_spec.items():
-                if fspec.metadata.get("name", {}) == field_spec_name:
-                    field_spec_name = fname
-                if field_spec_name == fname:
-                    field_spec = fspec
-            if field_spec and not field_spec.init:
-                # case of xsd fixed values, we should not try to write them
-                continue
-
-            if not binding_class_spec.get(field_spec_name):
-                # this can happen with a o2m generated foreign key for instance
-                continue
-            field_spec = binding_class_spec[field_spec_name]
             field_data = self._export_field(
-                xsd_field, class_obj, field_spec, export_dict.get(field_spec_name)
+                xsd_field,
+                class_obj,
+                export_field.spec,
+                export_dict.get(export_field.attr),
             )
-            if xsd_field in self._get_stacking_points().keys():
+            if xsd_field in stacking_points:
                 if not field_data:
                     # stacked nested tags are skipped if empty
                     continue
             elif not self[xsd_field] and not field_data:
                 continue
 
-            export_dict[field_spec_name] = field_data
+            export_dict[export_field.attr] = field_data
 
     def _export_field(self, xsd_field, class_obj, field_spec, export_value=None):
         """
@@ -107,34 +192,31 @@ class SpecMixinExport(models.AbstractModel):
         """
         self.ensure_one()
         # TODO: Export number required fields with Zero.
-        field = class_obj._fields.get(
-            xsd_field, self._get_stacking_points().get(xsd_field)
-        )
-        xsd_required = field.xsd_required if hasattr(field, "xsd_required") else None
-        xsd_type = field.xsd_type if hasattr(field, "xsd_type") else None
-        if field.type == "many2one":
-            if (not self._get_stacking_points().get(xsd_field)) and (
+        export_field = self._get_export_field(class_obj, xsd_field)
+        field = export_field.field
+        xsd_required = export_field.xsd_required
+        if export_field.type == "many2one":
+            if (xsd_field not in self._get_export_plan(class_obj).stacking_points) and (
                 not self[xsd_field] and not xsd_required
             ):
                 if field.comodel_name not in self._get_spec_classes():
                     return False
-            if hasattr(field, "xsd_choice_required"):
+            if export_field.choice_required:
                 xsd_required = True
             return self._export_many2one(xsd_field, xsd_required, class_obj)
-        elif self._fields[xsd_field].type == "one2many":
+        elif export_field.type == "one2many":
             return self._export_one2many(xsd_field, class_obj)
-        elif self._fields[xsd_field].type == "datetime" and self[xsd_field]:
+        elif export_field.type == "datetime" and self[xsd_field]:
             return self._export_datetime(xsd_field)
-        elif self._fields[xsd_field].type == "date" and self[xsd_field]:
+        elif export_field.type == "date" and self[xsd_field]:
             return self._export_date(xsd_field)
         elif (
-            self._fields[xsd_field].type in ("float", "monetary")
-            and self[xsd_field] is not False
+            export_field.type in ("float", "monetary") and self[xsd_field] is not False
         ):
-            if hasattr(field, "xsd_choice_required"):
+            if export_field.choice_required:
                 xsd_required = True
             return self._export_float_monetary(
-                xsd_field, xsd_type, class_obj, xsd_required, export_value
+                xsd_field, export_field.xsd_type, class_obj, xsd_required, export_value
             )
         elif isinstance(self[xsd_field], str):
             return self[xsd_field].strip()
@@ -170,12 +252,7 @@ class SpecMixinExport(models.AbstractModel):
         # TODO check xsd_required for all fields to export?
         if not field_data and not xsd_required:
             return False
-        if xsd_type and xsd_type.startswith("TDec"):
-            tdec = "".join(filter(lambda x: x.isdigit(), xsd_type))[-2:]
-        else:
-            tdec = ""
-        my_format = f"%.{tdec}f"
-        return str(my_format % field_data)
+        return str(_float_format(xsd_type) % field_data)
 
     def _export_date(self, field_name):
         self.ensure_one()
@@ -207,20 +284,62 @@ class SpecMixinExport(models.AbstractModel):
             class_name = self._get_spec_property("stacking_mixin", self._name)
 
         class_obj = self.env[class_name]
-
-        xsd_fields = (
-            i
-            for i in class_obj._fields
-            if class_obj._fields[i].name.startswith(f"{self._spec_prefix()}_")
-            and "_choice" not in class_obj._fields[i].name
-        )
+        plan = self._get_export_plan(class_obj)
 
         kwargs = {}
-        binding_class = self._get_binding_class(class_obj)
-        self._export_fields(xsd_fields, class_obj, export_dict=kwargs)
+        self._export_fields(list(plan.xsd_fields), class_obj, export_dict=kwargs)
         sliced_kwargs = {
-            key: kwargs.get(key)
-            for key in binding_class.__dataclass_fields__.keys()
-            if kwargs.get(key)
+            key: kwargs.get(key) for key in plan.binding_attrs if kwargs.get(key)
         }
-        return binding_class(**sliced_kwargs)
+        return plan.binding_class(**sliced_kwargs)
+
+    def _prefetch_binding(self, spec_schema=None, spec_version=None, class_name=None):
+        """
+        Read in batch the stored values exported by _build_binding for all
+        the records and, walking the export plans, for all their m2o and o2m
+        sub-records, so that the bindings can then be built record by record
+        from the cache.
+        """
+        if spec_schema and spec_version:
+            self = self.with_context(spec_schema=spec_schema, spec_version=spec_version)
+            self.env[f"spec.mixin.{spec_schema}"]._register_hook()
+        if not class_name:
+            class_name = self._get_spec_property("stacking_mixin", self._name)
+
+        done = {}
+        todo = [(self, class_name)]
+        while todo:
+            records, class_name = todo.pop()
+            done_ids = done.setdefault((records._name, class_name), set())
+            records = records.browse(
+                [i for i in records._ids if i and i not in done_ids]
+            )
+            if not records:
+                continue
+            done_ids.update(records._ids)
+
+            class_obj = self.env[class_name]
+            plan = records._get_export_plan(class_obj)
+            for xsd_field in plan.xsd_fields:
+                export_field = records._get_export_field(class_obj, xsd_field)
+                if not export_field:
+                    continue
+                if xsd_field in plan.stacking_points:
+                    todo.append((records, export_field.field.comodel_name))
+                elif export_field.type == "many2one":
+                    comodel_name = export_field.field.comodel_name
+                    todo.append((records.mapped(xsd_field), comodel_name))
+                    # empty m2o are exported from the record itself
+                    todo.append(
+                        (
+                            records.filtered(lambda r, f=xsd_field: not r[f]),
+                            comodel_name,
+                        )
+                    )
+                elif export_field.type == "one2many":
+                    todo.append(
+                        (records.mapped(xsd_field), export_field.field.comodel_name)
+                    )
+                elif records._fields[xsd_field].store:
+                    records.mapped(xsd_field)
+        return self
@@ -5,6 +5,7 @@ import dataclasses
 import inspect
 import logging
 import re
+from collections.abc import Hashable
 from datetime import datetime
 from enum import Enum
 from typing import ForwardRef
@@ -16,6 +17,23 @@ _logger = logging.getLogger(__name__)
 
 tz_datetime = re.compile(r".*[-+]0[0-9]:00$")
 
+# key of the m2o match results in the values built by preview_from_binding
+PREVIEW_MATCHES_KEY = "__matches__"
+
+
+class ImportSession:
+    """
+    Lookup cache shared by the build_from_binding calls of an import:
+    the ids of the records matched or created, by (model, key, value).
+    It is bound to the cursor of the transaction it was started in.
+    """
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.records = {}
+        self.hits = 0
+        self.misses = 0
+
 
 class SpecMixinImport(models.AbstractModel):
     _name = "spec.mixin_import"
@@ -42,17 +60,93 @@ class SpecMixinImport(models.AbstractModel):
 
         Defaults values and control options are meant to be passed in the context.
         """
+        session = self._get_import_session() or ImportSession(self.env.cr)
         self = self.with_context(
-            spec_schema=spec_schema, spec_version=spec_version, dry_run=dry_run
+            spec_schema=spec_schema,
+            spec_version=spec_version,
+            dry_run=dry_run,
+            spec_import_session=session,
         )
         self._register_hook()
         model = self._get_concrete_model(self._name)
         attrs = model.build_attrs(node)
+        _logger.debug(
+            "import session lookups: %s hits, %s misses", session.hits, session.misses
+        )
+        if self._context.get("spec_import_preview"):
+            return attrs
         if dry_run:
             return model.new(attrs)
         else:
             return model.create(attrs)
 
+    @api.model
+    def preview_from_binding(self, spec_schema, spec_version, node):
+        """
+        Lightweight alternative to a dry_run build: return the nested dict
+        of the values mapped from the binding, without any record, default
+        value or onchange. The m2o match results are in the
+        PREVIEW_MATCHES_KEY dict of each level, as {"id": matched id or
+        False, "values": mapped values} by field, and the o2m values are
+        lists of dicts.
+        """
+        return self.with_context(spec_import_preview=True).build_from_binding(
+            spec_schema, spec_version, node, dry_run=True
+        )
+
+    @api.model
+    def with_import_session(self):
+        """
+        Return self with a new import session in the context: the records
+        matched or created by the build_from_binding calls done with it
+        are looked up only once.
+        """
+        return self.with_context(spec_import_session=ImportSession(self.env.cr))
+
+    @api.model
+    def _get_import_session(self):
+        session = self._context.get("spec_import_session")
+        if session is not None and session.cr is self.env.cr:
+            return session
+        return None
+
+    @api.model
+    def _get_import_session_record(self, model, key, value):
+        """Return the id memoized in the import session for (model, key, value)"""
+        session = self._get_import_session()
+        if session is None or not isinstance(value, Hashable):
+            return False
+        rec_id = session.records.get(
+            (model._name, key, value, bool(self._context.get("dry_run")))
+        )
+        if rec_id:
+            session.hits += 1
+        else:
+            session.misses += 1
+        return rec_id or False
+
+    @api.model
+    def _set_import_session_record(self, model, key, value, rec_id):
+        session = self._get_import_session()
+        if session is not None and rec_id and isinstance(value, Hashable):
+            session.records[
+                (model._name, key, value, bool(self._context.get("dry_run")))
+            ] = rec_id
+
+    @api.model
+    def _search_import_session(self, model, key, value, domain, limit=None):
+        """
+        Search the model records matching domain, unless a record was already
+        matched or created for (model, key, value) in the import session.
+        """
+        rec_id = self._get_import_session_record(model, key, value)
+        if rec_id:
+            return model.browse(rec_id)
+        match = model.search(domain, limit=limit)
+        if match:
+            self._set_import_session_record(model, key, value, match[0].id)
+        return match
+
     @api.model
     def build_attrs(self, node, path="", defaults_model=None):
         """
@@ -62,7 +156,10 @@ class SpecMixinImport(models.AbstractModel):
         vals = {}
         for fname, fspec in node.__dataclass_fields__.items():
             self._build_attr(node, self._fields, vals, path, (fname, fspec))
+        matches = vals.get(PREVIEW_MATCHES_KEY)
         vals = self._prepare_import_dict(vals, defaults_model=defaults_model)
+        if matches:
+            vals.setdefault(PREVIEW_MATCHES_KEY, {}).update(matches)
         return vals
 
     @api.model
@@ -133,7 +230,10 @@ class SpecMixinImport(models.AbstractModel):
                     line_vals = comodel.build_attrs(
                         line, path=child_path, defaults_model=comodel
                     )
-                    lines.append((0, 0, line_vals))
+                    if self._context.get("spec_import_preview"):
+                        lines.append(line_vals)
+                    else:
+                        lines.append((0, 0, line_vals))
                 vals[key] = lines
             else:
                 # m2o
@@ -154,9 +254,21 @@ class SpecMixinImport(models.AbstractModel):
     def _build_many2one(self, comodel, vals, comodel_vals, key, value, path):
         if comodel._name == self._name:
             # stacked m2o
+            matches = comodel_vals.pop(PREVIEW_MATCHES_KEY, None)
             vals.update(comodel_vals)
+            if matches:
+                vals.setdefault(PREVIEW_MATCHES_KEY, {}).update(matches)
         else:
             vals[key] = comodel.match_or_create_m2o(comodel_vals, vals)
+            self._add_preview_match(vals, key, comodel_vals)
+
+    @api.model
+    def _add_preview_match(self, vals, key, rec_dict):
+        if self._context.get("spec_import_preview"):
+            vals.setdefault(PREVIEW_MATCHES_KEY, {})[key] = {
+                "id": vals[key],
+                "values": rec_dict,
+            }
 
     @api.model
     def _extract_related_values(self, vals, key):
@@ -224,8 +336,9 @@ class SpecMixinImport(models.AbstractModel):
                 vals[related_m2o] = comodel.match_or_create_m2o(sub_val, vals)
             else:  # search res.country with Brasil for instance
                 vals[related_m2o] = model.match_or_create_m2o(sub_val, vals, comodel)
+            self._add_preview_match(vals, related_m2o, sub_val)
 
-        if defaults_model is not None:
+        if defaults_model is not None and not self._context.get("spec_import_preview"):
             defaults = defaults_model.with_context(
                 record_dict=vals,
                 parent_dict=parent_dict,
@@ -254,14 +367,7 @@ class SpecMixinImport(models.AbstractModel):
         """
         if model is None:
             model = self
-        default_key = [model._rec_name or "name"]
-        search_keys = "_%s_search_keys" % (self._context["spec_schema"])
-        if hasattr(model, search_keys):
-            keys = getattr(model, search_keys) + default_key
-        else:
-            keys = [model._rec_name or "name"]
-        keys = self._get_aditional_keys(model, rec_dict, keys)
-        for key in keys:
+        for key in self._get_match_keys(model, rec_dict):
             if rec_dict.get(key):
                 # TODO enable to build criteria using parent_dict
                 # such as state_id when searching for a city
@@ -269,7 +375,9 @@ class SpecMixinImport(models.AbstractModel):
                     domain = model._nfe_extra_domain + [(key, "=", rec_dict.get(key))]
                 else:
                     domain = [(key, "=", rec_dict.get(key))]
-                match_ids = model.search(domain)
+                match_ids = self._search_import_session(
+                    model, key, rec_dict[key], domain
+                )
                 if match_ids:
                     if len(match_ids) > 1:
                         _logger.warning(
@@ -279,6 +387,16 @@ class SpecMixinImport(models.AbstractModel):
                     return match_ids[0].id
         return False
 
+    @api.model
+    def _get_match_keys(self, model, rec_dict):
+        default_key = [model._rec_name or "name"]
+        search_keys = "_%s_search_keys" % (self._context["spec_schema"])
+        if hasattr(model, search_keys):
+            keys = getattr(model, search_keys) + default_key
+        else:
+            keys = [model._rec_name or "name"]
+        return self._get_aditional_keys(model, rec_dict, keys)
+
     @api.model
     def _get_aditional_keys(self, model, rec_dict, keys):
         return keys
@@ -297,6 +415,8 @@ class SpecMixinImport(models.AbstractModel):
             rec_id = model.match_record(rec_dict, parent_dict, model)
         else:
             rec_id = self.match_record(rec_dict, parent_dict, model)
+        if not rec_id and self._context.get("spec_import_preview"):
+            return False
         if not rec_id:
             vals = self._prepare_import_dict(
                 rec_dict, model=model, parent_dict=parent_dict, defaults_model=model
@@ -326,4 +446,7 @@ class SpecMixinImport(models.AbstractModel):
                     .create(vals)
                     .id
                 )
+            for key in self._get_match_keys(model, rec_dict):
+                if rec_dict.get(key):
+                    self._set_import_session_record(model, key, rec_dict[key], rec_id)
         return rec_id
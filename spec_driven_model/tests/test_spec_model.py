@@ -188,3 +188,25 @@ class TestSpecModel(SavepointCase, FakeModelLoader):
             imported_po.partner_id.id, self.env.ref("base.res_partner_1").id
         )
         self.assertEqual(imported_po.order_line[0].name, "Some product desc")
+
+    def test_export_plan(self):
+        po = self.env["fake.purchase.order"].create(
+            {
+                "name": "PO XSD",
+                "date_order": "2024-10-08",
+                "partner_id": self.env.ref("base.res_partner_1").id,
+                "dest_address_id": self.env.ref("base.res_partner_1").id,
+            }
+        )
+        po_binding = po._build_binding(spec_schema="poxsd", spec_version="10")
+        po = po.with_context(spec_schema="poxsd", spec_version="10")
+        po_class = self.env["poxsd.10.purchaseordertype"]
+        plan = po._get_export_plan(po_class)
+        self.assertIs(plan.binding_class, type(po_binding))
+        self.assertIn("poxsd10_billTo", plan.fields)
+
+        # the plan is compiled once and the export doesn't change
+        self.assertEqual(
+            po._build_binding(spec_schema="poxsd", spec_version="10"), po_binding
+        )
+        self.assertIs(po._get_export_plan(po_class), plan)